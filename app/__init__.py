@@ -1,41 +1,64 @@
 from flask import Flask
 from app.config import Config
-from app.extensions import db
+from app.extensions import db, cache
+from app.database import configure_database, install_sqlite_pragmas
 from app.routes import posts_bp
 from app.routes.auth import auth_bp
 from app.routes.users import users_bp
+from app.routes.search import search_bp
+from app.routes.notifications import notifications_bp
 from app.models import User
-import re
+from app.commands import stats_cli, search_cli, db_cli, images_cli, assets_cli, content_cli, jobs_cli, data_cli
+from app.services.stats import backfill_missing_stats
+from app.services.user_stats import backfill_missing_user_stats
+from app.services.query_budget import init_query_budget
+from app.services.replicas import init_replicas
+from app.services.current_user import init_current_user
+from app.services.auth import init_proxies
+from app.services.metrics import init_metrics
+from app.services.assets import init_assets
+from app.services.markup import body_html
+from app.services.jobs import init_jobs
+from app.services.search import init_search
+from app.migrations import upgrade
 import os
 from sqlalchemy.exc import IntegrityError, OperationalError
 
-def parse_mentions(text):
-    """Convert @username mentions into profile links."""
-    if not text:
-        return text
-
-    def replace_mention(match):
-        username = match.group(1)
-        # Create a link for each @username (404 if user does not exist)
-        return f'<a href="/users/{username}">@{username}</a>'
-
-    pattern = r'@(\w+)'  # @username: letters, numbers, underscores
-    return re.sub(pattern, replace_mention, text)
-
-
 def create_app():
     app = Flask(__name__)
     app.config.from_object(Config)
 
+    configure_database(app)
     db.init_app(app)
+    install_sqlite_pragmas(app)
+    cache.init_app(app)
+    init_proxies(app)
+    init_query_budget(app)
+    init_replicas(app)
+    init_current_user(app)
+    init_metrics(app)
+    init_assets(app)
+    init_jobs(app)
 
-    # Register Jinja2 filter for mentions
-    app.jinja_env.filters['parse_mentions'] = parse_mentions
+    # Register Jinja2 filter for rendered post/comment bodies
+    app.jinja_env.filters['body_html'] = body_html
 
     # Register blueprints
     app.register_blueprint(posts_bp)
     app.register_blueprint(auth_bp)
     app.register_blueprint(users_bp)
+    app.register_blueprint(search_bp)
+    app.register_blueprint(notifications_bp)
+
+    # Register CLI commands
+    app.cli.add_command(stats_cli)
+    app.cli.add_command(search_cli)
+    app.cli.add_command(db_cli)
+    app.cli.add_command(images_cli)
+    app.cli.add_command(assets_cli)
+    app.cli.add_command(content_cli)
+    app.cli.add_command(jobs_cli)
+    app.cli.add_command(data_cli)
 
     with app.app_context():
         # create_all can race when multiple gunicorn workers start at once
@@ -52,6 +75,16 @@ def create_app():
                 # Unexpected DB error — re-raise
                 raise
 
+        # Bring databases created by older versions up to the current schema
+        upgrade()
+
+        # Full-text search table and sync triggers
+        try:
+            init_search()
+        except OperationalError as e:
+            if 'already exists' not in str(e).lower():
+                raise
+
         # Create admin user if not exists (safe for concurrent worker boot)
         admin = User.query.filter_by(login='admin').first()
         if not admin:
@@ -72,6 +105,13 @@ def create_app():
                 # Roll back and continue without failing the app startup.
                 db.session.rollback()
 
+        # Posts and users created before the stats tables existed have no counters yet
+        try:
+            backfill_missing_stats()
+            backfill_missing_user_stats()
+        except IntegrityError:
+            db.session.rollback()
+
     return app
 
 app = create_app()
\ No newline at end of file
@@ -0,0 +1,82 @@
+"""ASGI serving mode.
+
+    uvicorn app.asgi:asgi_app --workers 4 --host 0.0.0.0 --port 80
+
+Flask and the SQLAlchemy session stay synchronous: each request runs on
+one of ASGI_THREADS threads of the worker process (a2wsgi), so the read
+views of a worker (front page, posts, hashtags, profiles) run
+concurrently while SQLite serves them from WAL snapshots. The request
+body is read by the event loop before a thread is taken, so a slow
+upload or a client that never finishes sending costs a coroutine instead
+of a thread, or a whole process as with the sync gunicorn workers.
+Responses are handed to the event loop in chunks, so slow readers do not
+hold a thread for the whole download either.
+"""
+from a2wsgi import WSGIMiddleware
+
+from app import app
+
+
+class BufferedBody:
+    """Reads the whole request body in the event loop, then calls `app`.
+
+    Bodies larger than `max_body` are answered with 413 as soon as they
+    exceed it; a declared Content-Length over the limit goes straight to
+    Flask, which rejects it without reading the body.
+    """
+
+    def __init__(self, app, max_body=None):
+        self.app = app
+        self.max_body = max_body
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or self._declared_too_large(scope):
+            return await self.app(scope, receive, send)
+
+        chunks = []
+        size = 0
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            chunk = message.get('body', b'')
+            size += len(chunk)
+            if self.max_body is not None and size > self.max_body:
+                return await self._too_large(send)
+            chunks.append(chunk)
+            more_body = message.get('more_body', False)
+
+        body = b''.join(chunks)
+        delivered = False
+
+        async def replay():
+            nonlocal delivered
+            if not delivered:
+                delivered = True
+                return {'type': 'http.request', 'body': body, 'more_body': False}
+            return await receive()
+
+        await self.app(scope, replay, send)
+
+    def _declared_too_large(self, scope):
+        if self.max_body is None:
+            return False
+        for name, value in scope['headers']:
+            if name == b'content-length':
+                return value.isdigit() and int(value) > self.max_body
+        return False
+
+    async def _too_large(self, send):
+        await send({
+            'type': 'http.response.start',
+            'status': 413,
+            'headers': [(b'content-type', b'text/plain; charset=utf-8'), (b'connection', b'close')],
+        })
+        await send({'type': 'http.response.body', 'body': b'Request body too large'})
+
+
+asgi_app = BufferedBody(
+    WSGIMiddleware(app, workers=app.config['ASGI_THREADS']),
+    app.config['MAX_CONTENT_LENGTH']
+)
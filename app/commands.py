@@ -0,0 +1,288 @@
+import gzip
+import sys
+import time
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy.orm import selectinload
+
+from app.extensions import db, cache
+from app.models import Post, User
+from app.migrations import MIGRATIONS, applied_versions, upgrade
+from app.services.assets import compress_static
+from app.services.hashtags import find_hashtag_drift, rebuild_hashtag_counts
+from app.services.images import process_post_image
+from app.services.jobs import backlog, retry_failed, run_batch, work
+from app.services.markup import RENDER_VERSION, rerender
+from app.services.query_plans import check_query_plans
+from app.services.ranking import refresh_ranks
+from app.services.search import fts_available, reindex
+from app.services.stats import find_drift, rebuild_stats
+from app.services.transfer import TransferError, export_ndjson, import_ndjson
+from app.services.user_stats import find_user_drift, rebuild_user_stats
+
+stats_cli = AppGroup('stats', help='Maintain the denormalized post statistics.')
+search_cli = AppGroup('search', help='Maintain the full-text search index.')
+db_cli = AppGroup('db', help='Schema migrations and query plan checks.')
+images_cli = AppGroup('images', help='Post image thumbnails.')
+assets_cli = AppGroup('assets', help='Static file precompression.')
+content_cli = AppGroup('content', help='Stored HTML of posts and comments.')
+jobs_cli = AppGroup('jobs', help='Background job queue.')
+data_cli = AppGroup('data', help='NDJSON export and import of users, posts and comments.')
+
+
+def _describe(stats):
+    if stats is None:
+        return 'missing'
+    return (
+        f'plus={stats.plus_count} minus={stats.minus_count} '
+        f'comments={stats.comment_count} score={stats.score}'
+    )
+
+
+def _describe_user(stats):
+    if stats is None:
+        return 'missing'
+    return (
+        f'posts={stats.post_count} comments={stats.comment_count} '
+        f'plus_received={stats.plus_received} minus_received={stats.minus_received}'
+    )
+
+
+def _report_drift(drift, hashtag_drift, user_drift):
+    for post_id, stored, expected in drift:
+        click.echo(f'post {post_id}: stored [{_describe(stored)}], expected [{_describe(expected)}]')
+    for tag, stored, expected in hashtag_drift:
+        click.echo(f'#{tag.name}: stored post_count={stored}, expected post_count={expected}')
+    for user_id, stored, expected in user_drift:
+        click.echo(f'user {user_id}: stored [{_describe_user(stored)}], expected [{_describe_user(expected)}]')
+
+
+@stats_cli.command('verify')
+def verify_stats():
+    """Recount post stats, hashtag and user counters and report drift."""
+    drift = find_drift()
+    hashtag_drift = find_hashtag_drift()
+    user_drift = find_user_drift()
+    _report_drift(drift, hashtag_drift, user_drift)
+    if drift or hashtag_drift or user_drift:
+        click.echo(
+            f'{len(drift)} post(s), {len(hashtag_drift)} hashtag(s) '
+            f'and {len(user_drift)} user(s) drifted.'
+        )
+        raise SystemExit(1)
+    click.echo('All post stats, hashtag and user counters are up to date.')
+
+
+@stats_cli.command('rebuild')
+def rebuild_stats_command():
+    """Recount post stats, hashtag and user counters and fix any drift."""
+    drift = find_drift()
+    hashtag_drift = find_hashtag_drift()
+    user_drift = find_user_drift()
+    _report_drift(drift, hashtag_drift, user_drift)
+    rebuild_stats(drift)
+    rebuild_hashtag_counts(hashtag_drift)
+    rebuild_user_stats(user_drift)
+    cache.invalidate('feed', 'hashtags', *_drifted_pages(drift, user_drift))
+    click.echo(
+        f'Rebuilt stats for {len(drift)} post(s), {len(hashtag_drift)} hashtag(s) '
+        f'and {len(user_drift)} user(s).'
+    )
+
+
+def _drifted_pages(drift, user_drift):
+    """Cache namespaces of the profiles and hashtag pages showing counters that were fixed."""
+    post_ids = [post_id for post_id, stored, expected in drift]
+    user_ids = {user_id for user_id, stored, expected in user_drift}
+    tag_names = set()
+    for post in Post.query.filter(Post.id.in_(post_ids)).options(selectinload(Post.hashtags)):
+        user_ids.add(post.author_id)
+        tag_names.update(tag.name for tag in post.hashtags)
+    logins = [login for login, in db.session.query(User.login).filter(User.id.in_(user_ids))]
+    return [f'profile:{login}' for login in logins] + [f'hashtag:{name}' for name in tag_names]
+
+
+@stats_cli.command('refresh-ranks')
+@click.option('--all', 'full', is_flag=True, help='Check every post, not only recent and re-tagged ones.')
+def refresh_ranks_command(full):
+    """Update the stored feed scores now (the job workers do it every RANK_REFRESH_INTERVAL)."""
+    click.echo(f'Updated the feed score of {refresh_ranks(full=full)} post(s).')
+
+
+@search_cli.command('reindex')
+@click.option('--batch-size', default=1000, show_default=True, help='Rows written per transaction.')
+def reindex_command(batch_size):
+    """Rebuild the search index from posts and comments in small batches."""
+    if not fts_available():
+        click.echo('Full-text search needs SQLite with FTS5; nothing to index.')
+        return
+
+    def progress(kind, total):
+        click.echo(f'{total} row(s) indexed ({kind}s)')
+
+    total = reindex(batch_size, progress)
+    click.echo(f'Indexed {total} row(s).')
+
+
+@db_cli.command('upgrade')
+def upgrade_command():
+    """Apply pending schema migrations."""
+    applied = upgrade(lambda version, name: click.echo(f'Applied {version}: {name}'))
+    if not applied:
+        click.echo('Schema is up to date.')
+
+
+@db_cli.command('status')
+def status_command():
+    """List schema migrations and whether they are applied."""
+    applied = applied_versions()
+    for version, name, fn in MIGRATIONS:
+        state = 'applied' if version in applied else 'pending'
+        click.echo(f'{version:>4}  {state:<8} {name}')
+
+
+@db_cli.command('check-plans')
+def check_plans_command():
+    """EXPLAIN the hot queries and fail if one scans a table without an index."""
+    if db.engine.dialect.name != 'sqlite':
+        click.echo('Query plan checks are only implemented for SQLite.')
+        return
+
+    failed = False
+    for name, plan, problems in check_query_plans():
+        click.echo(f'{name}:')
+        for line in plan:
+            click.echo(f'    {line}')
+        if problems:
+            failed = True
+            click.echo(f'  FULL SCAN of {", ".join(problems)}')
+    if failed:
+        raise SystemExit(1)
+    click.echo('All hot queries use indexes.')
+
+
+@images_cli.command('thumbnails')
+@click.option('--all', 'redo', is_flag=True, help='Also regenerate existing thumbnails.')
+def thumbnails_command(redo):
+    """Create missing thumbnails, e.g. for images uploaded before they existed."""
+    query = db.session.query(Post.id).filter(Post.image_url.isnot(None))
+    if not redo:
+        query = query.filter(Post.thumbnail_url.is_(None))
+    post_ids = [post_id for post_id, in query.order_by(Post.id)]
+
+    done = 0
+    for post_id in post_ids:
+        namespaces = process_post_image(post_id)
+        if namespaces:
+            db.session.commit()
+            cache.invalidate(*namespaces)
+            done += 1
+        else:
+            click.echo(f'post {post_id}: no thumbnail created')
+    click.echo(f'Created thumbnails for {done} of {len(post_ids)} post(s).')
+
+
+@assets_cli.command('compress')
+@click.option('--force', is_flag=True, help='Rewrite variants that are up to date.')
+def compress_command(force):
+    """Write gzip/brotli copies of the static CSS and JS files."""
+    written = compress_static(current_app.static_folder, force)
+    for path in written:
+        click.echo(path)
+    click.echo(f'Wrote {len(written)} compressed file(s).')
+
+
+@content_cli.command('rerender')
+@click.option('--all', 'everything', is_flag=True,
+              help='Also re-render rows that are up to date, e.g. to link mentions of new users.')
+@click.option('--batch-size', default=500, show_default=True, help='Rows rendered per transaction.')
+def rerender_command(everything, batch_size):
+    """Render post and comment bodies made with older markup rules."""
+    def progress(table, total):
+        click.echo(f'{total} row(s) rendered ({table})')
+
+    total = rerender(batch_size, everything, progress)
+    cache.invalidate('feed', 'hashtags')
+    click.echo(f'Rendered {total} row(s) with version {RENDER_VERSION}.')
+
+
+@jobs_cli.command('work')
+@click.option('--once', is_flag=True, help='Run the due jobs and exit.')
+def work_command(once):
+    """Run background jobs (set JOB_WORKER_THREADS=0 on the web processes)."""
+    if once:
+        total = 0
+        while True:
+            claimed = run_batch()
+            if not claimed:
+                break
+            total += claimed
+        click.echo(f'Ran {total} job(s).')
+        return
+    click.echo('Waiting for jobs (Ctrl+C to stop)...')
+    work(current_app._get_current_object())
+
+
+@jobs_cli.command('status')
+def jobs_status_command():
+    """Show the job backlog."""
+    for name, value in backlog().items():
+        click.echo(f'{name}: {value}')
+
+
+@jobs_cli.command('retry-failed')
+def retry_failed_command():
+    """Queue the jobs that ran out of attempts again."""
+    click.echo(f'Requeued {retry_failed()} job(s).')
+
+
+def _open_dump(path, mode):
+    """Opens an export file; `-` is stdin/stdout and a .gz suffix compresses."""
+    if path == '-':
+        return open(sys.stdout.fileno() if mode == 'w' else sys.stdin.fileno(),
+                    mode, encoding='utf-8', closefd=False)
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+
+def _report_rate(table, rows, seconds):
+    # Progress goes to stderr so that `export -` can be piped
+    click.echo(f'{table}: {rows} row(s), {rows / max(seconds, 1e-9):.0f} rows/s overall', err=True)
+
+
+@data_cli.command('export')
+@click.argument('path', default='-')
+@click.option('--batch-size', default=5000, show_default=True, help='Rows read per query.')
+def export_command(path, batch_size):
+    """Write users, hashtags, posts, reactions and comments to PATH as NDJSON (.gz compresses)."""
+    started = time.perf_counter()
+    with _open_dump(path, 'w') as out:
+        total = export_ndjson(out, batch_size, _report_rate)
+    seconds = time.perf_counter() - started
+    click.echo(f'Exported {total} row(s) in {seconds:.1f}s ({total / max(seconds, 1e-9):.0f} rows/s).', err=True)
+
+
+@data_cli.command('import')
+@click.argument('path')
+@click.option('--batch-size', default=5000, show_default=True, help='Rows inserted per transaction.')
+def import_command(path, batch_size):
+    """Append an NDJSON export to this database (stop the app while importing)."""
+    def progress(table, rows, seconds=None):
+        if table == 'index':
+            click.echo(f'rebuilt index {rows}')
+        else:
+            _report_rate(table, rows, seconds)
+
+    started = time.perf_counter()
+    try:
+        with _open_dump(path, 'r') as lines:
+            counts = import_ndjson(lines, batch_size, progress)
+    except TransferError as e:
+        raise click.ClickException(str(e))
+    total = sum(counts.values())
+    seconds = time.perf_counter() - started
+    click.echo(', '.join(f'{count} {table}' for table, count in counts.items()))
+    click.echo(f'Imported {total} row(s) in {seconds:.1f}s ({total / max(seconds, 1e-9):.0f} rows/s).')
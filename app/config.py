@@ -6,7 +6,162 @@ load_dotenv()
 BASE_DIR = os.path.abspath(os.path.dirname(__file__))
 
 class Config:
-    SQLALCHEMY_DATABASE_URI = "sqlite:///" + os.path.join(BASE_DIR, "forum.db")
+    SQLALCHEMY_DATABASE_URI = os.getenv(
+        "DATABASE_URL", "sqlite:///" + os.path.join(BASE_DIR, "forum.db")
+    )
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     SECRET_KEY = os.getenv("SECRET_KEY")
     ADMIN_PASSWORD = os.getenv("ADMIN_PASSWORD")
+    # Seconds the login/admin flag kept in the session is trusted before
+    # it is checked against the database again (app/services/current_user.py)
+    SESSION_IDENTITY_TTL = int(os.getenv("SESSION_IDENTITY_TTL", 300))
+
+    # Password hashing (werkzeug method string, e.g. "pbkdf2:sha256:600000");
+    # hashes made with other parameters are upgraded at the next login.
+    # Hashing runs on PASSWORD_HASH_WORKERS threads per process; beyond
+    # PASSWORD_HASH_MAX_PENDING concurrent hashes requests get a 503
+    # (only reachable with threaded workers, e.g. app/asgi.py).
+    PASSWORD_HASH_METHOD = os.getenv("PASSWORD_HASH_METHOD", "scrypt:32768:8:1")
+    PASSWORD_SALT_LENGTH = 16
+    PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", 2))
+    PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", 8))
+    # Login/registration attempts per IP and failed logins per login
+    # within LOGIN_RATE_WINDOW seconds (counted in the cache backend)
+    LOGIN_RATE_WINDOW = int(os.getenv("LOGIN_RATE_WINDOW", 300))
+    LOGIN_ATTEMPTS_PER_IP = int(os.getenv("LOGIN_ATTEMPTS_PER_IP", 30))
+    LOGIN_FAILURES_PER_LOGIN = int(os.getenv("LOGIN_FAILURES_PER_LOGIN", 10))
+    # Number of reverse proxies in front of the app whose X-Forwarded-For
+    # and X-Forwarded-Proto headers are trusted (0: use the peer address)
+    TRUSTED_PROXIES = int(os.getenv("TRUSTED_PROXIES", 0))
+
+    # Read replicas (app/services/replicas.py): comma-separated database
+    # URLs. GETs of REPLICA_ENDPOINTS read from a random replica, except for
+    # clients that sent a write in the last REPLICA_STICKY_SECONDS.
+    DATABASE_REPLICA_URLS = [url for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url]
+    REPLICA_STICKY_SECONDS = int(os.getenv("REPLICA_STICKY_SECONDS", 10))
+    REPLICA_ENDPOINTS = {
+        'posts.index',
+        'posts.post_detail',
+        'posts.posts_by_hashtag',
+        'users.profile',
+    }
+
+    # Connection pool (see app/database.py)
+    DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+    DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+    DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", 30))
+    DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+    DB_POOL_PRE_PING = True
+    # Write views are retried this many times on "database is locked"
+    DB_LOCK_RETRIES = int(os.getenv("DB_LOCK_RETRIES", 5))
+    DB_LOCK_RETRY_DELAY = float(os.getenv("DB_LOCK_RETRY_DELAY", 0.05))
+
+    # ASGI mode (app/asgi.py): request threads per worker process; keep it
+    # below DB_POOL_SIZE + DB_MAX_OVERFLOW
+    ASGI_THREADS = int(os.getenv("ASGI_THREADS", 8))
+
+    # SQLite: WAL lets readers run alongside the single writer, and the busy
+    # timeout makes writers wait for the lock instead of failing at once
+    SQLITE_TUNING = os.getenv("SQLITE_TUNING", "1") == "1"
+    SQLITE_BUSY_TIMEOUT = int(os.getenv("SQLITE_BUSY_TIMEOUT", 5000))  # ms
+    SQLITE_PRAGMAS = {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -64000,  # 64 MB
+        "mmap_size": 268435456,  # 256 MB
+        "temp_store": "MEMORY",
+    }
+
+    # Feed, hashtag and profile listings are paginated with keyset cursors
+    POSTS_PER_PAGE = int(os.getenv("POSTS_PER_PAGE", 20))
+    POSTS_PER_PAGE_MAX = 100
+
+    # Page and fragment cache: "sqlite" is shared by all gunicorn workers,
+    # "lru" is per process, "null" disables caching
+    CACHE_BACKEND = os.getenv("CACHE_BACKEND", "sqlite")
+    CACHE_SQLITE_PATH = os.getenv("CACHE_SQLITE_PATH", os.path.join(BASE_DIR, "cache.db"))
+    CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", 10000))
+    CACHE_DEFAULT_TIMEOUT = int(os.getenv("CACHE_DEFAULT_TIMEOUT", 300))
+    # The feed ranking depends on post age, so it is cached for a shorter time
+    CACHE_FEED_TIMEOUT = int(os.getenv("CACHE_FEED_TIMEOUT", 60))
+
+    # Maximum number of SQL queries per request, independent of data size:
+    # the worst case measured on a seeded forum for a logged-in user whose
+    # identity is due for a refresh (tests/test_query_budgets.py).
+    # Enforced in testing mode or with QUERY_BUDGET_ENFORCE=1.
+    QUERY_BUDGETS = {
+        'posts.index': 6,
+        # Creating a post, independent of its number of hashtags and
+        # mentions; an image adds the image_url UPDATE and a thumbnail job
+        'POST posts.index': 12,
+        'posts.post_detail': 8,
+        'POST posts.post_detail': 9,
+        'posts.comment_thread': 5,
+        'posts.posts_by_hashtag': 7,
+        'posts.posts_api': 4,
+        # The timeline loads its posts and comments with one query each
+        'users.profile': 6,
+        'users.activity_api': 5,
+        'search.search_page': 3,
+        'search.search_api': 2,
+    }
+    QUERY_BUDGET_ENFORCE = os.getenv("QUERY_BUDGET_ENFORCE") == "1"
+    QUERY_COUNT_HEADER = os.getenv("QUERY_COUNT_HEADER") == "1"
+
+    # Metrics at /metrics; queries slower than SLOW_QUERY_SECONDS are logged.
+    # With several worker processes set METRICS_DIR to a directory they share.
+    SLOW_QUERY_SECONDS = float(os.getenv("SLOW_QUERY_SECONDS", 0.1))
+    METRICS_DIR = os.getenv("METRICS_DIR")
+    METRICS_FLUSH_INTERVAL = 10  # seconds
+    # /metrics, /cache/stats and /jobs/stats are for admins only; set
+    # STATS_PUBLIC=1 to open them to anyone, e.g. for a Prometheus scraper
+    # that can only be reached from the internal network.
+    STATS_PUBLIC = os.getenv("STATS_PUBLIC") == "1"
+
+    # Comment threads: top-level comments per page, rendered reply depth
+    # and number of replies shown under each comment before "show more"
+    COMMENTS_PER_PAGE = int(os.getenv("COMMENTS_PER_PAGE", 50))
+    COMMENT_MAX_DEPTH = int(os.getenv("COMMENT_MAX_DEPTH", 6))
+    COMMENT_REPLIES_SHOWN = int(os.getenv("COMMENT_REPLIES_SHOWN", 10))
+
+    # Trending hashtags: posts of the last TRENDING_WINDOW_DAYS days count
+    # 1, 1/2, 1/4, ... by age in days; the list is refreshed every
+    # TRENDING_REFRESH seconds
+    TRENDING_WINDOW_DAYS = int(os.getenv("TRENDING_WINDOW_DAYS", 7))
+    TRENDING_REFRESH = int(os.getenv("TRENDING_REFRESH", 300))
+
+    # Background jobs (app.services.jobs). With JOB_WORKER_THREADS=0 the web
+    # processes only enqueue and `flask jobs work` has to run separately.
+    JOB_WORKER_THREADS = int(os.getenv("JOB_WORKER_THREADS", 1))
+    JOB_BATCH_SIZE = int(os.getenv("JOB_BATCH_SIZE", 50))
+    JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 5))
+    JOB_RETRY_DELAY = 2  # seconds, doubled after every failed attempt
+    JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", 1))
+    JOB_LOCK_TIMEOUT = 300  # seconds before a job claimed by a dead worker runs again
+
+    # Reaction counters: 0 writes them with each reaction; otherwise every
+    # process adds them up in memory and writes them every N seconds
+    REACTION_FLUSH_INTERVAL = float(os.getenv("REACTION_FLUSH_INTERVAL", 0))
+
+    # Seconds between refreshes of the stored feed score (freshness boost
+    # and top hashtag bonus) by the job workers; 0 disables them
+    RANK_REFRESH_INTERVAL = int(os.getenv("RANK_REFRESH_INTERVAL", 60))
+
+    NOTIFICATIONS_PER_PAGE = 30
+
+    # Full-text search
+    SEARCH_RESULTS_PER_PAGE = int(os.getenv("SEARCH_RESULTS_PER_PAGE", 20))
+    SEARCH_SNIPPET_TOKENS = 24
+
+    # Image uploads: streamed to disk up to IMAGE_MAX_BYTES, thumbnails
+    # (longest side IMAGE_THUMB_SIZE px) made by a background job
+    IMAGE_MAX_BYTES = int(os.getenv("IMAGE_MAX_BYTES", 5 * 1024 * 1024))
+    IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.gif', '.webp'}
+    IMAGE_THUMB_SIZE = int(os.getenv("IMAGE_THUMB_SIZE", 640))
+    # Hard limit on the whole request body (image plus form fields)
+    MAX_CONTENT_LENGTH = IMAGE_MAX_BYTES + 1024 * 1024
+
+    # Static files: write .gz/.br copies of CSS/JS at startup; with
+    # USE_X_SENDFILE=1 a front proxy (nginx, Apache) sends the file bytes
+    STATIC_COMPRESS_ON_START = os.getenv("STATIC_COMPRESS_ON_START", "1") == "1"
+    USE_X_SENDFILE = os.getenv("USE_X_SENDFILE", "0") == "1"
@@ -0,0 +1,95 @@
+import random
+import time
+from functools import wraps
+
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import OperationalError
+
+from app.extensions import db
+from app.services.replicas import replica_binds
+
+
+def configure_database(app):
+    """Derives SQLAlchemy engine options from the DB_* / SQLITE_* settings.
+
+    Must run before `db.init_app`. Explicit SQLALCHEMY_ENGINE_OPTIONS
+    entries take precedence, so any database URL (e.g. PostgreSQL via
+    DATABASE_URL) can be tuned from configuration alone. The options
+    apply to the read replicas (DATABASE_REPLICA_URLS) as well.
+    """
+    url = make_url(app.config['SQLALCHEMY_DATABASE_URI'])
+    options = {'pool_pre_ping': app.config['DB_POOL_PRE_PING']}
+
+    if url.get_backend_name() == 'sqlite':
+        if app.config['SQLITE_TUNING']:
+            # Seconds the driver waits for a lock before "database is locked"
+            options['connect_args'] = {'timeout': app.config['SQLITE_BUSY_TIMEOUT'] / 1000}
+        if url.database and url.database != ':memory:':
+            options['pool_size'] = app.config['DB_POOL_SIZE']
+            options['max_overflow'] = app.config['DB_MAX_OVERFLOW']
+    else:
+        options.update(
+            pool_size=app.config['DB_POOL_SIZE'],
+            max_overflow=app.config['DB_MAX_OVERFLOW'],
+            pool_timeout=app.config['DB_POOL_TIMEOUT'],
+            pool_recycle=app.config['DB_POOL_RECYCLE'],
+        )
+
+    options.update(app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+
+    # Replicas are extra binds with the same options, see app/services/replicas.py
+    binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+    binds.update(replica_binds(app.config['DATABASE_REPLICA_URLS']))
+    app.config['SQLALCHEMY_BINDS'] = binds
+
+
+def install_sqlite_pragmas(app):
+    """Applies SQLITE_PRAGMAS to every new connection of the app's SQLite engines.
+
+    Must run after `db.init_app`, before the first connection is made.
+    """
+    if not app.config['SQLITE_TUNING']:
+        return
+    pragmas = dict(app.config['SQLITE_PRAGMAS'])
+    pragmas['busy_timeout'] = app.config['SQLITE_BUSY_TIMEOUT']
+
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+        cursor.close()
+
+    with app.app_context():
+        for engine in db.engines.values():
+            if engine.dialect.name == 'sqlite':
+                event.listen(engine, 'connect', set_pragmas)
+
+
+def is_lock_error(error):
+    message = str(getattr(error, 'orig', error)).lower()
+    return 'database is locked' in message or 'database is busy' in message
+
+
+def retry_on_lock(view):
+    """Re-runs a write view when the database reports lock contention.
+
+    The session is rolled back before each retry, so the view starts from
+    a clean transaction. Waits grow exponentially (with jitter) from
+    DB_LOCK_RETRY_DELAY; after DB_LOCK_RETRIES attempts the error is raised.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        retries = current_app.config['DB_LOCK_RETRIES']
+        delay = current_app.config['DB_LOCK_RETRY_DELAY']
+        for attempt in range(retries + 1):
+            try:
+                return view(*args, **kwargs)
+            except OperationalError as e:
+                db.session.rollback()
+                if attempt == retries or not is_lock_error(e):
+                    raise
+                time.sleep(delay * (2 ** attempt) * (0.5 + random.random()))
+    return wrapper
@@ -1,3 +1,7 @@
 from flask_sqlalchemy import SQLAlchemy
 
-db = SQLAlchemy()
+from app.services.cache import Cache
+from app.services.replicas import RoutingSession
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+cache = Cache()
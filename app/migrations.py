@@ -0,0 +1,146 @@
+"""Versioned schema migrations for existing databases.
+
+`db.create_all()` creates missing tables but never changes existing ones,
+so every schema change to a table that already exists in production gets
+a numbered migration here. Migrations are idempotent: on a fresh database
+(already created from the models) they find nothing to do and are only
+recorded as applied. Each one runs in its own short transaction.
+"""
+from datetime import datetime
+
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+from app.extensions import db
+
+schema_migrations = db.Table(
+    'schema_migrations',
+    db.Column('version', db.Integer, primary_key=True),
+    db.Column('name', db.String(200), nullable=False),
+    db.Column('applied_at', db.DateTime, nullable=False),
+)
+
+MIGRATIONS = []
+
+
+def migration(version, name):
+    """Registers a migration function taking a connection inside a transaction."""
+    def decorator(fn):
+        MIGRATIONS.append((version, name, fn))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return fn
+    return decorator
+
+
+def add_column(conn, table, column, ddl):
+    """ALTER TABLE ... ADD COLUMN unless the column is already there."""
+    if column not in {c['name'] for c in inspect(conn).get_columns(table)}:
+        conn.execute(text(f'ALTER TABLE {table} ADD COLUMN {column} {ddl}'))
+
+
+def create_indexes(conn, *names):
+    """Creates the named indexes declared on the models unless they already exist."""
+    indexes = {
+        index.name: index
+        for table in db.metadata.tables.values()
+        for index in table.indexes
+    }
+    for name in names:
+        indexes[name].create(conn, checkfirst=True)
+
+
+@migration(1, 'Add post.image_url')
+def add_post_image_url(conn):
+    add_column(conn, 'post', 'image_url', 'VARCHAR(256)')
+
+
+@migration(2, 'Indexes for feed, comment, hashtag and profile queries')
+def add_hot_path_indexes(conn):
+    create_indexes(
+        conn,
+        'ix_post_created_at',
+        'ix_post_author_id_created_at',
+        'ix_comment_post_id_parent_id',
+        'ix_comment_parent_id',
+        'ix_reaction_user_id_post_id',
+        'ix_post_hashtag_hashtag_id',
+    )
+
+
+@migration(3, 'Add post.thumbnail_url')
+def add_post_thumbnail_url(conn):
+    add_column(conn, 'post', 'thumbnail_url', 'VARCHAR(256)')
+
+
+@migration(4, 'Add hashtag.post_count')
+def add_hashtag_post_count(conn):
+    add_column(conn, 'hashtag', 'post_count', "INTEGER NOT NULL DEFAULT '0'")
+    conn.execute(text(
+        'UPDATE hashtag SET post_count = '
+        '(SELECT count(*) FROM post_hashtag WHERE post_hashtag.hashtag_id = hashtag.id)'
+    ))
+    create_indexes(conn, 'ix_hashtag_post_count')
+
+
+@migration(5, 'Add rendered HTML to posts and comments')
+def add_content_html(conn):
+    for table in ('post', 'comment'):
+        add_column(conn, table, 'content_html', 'TEXT')
+        add_column(conn, table, 'render_version', 'INTEGER')
+
+
+@migration(6, 'Widen user.password_hash for scrypt hashes')
+def widen_password_hash(conn):
+    # SQLite does not enforce VARCHAR lengths
+    if conn.dialect.name == 'postgresql':
+        conn.execute(text('ALTER TABLE "user" ALTER COLUMN password_hash TYPE VARCHAR(256)'))
+
+
+@migration(7, 'Add the stored feed score to post_stats')
+def add_rank_score(conn):
+    for column in ('rank_bonus', 'rank_freshness', 'rank_score'):
+        add_column(conn, 'post_stats', column, "INTEGER NOT NULL DEFAULT '0'")
+    # Bonus and freshness are filled in by the first refresh_ranks() sweep
+    conn.execute(text('UPDATE post_stats SET rank_score = score + rank_bonus + rank_freshness'))
+    create_indexes(conn, 'ix_post_stats_rank_score')
+
+
+@migration(8, 'Index comments by author for the activity timeline')
+def add_comment_author_index(conn):
+    # The user_stats table is new (create_all) and filled at startup
+    create_indexes(conn, 'ix_comment_author_id_created_at')
+
+
+def applied_versions():
+    with db.engine.connect() as conn:
+        return {row[0] for row in conn.execute(schema_migrations.select())}
+
+
+def pending_migrations():
+    applied = applied_versions()
+    return [m for m in MIGRATIONS if m[0] not in applied]
+
+
+def upgrade(progress=None):
+    """Applies pending migrations in order. Returns the versions applied by this call.
+
+    Several gunicorn workers may call this at boot at the same time; a
+    migration that another process applied concurrently is skipped.
+    """
+    applied = []
+    for version, name, fn in pending_migrations():
+        try:
+            with db.engine.begin() as conn:
+                fn(conn)
+                conn.execute(schema_migrations.insert().values(
+                    version=version, name=name, applied_at=datetime.utcnow()
+                ))
+        except (IntegrityError, OperationalError) as e:
+            msg = str(e).lower()
+            if not any(s in msg for s in ('unique', 'already exists', 'duplicate')):
+                raise
+            continue
+        applied.append(version)
+        if progress:
+            progress(version, name)
+    return applied
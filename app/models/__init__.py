@@ -1,5 +1,7 @@
 from app.models.post import Post
 from app.models.comment import Comment
-from app.models.user import User
-from app.models.post import Reaction
-from app.models.post import Hashtag, post_hashtag
\ No newline at end of file
+from app.models.user import User, UserStats
+from app.models.post import Reaction, PostStats
+from app.models.post import Hashtag, post_hashtag
+from app.models.notification import Notification
+from app.models.job import Job
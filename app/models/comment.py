@@ -6,6 +6,9 @@ class Comment(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     content = db.Column(db.Text, nullable=False)
+    # `content` rendered by app.services.markup, see RENDER_VERSION there
+    content_html = db.Column(db.Text, nullable=True)
+    render_version = db.Column(db.Integer, nullable=True)
     created_at = db.Column(db.DateTime(timezone=True), server_default=func.now(), nullable=False)
 
     post_id = db.Column(
@@ -22,6 +25,13 @@ class Comment(db.Model):
 
     author_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
 
+    __table_args__ = (
+        db.Index('ix_comment_post_id_parent_id', 'post_id', 'parent_id'),
+        db.Index('ix_comment_parent_id', 'parent_id'),
+        # Activity timeline on profiles, see app.services.activity
+        db.Index('ix_comment_author_id_created_at', 'author_id', 'created_at', 'id'),
+    )
+
     replies = db.relationship(
         "Comment",
         backref=db.backref("parent", remote_side=[id]),
@@ -0,0 +1,23 @@
+from app.extensions import db
+from sqlalchemy.sql import func
+
+class Notification(db.Model):
+    """Tells a user that they were mentioned in a post or comment."""
+    __tablename__ = "notification"
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
+    actor_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
+    post_id = db.Column(db.Integer, db.ForeignKey("post.id"), nullable=False)
+    comment_id = db.Column(db.Integer, db.ForeignKey("comment.id"), nullable=True)
+    kind = db.Column(db.String(20), nullable=False, default='mention')
+    created_at = db.Column(db.DateTime(timezone=True), server_default=func.now(), nullable=False)
+    read_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_notification_user_id_id', 'user_id', 'id'),
+        db.Index('ix_notification_user_id_read_at', 'user_id', 'read_at'),
+    )
+
+    actor = db.relationship("User", foreign_keys=[actor_id])
+    comment = db.relationship("Comment")
@@ -1,24 +1,55 @@
+import os
 from app.extensions import db
 from sqlalchemy.sql import func
 
 post_hashtag = db.Table('post_hashtag',
     db.Column('post_id', db.Integer, db.ForeignKey('post.id'), primary_key=True),
-    db.Column('hashtag_id', db.Integer, db.ForeignKey('hashtag.id'), primary_key=True)
+    db.Column('hashtag_id', db.Integer, db.ForeignKey('hashtag.id'), primary_key=True),
+    # The primary key serves lookups by post; this one serves hashtag pages
+    db.Index('ix_post_hashtag_hashtag_id', 'hashtag_id', 'post_id')
 )
 
 class Hashtag(db.Model):
     __tablename__ = 'hashtag'
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(64), unique=True, nullable=False)
+    # Number of posts tagged with this hashtag, see app.services.hashtags
+    post_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     posts = db.relationship('Post', secondary=post_hashtag, back_populates='hashtags')
 
+    __table_args__ = (
+        db.Index('ix_hashtag_post_count', 'post_count', 'id'),
+    )
+
 class Reaction(db.Model):
     __tablename__ = 'reaction'
     id = db.Column(db.Integer, primary_key=True)
     post_id = db.Column(db.Integer, db.ForeignKey('post.id'), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     type = db.Column(db.String(10), nullable=False)  # 'plus' or 'minus'
-    __table_args__ = (db.UniqueConstraint('post_id', 'user_id', name='_user_post_uc'),)
+    __table_args__ = (
+        db.UniqueConstraint('post_id', 'user_id', name='_user_post_uc'),
+        db.Index('ix_reaction_user_id_post_id', 'user_id', 'post_id'),
+    )
+
+class PostStats(db.Model):
+    """Denormalized per-post counters, updated by every write that affects them."""
+    __tablename__ = 'post_stats'
+    post_id = db.Column(db.Integer, db.ForeignKey('post.id'), primary_key=True)
+    plus_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    minus_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    comment_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # Reaction and comment part of the popularity score
+    score = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # Top hashtag bonus and freshness boost as of the last refresh, and the
+    # full score the feed is ordered by (see app.services.ranking.refresh_ranks)
+    rank_bonus = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rank_freshness = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    rank_score = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+    __table_args__ = (
+        db.Index('ix_post_stats_rank_score', rank_score.desc(), 'post_id'),
+    )
 
 class Post(db.Model):
     __tablename__ = "post"
@@ -26,9 +57,19 @@ class Post(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(200), nullable=False)
     content = db.Column(db.Text, nullable=False)
+    # `content` rendered by app.services.markup, see RENDER_VERSION there
+    content_html = db.Column(db.Text, nullable=True)
+    render_version = db.Column(db.Integer, nullable=True)
     author_id = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
     created_at = db.Column(db.DateTime(timezone=True), server_default=func.now(), nullable=False)
     image_url = db.Column(db.String(256), nullable=True)
+    # Downscaled JPEG written by app.services.images; a .webp sits next to it
+    thumbnail_url = db.Column(db.String(256), nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_post_created_at', 'created_at', 'id'),
+        db.Index('ix_post_author_id_created_at', 'author_id', 'created_at', 'id'),
+    )
 
     comments = db.relationship(
         "Comment",
@@ -44,3 +85,24 @@ class Post(db.Model):
         lazy=True
     )
     hashtags = db.relationship('Hashtag', secondary=post_hashtag, back_populates='posts')
+
+    notifications = db.relationship(
+        'Notification',
+        backref='post',
+        cascade='all, delete-orphan',
+        lazy=True
+    )
+
+    stats = db.relationship(
+        'PostStats',
+        backref='post',
+        uselist=False,
+        cascade='all, delete-orphan',
+        lazy=True
+    )
+
+    @property
+    def thumbnail_webp_url(self):
+        if not self.thumbnail_url:
+            return None
+        return os.path.splitext(self.thumbnail_url)[0] + '.webp'
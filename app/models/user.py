@@ -1,3 +1,4 @@
+from flask import current_app
 from app.extensions import db
 from werkzeug.security import generate_password_hash, check_password_hash
 
@@ -6,16 +7,42 @@ class User(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     login = db.Column(db.String(64), unique=True, nullable=False)
-    password_hash = db.Column(db.String(128), nullable=False)
+    password_hash = db.Column(db.String(256), nullable=False)
     bio = db.Column(db.Text, nullable=True)
     profile_image = db.Column(db.String(256), nullable=True)
     is_admin = db.Column(db.Boolean, default=False)
 
     posts = db.relationship("Post", backref="author", lazy=True)
     comments = db.relationship("Comment", backref="author", lazy=True)
+    stats = db.relationship("UserStats", uselist=False, lazy=True)
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        # Requests hash through app.services.auth (pooled); this is for the CLI/startup
+        self.password_hash = generate_password_hash(
+            password,
+            method=current_app.config['PASSWORD_HASH_METHOD'],
+            salt_length=current_app.config['PASSWORD_SALT_LENGTH']
+        )
 
     def check_password(self, password):
         return check_password_hash(self.password_hash, password)
+
+
+class UserStats(db.Model):
+    """Denormalized per-user counters, updated by every write that affects them."""
+    __tablename__ = "user_stats"
+
+    user_id = db.Column(db.Integer, db.ForeignKey("user.id"), primary_key=True)
+    post_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    comment_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # Reactions to the user's posts
+    plus_received = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    minus_received = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+    @property
+    def reactions_received(self):
+        return self.plus_received + self.minus_received
+
+    @property
+    def karma(self):
+        return self.plus_received - self.minus_received
@@ -1,6 +1,10 @@
-from flask import Blueprint, render_template, request, redirect, url_for, session, flash
-from app.models import User
+from flask import Blueprint, render_template, request, redirect, url_for, flash
+from app.models import User, UserStats
 from app.extensions import db
+from app.database import retry_on_lock, is_lock_error
+from app.services.auth import HashingBusy, count_attempt, hash_password, login_locked, record_failure, verify_password
+from app.services.current_user import login_user, logout_user
+from sqlalchemy.exc import IntegrityError
 
 import re
 
@@ -30,16 +34,15 @@ def validate_login(login):
     """
     Validates login:
     - cannot be empty
-    - must be unique
+    Uniqueness is enforced by the unique index when the user is inserted.
     """
     if not login or len(login.strip()) == 0:
         return False, 'Login cannot be empty.'
-    if User.query.filter_by(login=login).first():
-        return False, 'User with this login already exists.'
     return True, None
 
 
 @auth_bp.route('/register', methods=['GET', 'POST'])
+@retry_on_lock
 def register():
     if request.method == 'POST':
         login = request.form.get('login', '').strip()
@@ -73,16 +76,26 @@ def register():
             flash(error_msg)
             return render_template('auth/register.html')
 
+        if not count_attempt():
+            flash('Too many attempts. Please try again in a few minutes.')
+            return render_template('auth/register.html'), 429
+
         # User registration
+        password_hash = hash_password(password)
         try:
-            user = User(login=login, is_admin=False)  # Always create a regular user
-            user.set_password(password)  # Sets the password hash
+            user = User(login=login, is_admin=False, password_hash=password_hash, stats=UserStats())  # Always create a regular user
             db.session.add(user)
             db.session.commit()
             flash('Registration successful! You can now log in.')
             return redirect(url_for('auth.login'))
-        except Exception:
+        except IntegrityError:
+            db.session.rollback()
+            flash('User with this login already exists.')
+            return render_template('auth/register.html')
+        except Exception as e:
             db.session.rollback()
+            if is_lock_error(e):
+                raise  # retried by retry_on_lock
             flash('An error occurred during registration. Please try again.')
             return render_template('auth/register.html')
 
@@ -90,6 +103,7 @@ def register():
 
 
 @auth_bp.route('/login', methods=['GET', 'POST'])
+@retry_on_lock
 def login():
     if request.method == 'POST':
         login = request.form.get('login', '').strip()
@@ -103,15 +117,22 @@ def login():
             flash('You must provide a password.')
             return render_template('auth/login.html')
 
+        if not count_attempt() or login_locked(login):
+            flash('Too many login attempts. Please try again in a few minutes.')
+            return render_template('auth/login.html'), 429
+
         # User verification
         user = User.query.filter_by(login=login).first()
-        if not user or not user.check_password(password):
+        if not verify_password(user, password):
+            record_failure(login)
             flash('Invalid login or password.')
             return render_template('auth/login.html')
 
+        # Saves the hash if it was upgraded to the current parameters
+        db.session.commit()
+
         # Log in user
-        session['user_id'] = user.id
-        session['user_login'] = user.login
+        login_user(user)
         return redirect(url_for('posts.index'))
 
     return render_template('auth/login.html')
@@ -119,6 +140,14 @@ def login():
 
 @auth_bp.route('/logout')
 def logout():
-    session.pop('user_id', None)
-    session.pop('user_login', None)
+    logout_user()
     return redirect(url_for('posts.index'))
+
+
+@auth_bp.errorhandler(HashingBusy)
+def hashing_busy(e):
+    """More password hashes are queued in this worker than PASSWORD_HASH_MAX_PENDING."""
+    db.session.rollback()
+    flash('The server is busy. Please try again in a moment.')
+    template = 'auth/register.html' if request.endpoint == 'auth.register' else 'auth/login.html'
+    return render_template(template), 503, {'Retry-After': '5'}
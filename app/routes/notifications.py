@@ -0,0 +1,36 @@
+from flask import Blueprint, render_template, request, redirect, url_for, session, g
+
+from app.services.notifications import notifications_page, mark_read, unread_count
+
+notifications_bp = Blueprint('notifications', __name__)
+
+
+@notifications_bp.route('/notifications')
+def notifications():
+    if not session.get('user_id'):
+        return redirect(url_for('auth.login'))
+
+    user_id = session['user_id']
+    items, next_before = notifications_page(user_id, request.args.get('before', type=int))
+    # Rendered as unread once, then marked read
+    unread_ids = {n.id for n in items if n.read_at is None}
+    mark_read(user_id, items)
+
+    return render_template(
+        'notifications.html',
+        notifications=items,
+        unread_ids=unread_ids,
+        next_page_url=url_for('notifications.notifications', before=next_before) if next_before else None
+    )
+
+
+@notifications_bp.app_context_processor
+def inject_unread_notifications():
+    """Unread count for the header; computed only when a template asks for it."""
+    def unread_notifications():
+        if not session.get('user_id'):
+            return 0
+        if 'unread_notifications' not in g:
+            g.unread_notifications = unread_count(session['user_id'])
+        return g.unread_notifications
+    return {'unread_notifications': unread_notifications}
@@ -1,10 +1,22 @@
-from flask import Blueprint, render_template, request, redirect, url_for, session, flash
-from app.extensions import db
-from app.models import Post, Comment, User, Reaction, Hashtag, post_hashtag
-from sqlalchemy import func
-import os
-from werkzeug.utils import secure_filename
-from datetime import datetime, timedelta
+from flask import Blueprint, render_template, request, redirect, url_for, session, flash, jsonify, abort, current_app, g
+from app.extensions import db, cache
+from app.database import retry_on_lock
+from app.models import Post, Comment, User, Hashtag
+from app.services.ranking import new_post_stats, top_hashtags, ranked_page
+from app.services.hashtags import attach_hashtags, record_hashtags, trending_hashtags
+from app.services.pagination import chronological_page
+from app.services.cache import cached_page
+from app.services.stats import record_comment, reaction_summary
+from app.services.reactions import count_reaction, reaction_counts, set_reaction
+from app.services.user_stats import record_post, record_user_comment, refresh_user_stats
+from app.services.comments import load_comment_page, load_comment_thread
+from app.services.markup import render_contents
+from app.services.notifications import queue_mention_notifications
+from app.services.jobs import backlog as job_backlog
+from app.services.images import UploadError, save_upload, schedule_post_image, delete_post_images
+from app.services.metrics import stats_view
+from sqlalchemy.orm import joinedload, selectinload
+from datetime import datetime
 
 posts_bp = Blueprint("posts", __name__)
 
@@ -15,20 +27,10 @@ def parse_hashtags(text):
     return list(set([tag[1:] for tag in re.findall(r"#\w+", text)]))
 
 
-# Ensure image_url column exists (fallback / legacy support)
-if not hasattr(Post, 'image_url'):
-    Post.image_url = db.Column(db.String(256), nullable=True)
-
-
 def save_post_image(file, post_id):
     if not file or not file.filename:
         return None
-    ext = os.path.splitext(file.filename)[1]
-    filename = f'post_{post_id}{ext}'
-    static_path = os.path.join('static', 'img', filename)
-    abs_path = os.path.join(os.path.dirname(__file__), '..', static_path)
-    file.save(abs_path)
-    return '/' + static_path.replace('\\', '/')
+    return save_upload(file, f'post_{post_id}')
 
 
 def calculate_popularity_score(post, top_hashtags):
@@ -72,7 +74,17 @@ def calculate_popularity_score(post, top_hashtags):
     return score
 
 
+def invalidate_listings(author_login=None, tag_names=()):
+    """Drops cached pages that list posts after a post was created or deleted."""
+    namespaces = ['feed', 'hashtags'] + [f'hashtag:{name}' for name in tag_names]
+    if author_login:
+        namespaces.append(f'profile:{author_login}')
+    cache.invalidate(*namespaces)
+
+
 @posts_bp.route("/", methods=["GET", "POST"])
+@cached_page(('feed', 'hashtags'))
+@retry_on_lock
 def index():
     if request.method == "POST":
         if not session.get("user_id"):
@@ -86,84 +98,76 @@ def index():
         post = Post(
             title=title,
             content=content,
-            author_id=session["user_id"]
+            author_id=session["user_id"],
+            stats=new_post_stats()
         )
+        render_contents([post])
+        record_post(session["user_id"])
 
-        # Commit first to get post_id
+        # Post, image and hashtags are written in one transaction; the
+        # flush only assigns post_id for the image file name
         db.session.add(post)
-        db.session.commit()
-
-        file = request.files.get('image')
-        if file and file.filename:
-            post.image_url = save_post_image(file, post.id)
-            db.session.commit()
+        db.session.flush()
+        post_id = post.id
 
-        # Attach hashtags
-        for name in hashtags:
-            tag = Hashtag.query.filter_by(name=name.lower()).first()
-            if not tag:
-                tag = Hashtag(name=name.lower())
-                db.session.add(tag)
-            if tag not in post.hashtags:
-                post.hashtags.append(tag)
+        try:
+            image_url = save_post_image(request.files.get('image'), post_id)
+            if image_url is not None:
+                post.image_url = image_url
+        except UploadError as e:
+            db.session.rollback()
+            flash(str(e))
+            return redirect(url_for("posts.index"))
 
-        db.session.commit()
+        try:
+            tag_names = attach_hashtags(post, hashtags)
+            if image_url:
+                # Thumbnails are made in the background, the feed shows the original until then
+                schedule_post_image(post_id)
+            queue_mention_notifications(content, session["user_id"], post_id)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            if image_url:
+                # Nothing refers to the file once the post is gone
+                delete_post_images(post_id, image_url)
+            raise
+
+        invalidate_listings(session.get("user_login"), tag_names)
         return redirect(url_for("posts.index"))
 
-    # Fetch top 5 hashtags (needed for popularity score)
-    hashtags = (
-        db.session.query(
-            Hashtag,
-            func.count(post_hashtag.c.post_id).label('count')
-        )
-        .join(post_hashtag)
-        .group_by(Hashtag.id)
-        .order_by(func.count(post_hashtag.c.post_id).desc())
-        .limit(5)
-        .all()
-    )
-    hashtags = [h[0] for h in hashtags]
-
-    # Fetch all posts
-    posts = Post.query.all()
-
-    # Calculate popularity scores
-    posts_with_scores = []
-    for post in posts:
-        score = calculate_popularity_score(post, hashtags)
-        posts_with_scores.append((post, score))
-
-    # Sort by score descending
-    posts_with_scores.sort(key=lambda x: x[1], reverse=True)
-    posts = [post for post, score in posts_with_scores]
+    # Fetch top 5 hashtags for the sidebar
+    hashtags = top_hashtags()
 
-    reactions_map = {}
-    your_reactions = {}
-    user_id = session.get("user_id")
+    # Fetch one page of posts ordered by the stored popularity score
+    posts, next_cursor = ranked_page(request.args.get("cursor"))
 
-    for post in posts:
-        plus = sum(1 for r in post.reactions if r.type == 'plus')
-        minus = sum(1 for r in post.reactions if r.type == 'minus')
-        reactions_map[post.id] = {'plus': plus, 'minus': minus}
-
-        your_reactions[post.id] = None
-        if user_id:
-            your = [r for r in post.reactions if r.user_id == user_id]
-            if your:
-                your_reactions[post.id] = your[0].type
+    reactions_map, your_reactions = reaction_summary(posts, session.get("user_id"))
 
     return render_template(
         "index.html",
         posts=posts,
         reactions_map=reactions_map,
         your_reactions=your_reactions,
-        hashtags=hashtags
+        hashtags=hashtags,
+        trending=trending_hashtags(),
+        **pagination_links(next_cursor, "posts.index")
     )
 
 
 @posts_bp.route("/post/<int:post_id>", methods=["GET", "POST"])
+@retry_on_lock
 def post_detail(post_id):
-    post = Post.query.get_or_404(post_id)
+    post = (
+        Post.query
+        .filter_by(id=post_id)
+        .options(
+            joinedload(Post.author),
+            joinedload(Post.stats),
+            selectinload(Post.hashtags)
+        )
+        .first_or_404()
+    )
 
     if request.method == "POST":
         if not session.get("user_id"):
@@ -188,23 +192,23 @@ def post_detail(post_id):
                 author_id=session["user_id"]
             )
 
+        render_contents([comment])
         db.session.add(comment)
+        record_comment(post.id)
+        record_user_comment(session["user_id"])
+        db.session.flush()
+        queue_mention_notifications(content, session["user_id"], post.id, comment.id)
         db.session.commit()
-        return redirect(url_for("posts.post_detail", post_id=post.id))
-
-    comments = Comment.query.filter_by(
-        post_id=post.id,
-        parent_id=None
-    ).all()
+        # Comments count towards the popularity score and show on the profile
+        cache.invalidate('feed', f'profile:{session.get("user_login")}')
+        return redirect(url_for("posts.post_detail", post_id=post_id))
 
-    plus = sum(1 for r in post.reactions if r.type == 'plus')
-    minus = sum(1 for r in post.reactions if r.type == 'minus')
+    comments, next_after = load_comment_page(post.id, request.args.get('after', type=int))
 
-    your_reaction = None
-    if session.get('user_id'):
-        your = [r for r in post.reactions if r.user_id == session['user_id']]
-        if your:
-            your_reaction = your[0].type
+    reactions_map, your_reactions = reaction_summary([post], session.get('user_id'))
+    plus = reactions_map[post.id]['plus']
+    minus = reactions_map[post.id]['minus']
+    your_reaction = your_reactions[post.id]
 
     return render_template(
         "posts/detail.html",
@@ -212,11 +216,45 @@ def post_detail(post_id):
         comments=comments,
         plus=plus,
         minus=minus,
-        your_reaction=your_reaction
+        your_reaction=your_reaction,
+        next_comments_url=(
+            url_for('posts.post_detail', post_id=post.id, after=next_after)
+            if next_after else None
+        )
+    )
+
+
+@posts_bp.route('/post/<int:post_id>/comment/<int:comment_id>')
+def comment_thread(post_id, comment_id):
+    """Shows one comment with all its direct replies ("show more replies" / "continue thread")."""
+    post = (
+        Post.query
+        .filter_by(id=post_id)
+        .options(joinedload(Post.author))
+        .first_or_404()
     )
+    node = load_comment_thread(comment_id)
+    if node is None or node.comment.post_id != post.id:
+        abort(404)
+
+    return render_template('posts/thread.html', post=post, node=node)
+
+
+def _react(post_id, reaction_type):
+    """Stores the reaction of the logged-in user; returns whether it changed."""
+    if not db.session.query(Post.id).filter_by(id=post_id).first():
+        abort(404)
+    changed, old_type = set_reaction(post_id, session['user_id'], reaction_type)
+    if not changed:
+        return False
+    after_commit = count_reaction(post_id, old_type, reaction_type)
+    db.session.commit()
+    after_commit()
+    return True
 
 
 @posts_bp.route('/react/<int:post_id>/<reaction_type>', methods=['POST'])
+@retry_on_lock
 def react(post_id, reaction_type):
     if not session.get('user_id'):
         flash('You must be logged in to react.')
@@ -226,63 +264,38 @@ def react(post_id, reaction_type):
         flash('Invalid reaction.')
         return redirect(url_for('posts.index'))
 
-    post = Post.query.get_or_404(post_id)
-    user_id = session['user_id']
-
-    reaction = Reaction.query.filter_by(
-        post_id=post.id,
-        user_id=user_id
-    ).first()
+    _react(post_id, reaction_type)
+    return redirect(request.referrer or url_for('posts.index'))
 
-    if reaction:
-        if reaction.type == reaction_type:
-            return redirect(request.referrer or url_for('posts.index'))
-        reaction.type = reaction_type
-    else:
-        reaction = Reaction(
-            post_id=post.id,
-            user_id=user_id,
-            type=reaction_type
-        )
-        db.session.add(reaction)
 
-    db.session.commit()
-    return redirect(request.referrer or url_for('posts.index'))
+@posts_bp.route('/api/react/<int:post_id>/<reaction_type>', methods=['POST'])
+@retry_on_lock
+def react_api(post_id, reaction_type):
+    """`react` for scripts: returns the post's counters instead of redirecting."""
+    if not session.get('user_id'):
+        return jsonify(error='You must be logged in to react.'), 401
+    if reaction_type not in ('plus', 'minus'):
+        return jsonify(error='Invalid reaction.'), 400
+
+    changed = _react(post_id, reaction_type)
+    return jsonify(
+        post_id=post_id,
+        changed=changed,
+        your_reaction=reaction_type,
+        **reaction_counts(post_id)
+    )
 
 
 # Display posts with a selected hashtag
 @posts_bp.route('/hashtag/<name>')
+@cached_page(lambda name: (f'hashtag:{name.lower()}', 'hashtags'))
 def posts_by_hashtag(name):
     tag = Hashtag.query.filter_by(name=name.lower()).first_or_404()
-    posts = tag.posts
-
-    reactions_map = {}
-    your_reactions = {}
-    user_id = session.get("user_id")
-
-    for post in posts:
-        plus = sum(1 for r in post.reactions if r.type == 'plus')
-        minus = sum(1 for r in post.reactions if r.type == 'minus')
-        reactions_map[post.id] = {'plus': plus, 'minus': minus}
-
-        your_reactions[post.id] = None
-        if user_id:
-            your = [r for r in post.reactions if r.user_id == user_id]
-            if your:
-                your_reactions[post.id] = your[0].type
-
-    hashtags = (
-        db.session.query(
-            Hashtag,
-            func.count(post_hashtag.c.post_id).label('count')
-        )
-        .join(post_hashtag)
-        .group_by(Hashtag.id)
-        .order_by(func.count(post_hashtag.c.post_id).desc())
-        .limit(5)
-        .all()
-    )
-    hashtags = [h[0] for h in hashtags]
+    posts, next_cursor = chronological_page(hashtag_posts(tag), request.args.get('cursor'))
+
+    reactions_map, your_reactions = reaction_summary(posts, session.get("user_id"))
+
+    hashtags = top_hashtags()
 
     return render_template(
         'index.html',
@@ -290,52 +303,146 @@ def posts_by_hashtag(name):
         reactions_map=reactions_map,
         your_reactions=your_reactions,
         hashtags=hashtags,
-        selected_tag=name.lower()
+        trending=trending_hashtags(),
+        selected_tag=name.lower(),
+        **pagination_links(next_cursor, 'posts.posts_by_hashtag', name=tag.name)
     )
 
 
-from flask import abort
-from flask import g
+def hashtag_posts(tag):
+    """Query for the posts tagged with `tag`."""
+    return (
+        Post.query
+        .filter(Post.hashtags.contains(tag))
+        .options(joinedload(Post.author), joinedload(Post.stats))
+    )
+
+
+def pagination_links(next_cursor, endpoint, **values):
+    """Template variables linking to the next page of a listing.
+
+    `next_page_url` is a plain link for browsers without JavaScript,
+    `next_api_url` is fetched by app.js to append the page in place.
+    """
+    if not next_cursor:
+        return {'next_page_url': None, 'next_api_url': None}
+
+    api_args = {}
+    if endpoint == 'posts.posts_by_hashtag':
+        api_args['tag'] = values['name']
+    elif endpoint == 'users.profile':
+        api_args['author'] = values['login']
 
-@posts_bp.before_app_request
-def load_current_user():
-    g.current_user = User.query.get(session['user_id']) if session.get('user_id') else None
+    return {
+        'next_page_url': url_for(endpoint, cursor=next_cursor, **values),
+        'next_api_url': url_for('posts.posts_api', cursor=next_cursor, **api_args),
+    }
 
 
-@posts_bp.app_context_processor
-def inject_current_user():
-    """Make current_user available in templates as a convenience variable.
+@posts_bp.route('/api/posts')
+def posts_api():
+    """Returns the next page of a listing as JSON for infinite scrolling.
 
-    Some templates reference `current_user` (e.g. to check admin rights).
-    We already set `g.current_user` in `before_app_request`; expose it here so
-    templates can safely use `current_user.is_admin` without failing.
+    Without parameters it pages through the ranked feed; `tag` selects a
+    hashtag listing and `author` a user's posts (both newest first).
     """
-    return {"current_user": getattr(g, 'current_user', None)}
+    cursor = request.args.get('cursor')
+    tag_name = request.args.get('tag')
+    author = request.args.get('author')
+    template = 'posts/_post_cards.html'
+
+    if tag_name:
+        tag = Hashtag.query.filter_by(name=tag_name.lower()).first_or_404()
+        posts, next_cursor = chronological_page(hashtag_posts(tag), cursor, request.args.get('limit'))
+        links = pagination_links(next_cursor, 'posts.posts_by_hashtag', name=tag.name)
+    elif author:
+        user = User.query.filter_by(login=author).first_or_404()
+        posts, next_cursor = chronological_page(
+            Post.query.filter_by(author_id=user.id).options(joinedload(Post.stats)),
+            cursor,
+            request.args.get('limit')
+        )
+        links = pagination_links(next_cursor, 'users.profile', login=user.login)
+        template = 'users/_post_items.html'
+    else:
+        posts, next_cursor = ranked_page(cursor, request.args.get('limit'))
+        links = pagination_links(next_cursor, 'posts.index')
+
+    reactions_map, your_reactions = reaction_summary(posts, session.get('user_id'))
+
+    return jsonify(
+        posts=[
+            {
+                'id': post.id,
+                'title': post.title,
+                'created_at': post.created_at.isoformat() if post.created_at else None,
+                'url': url_for('posts.post_detail', post_id=post.id),
+                'reactions': reactions_map[post.id],
+                'your_reaction': your_reactions[post.id],
+            }
+            for post in posts
+        ],
+        html=render_template(template, posts=posts),
+        next_cursor=next_cursor,
+        **links
+    )
+
 
 @posts_bp.route('/delete/<int:post_id>', methods=['POST'])
+@retry_on_lock
 def delete_post(post_id):
-    if not session.get('user_id'):
+    if not session.get('user_id') or g.get('current_user') is None:
         flash("You must be logged in to delete a post.")
         return redirect(url_for('auth.login'))
 
-    user = User.query.get(session['user_id'])
-    if not user or not getattr(user, 'is_admin', False):
+    if not g.current_user.is_admin:
         abort(403)  # Forbidden
 
     post = Post.query.get_or_404(post_id)
 
-    # Usuń obrazek jeśli istnieje
-    if getattr(post, 'image_url', None):
-        try:
-            abs_path = os.path.join(os.path.dirname(__file__), '..', post.image_url.lstrip('/'))
-            if os.path.exists(abs_path):
-                os.remove(abs_path)
-        except Exception as e:
-            print(f"Failed to delete image: {e}")
+    # Usuń obrazek i miniatury jeśli istnieją
+    delete_post_images(post.id, post.image_url)
+
+    author_login = post.author.login
+    tag_names = [tag.name for tag in post.hashtags]
+    record_hashtags([tag.id for tag in post.hashtags], -1)
+    # The author and everyone who commented lose counters along with the post
+    affected_users = {post.author_id: author_login}
+    affected_users.update(
+        db.session.query(User.id, User.login)
+        .join(Comment, Comment.author_id == User.id)
+        .filter(Comment.post_id == post.id)
+        .distinct()
+    )
 
     # Usuń post
     db.session.delete(post)
+    refresh_user_stats(affected_users)
     db.session.commit()
+    invalidate_listings(author_login, tag_names)
+    # Their profiles show the counters and link the deleted comments
+    cache.invalidate(*[f'profile:{login}' for login in affected_users.values()])
 
     flash("Post deleted successfully.")
     return redirect(url_for('posts.index'))
+
+
+@posts_bp.app_errorhandler(413)
+def upload_too_large(e):
+    """The request body exceeded MAX_CONTENT_LENGTH (an oversized upload)."""
+    flash(f"Image is too large (max {current_app.config['IMAGE_MAX_BYTES'] // (1024 * 1024)} MB).")
+    return redirect(request.referrer or url_for('posts.index'))
+
+
+@posts_bp.route('/cache/stats')
+@stats_view
+def cache_stats():
+    """Hit and miss counters of this worker's cache."""
+    return jsonify(cache.stats())
+
+
+@posts_bp.route('/jobs/stats')
+@stats_view
+def job_stats():
+    """Background job backlog (shared by all workers)."""
+    return jsonify(job_backlog())
@@ -0,0 +1,50 @@
+from flask import Blueprint, render_template, request, jsonify, url_for
+
+from app.services.search import search
+
+search_bp = Blueprint('search', __name__)
+
+
+@search_bp.route('/search')
+def search_page():
+    query = request.args.get('q', '').strip()
+    page = request.args.get('page', 1, type=int)
+    results, has_next = search(query, page) if query else ([], False)
+
+    return render_template(
+        'search.html',
+        query=query,
+        results=results,
+        page=page,
+        has_next=has_next
+    )
+
+
+@search_bp.route('/api/search')
+def search_api():
+    query = request.args.get('q', '').strip()
+    page = request.args.get('page', 1, type=int)
+    results, has_next = search(query, page) if query else ([], False)
+
+    return jsonify(
+        query=query,
+        page=page,
+        results=[
+            {
+                'kind': result['kind'],
+                'post_id': result['post_id'],
+                'comment_id': result['comment_id'],
+                'title': str(result['title']),
+                'snippet': str(result['snippet']),
+                'url': _result_url(result),
+            }
+            for result in results
+        ],
+        next_page_url=url_for('search.search_api', q=query, page=page + 1) if has_next else None
+    )
+
+
+def _result_url(result):
+    if result['comment_id']:
+        return url_for('posts.comment_thread', post_id=result['post_id'], comment_id=result['comment_id'])
+    return url_for('posts.post_detail', post_id=result['post_id'])
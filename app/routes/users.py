@@ -1,39 +1,72 @@
-from flask import Blueprint, render_template, abort, session, redirect, url_for, request, flash
-from app.models import User, Post
-from app.extensions import db
-import os
-from werkzeug.utils import secure_filename
+from flask import Blueprint, render_template, abort, session, redirect, url_for, request, flash, g, jsonify
+from sqlalchemy.orm import joinedload
+from app.models import User, UserStats
+from app.extensions import db, cache
+from app.database import retry_on_lock
+from app.services.activity import activity_page
+from app.services.cache import cached_page
+from app.services.current_user import logout_user
+from app.services.images import UploadError, save_upload
 
 users_bp = Blueprint('users', __name__, url_prefix="/users")
 
 
+def activity_links(next_cursor, login):
+    """Links to the next timeline page, like `pagination_links`."""
+    if not next_cursor:
+        return {'next_page_url': None, 'next_api_url': None}
+    return {
+        'next_page_url': url_for('users.profile', login=login, cursor=next_cursor),
+        'next_api_url': url_for('users.activity_api', login=login, cursor=next_cursor),
+    }
+
+
 @users_bp.route('/<login>')
+@cached_page(lambda login: f'profile:{login}')
 def profile(login):
-    user = User.query.filter_by(login=login).first()
+    user = (
+        User.query
+        .filter_by(login=login)
+        .options(joinedload(User.stats))
+        .first()
+    )
     if not user:
         abort(404)
 
-    posts = (
-        Post.query
-        .filter_by(author_id=user.id)
-        .order_by(Post.created_at.desc())
-        .all()
-    )
+    # Posts and comments of the user, newest first
+    items, next_cursor = activity_page(user.id, request.args.get('cursor'))
 
     return render_template(
         'users/profile.html',
         user=user,
-        posts=posts
+        stats=user.stats or UserStats(post_count=0, comment_count=0, plus_received=0, minus_received=0),
+        items=items,
+        **activity_links(next_cursor, user.login)
+    )
+
+
+@users_bp.route('/<login>/activity')
+def activity_api(login):
+    """The next page of a profile's activity timeline as JSON (see posts_api)."""
+    user = User.query.filter_by(login=login).first_or_404()
+    items, next_cursor = activity_page(user.id, request.args.get('cursor'), request.args.get('limit'))
+    return jsonify(
+        html=render_template('users/_activity_items.html', items=items),
+        next_cursor=next_cursor,
+        **activity_links(next_cursor, user.login)
     )
 
 
 @users_bp.route('/edit', methods=['GET', 'POST'])
+@retry_on_lock
 def edit_profile():
-    if not session.get('user_id'):
+    identity = g.get('current_user')
+    user = identity.load() if identity else None
+    if not session.get('user_id') or user is None:
+        # Also when the account was deleted since the identity was refreshed
+        logout_user()
         return redirect(url_for('auth.login'))
 
-    user = User.query.get(session['user_id'])
-
     # --- Additional security check ---
     # If a user_id is provided (e.g. ?id=...) or the user attempts
     # to edit someone else's profile (not possible in this app yet,
@@ -49,14 +82,15 @@ def edit_profile():
 
         file = request.files.get('profile_image')
         if file and file.filename:
-            ext = os.path.splitext(file.filename)[1]
-            filename = f'profile_{user.id}{ext}'
-            static_path = os.path.join('static', 'img', filename)
-            abs_path = os.path.join(os.path.dirname(__file__), '..', static_path)
-            file.save(abs_path)
-            user.profile_image = '/' + static_path.replace('\\', '/')
+            try:
+                user.profile_image = save_upload(file, f'profile_{user.id}')
+            except UploadError as e:
+                db.session.rollback()
+                flash(str(e))
+                return redirect(url_for('users.edit_profile'))
 
         db.session.commit()
+        cache.invalidate(f'profile:{user.login}')
         flash('Profile updated successfully!')
         return redirect(url_for('users.edit_profile'))
 
@@ -0,0 +1,88 @@
+"""Profile activity timeline: a user's posts and comments, newest first.
+
+Both tables are read through their `(author_id, created_at, id)` index,
+each limited to one page, and merged with UNION ALL, so a page costs the
+same for a user with ten posts and one with a hundred thousand. Pages
+are keyset-paginated on `(created_at, kind, id)`; at equal timestamps
+posts come before comments.
+"""
+from flask import abort
+from sqlalchemy import func, literal, or_, select, union_all
+from sqlalchemy.orm import joinedload
+
+from app.extensions import db
+from app.models import Post, Comment
+from app.services.metrics import timed
+from app.services.pagination import parse_datetime, decode_cursor, encode_cursor, page_size, split_page
+
+KINDS = {'post': Post, 'comment': Comment}
+
+
+def _branch(kind, user_id, after, limit):
+    model = KINDS[kind]
+    query = select(
+        literal(kind).label('kind'),
+        model.id.label('id'),
+        model.created_at.label('created_at'),
+    ).where(model.author_id == user_id)
+
+    if after is not None:
+        created_at, last_kind, last_id = after
+        # The stored timestamp of the last item, see chronological_query
+        last_created_at = func.coalesce(
+            select(KINDS[last_kind].created_at).where(KINDS[last_kind].id == last_id).scalar_subquery(),
+            parse_datetime(created_at)
+        )
+        if kind < last_kind:
+            query = query.where(model.created_at <= last_created_at)
+        elif kind == last_kind:
+            # Spelled as a range on created_at so the index can seek to it
+            query = query.where(
+                model.created_at <= last_created_at,
+                or_(model.created_at < last_created_at, model.id < last_id)
+            )
+        else:
+            query = query.where(model.created_at < last_created_at)
+
+    return query.order_by(model.created_at.desc(), model.id.desc()).limit(limit).subquery(f'{kind}_page')
+
+
+def activity_query(user_id, after=None, limit=21):
+    """Query yielding `(kind, id, created_at)` rows of one timeline page."""
+    branches = [_branch(kind, user_id, after, limit) for kind in KINDS]
+    merged = union_all(*[select(branch) for branch in branches]).subquery('activity')
+    return (
+        db.session.query(merged.c.kind, merged.c.id, merged.c.created_at)
+        .order_by(merged.c.created_at.desc(), merged.c.kind.desc(), merged.c.id.desc())
+        .limit(limit)
+    )
+
+
+@timed()
+def activity_page(user_id, cursor=None, per_page=None):
+    """Returns `(items, next_cursor)`; items are `(kind, post_or_comment)` pairs."""
+    per_page = page_size(per_page)
+    after = decode_cursor(cursor, 3)
+    if after is not None and (after[1] not in KINDS or not isinstance(after[2], int)):
+        abort(400)
+
+    rows = activity_query(user_id, after, per_page + 1).all()
+    rows, next_cursor = split_page(rows, per_page, lambda row: encode_cursor(row.created_at, row.kind, row.id))
+
+    ids = {kind: [row.id for row in rows if row.kind == kind] for kind in KINDS}
+    loaded = {'post': {}, 'comment': {}}
+    if ids['post']:
+        loaded['post'] = {
+            post.id: post for post in
+            Post.query.filter(Post.id.in_(ids['post'])).options(joinedload(Post.stats))
+        }
+    if ids['comment']:
+        loaded['comment'] = {
+            comment.id: comment for comment in
+            Comment.query.filter(Comment.id.in_(ids['comment'])).options(joinedload(Comment.post))
+        }
+    items = [
+        (row.kind, loaded[row.kind][row.id])
+        for row in rows if row.id in loaded[row.kind]
+    ]
+    return items, next_cursor
@@ -0,0 +1,182 @@
+"""Static files: fingerprinted URLs, long-lived caching and precompression.
+
+`url_for('static', ...)` (and the `asset` template filter for the image
+URLs stored in the database) appends `?v=<content hash>`. A request whose
+`v` matches the file's current hash is answered with an immutable
+one-year Cache-Control; anything else must revalidate with its ETag, so
+an overwritten profile picture shows up at once under its new URL.
+
+Files are sent with `flask.send_file`, which handles conditional GET and
+Range requests and passes the open file to the server's
+`wsgi.file_wrapper` (gunicorn uses sendfile(2) for it) or, with
+USE_X_SENDFILE, leaves the transfer to the front proxy. CSS and JS get
+.gz/.br siblings from `compress_static()` that are sent to clients
+accepting those encodings.
+"""
+import gzip
+import hashlib
+import logging
+import mimetypes
+import os
+
+from flask import current_app, request, send_file, abort, url_for
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:  # gzip variants only
+    brotli = None
+
+log = logging.getLogger(__name__)
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+IMMUTABLE = f'public, max-age={IMMUTABLE_MAX_AGE}, immutable'
+COMPRESSIBLE = ('.css', '.js', '.svg', '.json', '.txt')
+
+# Encodings in order of preference: (Content-Encoding, file suffix)
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+# path -> (mtime_ns, size, digest); recomputed when the file changes
+_fingerprints = {}
+
+
+def fingerprint(path):
+    """Short content hash of a file, or None if it does not exist."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+
+    cached = _fingerprints.get(path)
+    if cached and cached[:2] == (st.st_mtime_ns, st.st_size):
+        return cached[2]
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(64 * 1024), b''):
+            digest.update(chunk)
+    value = digest.hexdigest()[:12]
+    _fingerprints[path] = (st.st_mtime_ns, st.st_size, value)
+    return value
+
+
+def static_file_path(filename):
+    return safe_join(current_app.static_folder, filename)
+
+
+def asset_url(url):
+    """Fingerprinted version of a '/static/...' URL stored in the database."""
+    if not url:
+        return url
+    prefix = current_app.static_url_path + '/'
+    if not url.startswith(prefix):
+        return url
+    return url_for('static', filename=url[len(prefix):])
+
+
+def _add_fingerprint(endpoint, values):
+    if endpoint == 'static' and 'filename' in values and 'v' not in values:
+        path = static_file_path(values['filename'])
+        digest = fingerprint(path) if path else None
+        if digest:
+            values['v'] = digest
+
+
+def _compressed_variant(path):
+    """(path, encoding) of the best precompressed file the client accepts."""
+    if not path.endswith(COMPRESSIBLE):
+        return path, None
+
+    accepted = request.accept_encodings
+    source_mtime = os.stat(path).st_mtime_ns
+    for encoding, suffix in ENCODINGS:
+        if not accepted[encoding]:
+            continue
+        try:
+            # A variant older than its source is stale; skip it
+            if os.stat(path + suffix).st_mtime_ns >= source_mtime:
+                return path + suffix, encoding
+        except OSError:
+            pass
+    return path, None
+
+
+def serve_static(filename):
+    """Replacement for Flask's static view."""
+    path = static_file_path(filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+
+    digest = fingerprint(path)
+    fingerprinted = request.args.get('v') == digest
+    send_path, encoding = _compressed_variant(path)
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+    response = send_file(
+        send_path,
+        mimetype=mimetype,
+        conditional=True,
+        etag=f'{digest}-{encoding}' if encoding else digest,
+        max_age=IMMUTABLE_MAX_AGE if fingerprinted else 0
+    )
+
+    response.headers['Cache-Control'] = IMMUTABLE if fingerprinted else 'no-cache'
+    if path.endswith(COMPRESSIBLE):
+        response.vary.add('Accept-Encoding')
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def _write_atomic(path, data):
+    tmp_path = f'{path}.{os.getpid()}.part'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def compress_static(static_folder, force=False):
+    """Writes .gz (and with the brotli package .br) copies of CSS/JS files.
+
+    Up-to-date variants are left alone unless `force` is set. Returns the
+    list of written files.
+    """
+    written = []
+    for root, dirs, files in os.walk(static_folder):
+        for name in files:
+            if not name.endswith(COMPRESSIBLE):
+                continue
+            path = os.path.join(root, name)
+            source_mtime = os.stat(path).st_mtime_ns
+            data = None
+
+            for encoding, suffix in ENCODINGS:
+                if encoding == 'br' and brotli is None:
+                    continue
+                target = path + suffix
+                if not force and os.path.exists(target) and os.stat(target).st_mtime_ns >= source_mtime:
+                    continue
+                if data is None:
+                    with open(path, 'rb') as f:
+                        data = f.read()
+                if encoding == 'br':
+                    compressed = brotli.compress(data, quality=11)
+                else:
+                    compressed = gzip.compress(data, compresslevel=9, mtime=0)
+                _write_atomic(target, compressed)
+                written.append(target)
+    return written
+
+
+def init_assets(app):
+    """Installs the fingerprinting static view; precompresses CSS/JS if configured."""
+    app.url_defaults(_add_fingerprint)
+    app.jinja_env.filters['asset'] = asset_url
+    app.view_functions['static'] = serve_static
+
+    if app.config['STATIC_COMPRESS_ON_START']:
+        try:
+            compress_static(app.static_folder)
+        except OSError as e:
+            # e.g. a read-only image; `flask assets compress` can run at build time
+            log.warning('Could not precompress static files: %s', e)
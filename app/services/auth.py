@@ -0,0 +1,130 @@
+"""Password hashing and login throttling.
+
+Hashing is deliberately slow, so it runs in a small per-process thread
+pool (scrypt and pbkdf2 release the GIL) and at most
+PASSWORD_HASH_MAX_PENDING hashes may be running or waiting per process;
+beyond that the request fails fast with `HashingBusy` instead of tying up
+the worker. The cap only matters for threaded workers (the ASGI mode, see
+app/asgi.py): a sync gunicorn worker serves one request at a time, so it
+never has more than one hash in flight. Stored hashes made with other
+parameters than PASSWORD_HASH_METHOD are replaced on the next successful
+login.
+
+Attempts are counted in the cache backend per client IP (logins and
+registrations) and per login (failed logins) in fixed windows of
+LOGIN_RATE_WINDOW seconds. With the SQLite cache the counters are shared
+by all workers of the host; with CACHE_BACKEND=null there is no limit.
+Behind reverse proxies the client IP is taken from X-Forwarded-For, see
+`init_proxies`.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app, request
+from werkzeug.middleware.proxy_fix import ProxyFix
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from app.extensions import cache
+
+
+class HashingBusy(RuntimeError):
+    """Too many password hashes are in progress in this process."""
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+_pending = None
+# Normalized method prefix and a hash to check unknown logins against, per method
+_method_ids = {}
+_dummy_hashes = {}
+
+
+def _hash_params():
+    config = current_app.config
+    return config['PASSWORD_HASH_METHOD'], config['PASSWORD_SALT_LENGTH']
+
+
+def _offload(fn, *args):
+    """Runs `fn(*args)` in the hashing pool and waits for the result."""
+    global _pool, _pool_pid, _pending
+    with _pool_lock:
+        if _pool_pid != os.getpid():
+            # A pool inherited through a fork has no threads
+            _pool = ThreadPoolExecutor(current_app.config['PASSWORD_HASH_WORKERS'], 'password-hash')
+            _pending = threading.BoundedSemaphore(current_app.config['PASSWORD_HASH_MAX_PENDING'])
+            _pool_pid = os.getpid()
+        pool, pending = _pool, _pending
+
+    if not pending.acquire(blocking=False):
+        raise HashingBusy('too many password hashes in progress')
+    try:
+        return pool.submit(fn, *args).result()
+    finally:
+        pending.release()
+
+
+def hash_password(password):
+    """A new hash of `password` with the configured parameters."""
+    method, salt_length = _hash_params()
+    return _offload(generate_password_hash, password, method, salt_length)
+
+
+def _method_id(method, salt_length):
+    # werkzeug expands defaults ('scrypt' -> 'scrypt:32768:8:1'); compare the expanded form
+    if method not in _method_ids:
+        _method_ids[method] = _offload(generate_password_hash, '', method, salt_length).split('$', 1)[0]
+    return _method_ids[method]
+
+
+def verify_password(user, password):
+    """Checks `password` against `user` (None for an unknown login).
+
+    Unknown logins are checked against a dummy hash so that they take as
+    long as wrong passwords. A correct password stored with outdated
+    parameters is rehashed; the caller commits.
+    """
+    method, salt_length = _hash_params()
+    if user is None:
+        if method not in _dummy_hashes:
+            _dummy_hashes[method] = _offload(generate_password_hash, os.urandom(16).hex(), method, salt_length)
+        _offload(check_password_hash, _dummy_hashes[method], password)
+        return False
+
+    if not _offload(check_password_hash, user.password_hash, password):
+        return False
+    if user.password_hash.split('$', 1)[0] != _method_id(method, salt_length):
+        user.password_hash = hash_password(password)
+    return True
+
+
+def init_proxies(app):
+    """Reads the client address from the headers of TRUSTED_PROXIES reverse proxies.
+
+    Otherwise `request.remote_addr` is the proxy's address, and all clients
+    share one per-IP attempt counter.
+    """
+    hops = app.config['TRUSTED_PROXIES']
+    if hops:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=hops, x_proto=hops)
+
+
+def _window():
+    return current_app.config['LOGIN_RATE_WINDOW']
+
+
+def count_attempt():
+    """Counts a login or registration attempt of the client IP; False once over the limit."""
+    attempts = cache.backend.incr(f'ratelimit:ip:{request.remote_addr}', _window())
+    return attempts <= current_app.config['LOGIN_ATTEMPTS_PER_IP']
+
+
+def login_locked(login):
+    """Whether `login` had too many failed attempts in the current window."""
+    failures = cache.backend.get(f'ratelimit:login:{login.lower()}') or 0
+    return failures >= current_app.config['LOGIN_FAILURES_PER_LOGIN']
+
+
+def record_failure(login):
+    cache.backend.incr(f'ratelimit:login:{login.lower()}', _window())
@@ -0,0 +1,284 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import current_app, make_response, request, session
+
+
+class NullBackend:
+    """Backend that never stores anything (CACHE_BACKEND = 'null')."""
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value, timeout):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def incr(self, key, timeout=None):
+        return 1
+
+
+class LRUBackend:
+    """In-process LRU cache (CACHE_BACKEND = 'lru').
+
+    Each gunicorn worker has its own copy, so invalidations done by one
+    worker are not seen by the others until the entries expire. Use the
+    SQLite backend when running several workers.
+    """
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        # Counters (namespace versions, rate limits) are kept apart so that
+        # they are never evicted by regular entries.
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key in self._counters:
+                value, expires_at = self._counters[key]
+                if expires_at is not None and expires_at < time.time():
+                    return None
+                return value
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at is not None and expires_at < time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout):
+        expires_at = time.time() + timeout if timeout else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+            self._counters.pop(key, None)
+
+    def incr(self, key, timeout=None):
+        now = time.time()
+        with self._lock:
+            value, expires_at = self._counters.get(key, (0, None))
+            if expires_at is not None and expires_at < now:
+                value, expires_at = 0, None
+            if expires_at is None and timeout:
+                expires_at = now + timeout
+            self._counters[key] = (value + 1, expires_at)
+            if len(self._counters) > self.max_entries:
+                self._counters = {
+                    k: item for k, item in self._counters.items()
+                    if item[1] is None or item[1] >= now
+                }
+            return value + 1
+
+
+class SQLiteBackend:
+    """Cache stored in a local SQLite file (CACHE_BACKEND = 'sqlite').
+
+    Shared by every worker process on the host, so invalidations are
+    visible everywhere immediately. Values are pickled; counters created
+    by `incr` are stored as plain integers so they can be updated in SQL.
+    """
+
+    PURGE_EVERY = 500
+
+    def __init__(self, path, max_entries=10000):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._writes = 0
+        with self._connect() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS cache ('
+                ' key TEXT PRIMARY KEY,'
+                ' value BLOB,'
+                ' expires_at REAL)'
+            )
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            # Connections must not be shared across a fork (gunicorn preload)
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key):
+        row = self._connect().execute(
+            'SELECT value, expires_at FROM cache WHERE key = ?', (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        value, expires_at = row
+        if expires_at is not None and expires_at < time.time():
+            return None
+        return pickle.loads(value) if isinstance(value, bytes) else value
+
+    def set(self, key, value, timeout):
+        expires_at = time.time() + timeout if timeout else None
+        conn = self._connect()
+        conn.execute(
+            'INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)',
+            (key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), expires_at)
+        )
+        self._writes += 1
+        if self._writes % self.PURGE_EVERY == 0:
+            self._purge(conn)
+
+    def delete(self, key):
+        self._connect().execute('DELETE FROM cache WHERE key = ?', (key,))
+
+    def incr(self, key, timeout=None):
+        now = time.time()
+        expires_at = now + timeout if timeout else None
+        row = self._connect().execute(
+            'INSERT INTO cache (key, value, expires_at) VALUES (?, 1, ?) '
+            'ON CONFLICT (key) DO UPDATE SET '
+            ' value = CASE WHEN expires_at < ? THEN 1 ELSE value + 1 END,'
+            ' expires_at = CASE WHEN expires_at < ? THEN excluded.expires_at ELSE expires_at END '
+            'RETURNING value',
+            (key, expires_at, now, now)
+        ).fetchone()
+        return row[0]
+
+    def _purge(self, conn):
+        conn.execute('DELETE FROM cache WHERE expires_at < ?', (time.time(),))
+        conn.execute(
+            'DELETE FROM cache WHERE key IN ('
+            ' SELECT key FROM cache WHERE expires_at IS NOT NULL'
+            ' ORDER BY expires_at LIMIT max(0, (SELECT count(*) FROM cache) - ?))',
+            (self.max_entries,)
+        )
+
+
+class Cache:
+    """Response and fragment cache with namespace-based invalidation.
+
+    Keys are grouped in namespaces (e.g. 'feed', 'hashtag:python'). Every
+    namespace has a version number stored in the backend and included in
+    its keys, so `invalidate('feed')` drops all feed entries at once by
+    bumping the version instead of deleting them one by one.
+    """
+
+    def __init__(self, app=None):
+        self.backend = NullBackend()
+        self.default_timeout = 300
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        kind = app.config['CACHE_BACKEND']
+        if kind == 'lru':
+            self.backend = LRUBackend(app.config['CACHE_MAX_ENTRIES'])
+        elif kind == 'sqlite':
+            self.backend = SQLiteBackend(app.config['CACHE_SQLITE_PATH'], app.config['CACHE_MAX_ENTRIES'])
+        elif kind == 'null':
+            self.backend = NullBackend()
+        else:
+            raise RuntimeError(f"Unknown CACHE_BACKEND: {kind!r}")
+        self.default_timeout = app.config['CACHE_DEFAULT_TIMEOUT']
+        app.extensions['cache'] = self
+
+    def key(self, namespace, *parts):
+        """Builds a key inside `namespace`, tied to its current version."""
+        version = self.backend.get(f'ns:{namespace}') or 0
+        return ':'.join([namespace, str(version), *map(str, parts)])
+
+    def get(self, key):
+        value = self.backend.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, key, value, timeout=None):
+        self.backend.set(key, value, self.default_timeout if timeout is None else timeout)
+
+    def get_or_set(self, key, compute, timeout=None):
+        """Returns the cached value of `key`, computing and storing it on a miss."""
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.set(key, value, timeout)
+        return value
+
+    def invalidate(self, *namespaces):
+        """Drops every entry of the given namespaces."""
+        for namespace in set(namespaces):
+            self.backend.incr(f'ns:{namespace}')
+            self.invalidations += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'backend': type(self.backend).__name__,
+            'pid': os.getpid(),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+            'invalidations': self.invalidations,
+        }
+
+
+def cached_page(namespace, timeout=None):
+    """Caches the rendered response of a GET view for anonymous visitors.
+
+    `namespace` is a namespace name, a tuple of them, or a function receiving
+    the view arguments and returning either; the page is dropped when any of
+    its namespaces is invalidated.
+    Logged-in users and requests with pending flash messages always get a
+    fresh render since the page contains per-user content.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            cache = current_app.extensions['cache']
+            if request.method != 'GET' or session.get('user_id') or session.get('_flashes'):
+                return view(*args, **kwargs)
+
+            namespaces = namespace(**kwargs) if callable(namespace) else namespace
+            if isinstance(namespaces, str):
+                namespaces = (namespaces,)
+            key = '|'.join([cache.key(ns) for ns in namespaces] + ['page', request.full_path])
+            cached = cache.get(key)
+            if cached is not None:
+                body, status, mimetype = cached
+                response = make_response(body, status)
+                response.mimetype = mimetype
+                response.headers['X-Cache'] = 'HIT'
+                return response
+
+            response = make_response(view(*args, **kwargs))
+            if response.status_code == 200 and not response.direct_passthrough:
+                cache.set(
+                    key,
+                    (response.get_data(), response.status_code, response.mimetype),
+                    timeout
+                )
+            response.headers['X-Cache'] = 'MISS'
+            return response
+        return wrapper
+    return decorator
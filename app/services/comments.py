@@ -0,0 +1,151 @@
+from flask import current_app
+from sqlalchemy import func, literal, or_, select
+from sqlalchemy.orm import aliased, joinedload
+
+from app.extensions import db
+from app.models import Comment
+from app.services.metrics import timed
+
+
+class CommentNode:
+    """A comment and the part of its reply tree that gets rendered.
+
+    `more_replies` counts direct replies cut off by COMMENT_REPLIES_SHOWN and
+    `deeper_replies` the replies of a node sitting at COMMENT_MAX_DEPTH; the
+    template links both to the thread view of the comment.
+    """
+
+    def __init__(self, comment, depth):
+        self.comment = comment
+        self.depth = depth
+        self.replies = []
+        self.more_replies = 0
+        self.deeper_replies = 0
+
+
+@timed()
+def load_comment_page(post_id, after=None, per_page=None):
+    """Loads one page of top-level comments of a post with their reply trees.
+
+    Top-level comments are paged by id (oldest first, keyset on `after`).
+    Returns `(nodes, next_after)` where `next_after` is None on the last page.
+    """
+    per_page = per_page or current_app.config['COMMENTS_PER_PAGE']
+
+    root_ids = [row[0] for row in top_level_comments_query(post_id, after).limit(per_page + 1)]
+
+    next_after = None
+    if len(root_ids) > per_page:
+        root_ids = root_ids[:per_page]
+        next_after = root_ids[-1]
+
+    return build_comment_tree(root_ids), next_after
+
+
+def top_level_comments_query(post_id, after=None):
+    """Ids of the top-level comments of a post, oldest first, after comment id `after`."""
+    query = db.session.query(Comment.id).filter(
+        Comment.post_id == post_id,
+        Comment.parent_id.is_(None)
+    )
+    if after is not None:
+        query = query.filter(Comment.id > after)
+    return query.order_by(Comment.id)
+
+
+def comment_tree_query(root_ids, max_depth, replies_shown, all_root_replies=False):
+    """`(comment, depth)` rows of the subtrees below `root_ids`, parents first.
+
+    Uses a recursive CTE, so the whole tree is fetched in one statement.
+    The CTE carries the comment columns itself: joining it back to
+    `comment` lets SQLite scan the whole table once ANALYZE has run. Only
+    the first `replies_shown` replies of each comment are followed (all
+    replies of the roots with `all_root_replies`), down to `max_depth`.
+    """
+    comment = Comment.__table__
+    tree = (
+        select(*comment.c, literal(0).label('depth'))
+        .where(comment.c.id.in_(root_ids))
+        .cte('comment_tree', recursive=True)
+    )
+    reply = comment.alias('reply')
+    sibling = comment.alias('sibling')
+    # SQLite allows no window functions (ROW_NUMBER) in the recursive step;
+    # a LIMITed lookup of the parent_id index picks the same replies
+    shown = reply.c.id.in_(
+        select(sibling.c.id)
+        .where(sibling.c.parent_id == tree.c.id)
+        .order_by(sibling.c.id)
+        .limit(replies_shown)
+    )
+    if all_root_replies:
+        shown = or_(tree.c.depth == 0, shown)
+    tree = tree.union_all(
+        select(*reply.c, tree.c.depth + 1)
+        .where(reply.c.parent_id == tree.c.id, tree.c.depth < max_depth, shown)
+    )
+
+    node = aliased(Comment, tree)
+    return (
+        db.session.query(node, tree.c.depth)
+        .options(joinedload(node.author))
+        .order_by(tree.c.depth, tree.c.id)
+    )
+
+
+@timed()
+def load_comment_thread(comment_id):
+    """Loads a single comment as the root of its own tree, with all direct replies shown."""
+    nodes = build_comment_tree([comment_id], all_root_replies=True)
+    return nodes[0] if nodes else None
+
+
+def build_comment_tree(root_ids, max_depth=None, replies_shown=None, all_root_replies=False):
+    """Loads the subtrees below `root_ids` and links them in memory.
+
+    The comments shown, down to `max_depth` levels below the roots and
+    `replies_shown` replies per comment, come from a single recursive CTE
+    (see `comment_tree_query`), and the tree is assembled in O(n). One
+    more grouped query counts the replies that were cut off. Returns the
+    root nodes in the order of `root_ids`.
+    """
+    if not root_ids:
+        return []
+    if max_depth is None:
+        max_depth = current_app.config['COMMENT_MAX_DEPTH']
+    if replies_shown is None:
+        replies_shown = current_app.config['COMMENT_REPLIES_SHOWN']
+
+    rows = comment_tree_query(root_ids, max_depth, replies_shown, all_root_replies).all()
+
+    nodes = {}
+    for comment, depth in rows:
+        node = CommentNode(comment, depth)
+        if depth > 0:
+            parent = nodes.get(comment.parent_id)
+            if parent is None:
+                continue
+            parent.replies.append(node)
+        nodes[comment.id] = node
+
+    # Only comments at the depth limit or with a full set of replies
+    # shown can have replies that were not loaded
+    cut = [
+        node.comment.id for node in nodes.values()
+        if node.depth == max_depth
+        or (len(node.replies) == replies_shown and not (all_root_replies and node.depth == 0))
+    ]
+    if cut:
+        counts = (
+            db.session.query(Comment.parent_id, func.count(Comment.id))
+            .filter(Comment.parent_id.in_(cut))
+            .group_by(Comment.parent_id)
+        )
+        for parent_id, count in counts:
+            node = nodes[parent_id]
+            if node.depth == max_depth:
+                node.deeper_replies = count
+            else:
+                node.more_replies = count - len(node.replies)
+
+    return [nodes[root_id] for root_id in root_ids if root_id in nodes]
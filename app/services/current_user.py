@@ -0,0 +1,81 @@
+"""The logged-in user of the current request.
+
+Logging in stores a small identity (id, login, is_admin) in the signed
+session cookie, so a request knows who is logged in without a query.
+The identity is refreshed from the database once it is older than
+SESSION_IDENTITY_TTL seconds, which bounds how long a revoked admin flag
+or a deleted account keeps working. Views that need the `User` row call
+`g.current_user.load()`; it is queried at most once per request. Static
+files skip all of this (and thus never touch the session).
+"""
+import time
+
+from flask import current_app, g, request, session
+
+from app.extensions import db
+from app.models import User
+
+SESSION_KEYS = ('user_id', 'user_login', 'is_admin', 'identity_at')
+
+
+class Identity:
+    """Who is logged in, as stored in the session."""
+
+    __slots__ = ('id', 'login', 'is_admin', '_user')
+
+    def __init__(self, id, login, is_admin, user=None):
+        self.id = id
+        self.login = login
+        self.is_admin = is_admin
+        self._user = user
+
+    def load(self):
+        """The full `User` row (one query, then reused for the request)."""
+        if self._user is None:
+            self._user = db.session.get(User, self.id)
+        return self._user
+
+    def __repr__(self):
+        return f'<Identity {self.id} {self.login}>'
+
+
+def login_user(user):
+    session['user_id'] = user.id
+    session['user_login'] = user.login
+    session['is_admin'] = bool(user.is_admin)
+    session['identity_at'] = int(time.time())
+
+
+def logout_user():
+    for key in SESSION_KEYS:
+        session.pop(key, None)
+
+
+def current_identity():
+    """The identity of the session, refreshed from the database when it is stale."""
+    user_id = session.get('user_id')
+    if not user_id:
+        return None
+
+    user = None
+    if time.time() - session.get('identity_at', 0) > current_app.config['SESSION_IDENTITY_TTL']:
+        user = db.session.get(User, user_id)
+        if user is None:
+            logout_user()
+            return None
+        login_user(user)
+    return Identity(user_id, session.get('user_login'), session.get('is_admin', False), user)
+
+
+def init_current_user(app):
+    """Sets `g.current_user` (an Identity or None) and exposes it to templates."""
+
+    @app.before_request
+    def load_current_user():
+        if request.endpoint == 'static':
+            return
+        g.current_user = current_identity()
+
+    @app.context_processor
+    def inject_current_user():
+        return {'current_user': g.get('current_user')}
@@ -0,0 +1,212 @@
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import case, func, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+
+from app.extensions import db, cache
+from app.models import Post, Hashtag, post_hashtag
+
+TrendingTag = namedtuple('TrendingTag', 'id name score')
+
+MAX_NAME_LENGTH = Hashtag.__table__.c.name.type.length
+# First versions that accept WITH ... AS MATERIALIZED
+MATERIALIZED_CTE_VERSIONS = {'sqlite': (3, 35), 'postgresql': (12,)}
+
+
+def normalize_hashtags(names):
+    """Lower-cased, de-duplicated tag names (without '#') in their original order."""
+    result = []
+    for name in names:
+        name = name.lstrip('#').strip().lower()[:MAX_NAME_LENGTH]
+        if name and name not in result:
+            result.append(name)
+    return result
+
+
+def _insert_missing(names):
+    """INSERT ... ON CONFLICT DO NOTHING for new hashtags; returns {name: id} of the inserted rows."""
+    rows = [{'name': name, 'post_count': 0} for name in names]
+    dialect = db.engine.dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        insert = sqlite.insert if dialect == 'sqlite' else postgresql.insert
+        stmt = (
+            insert(Hashtag.__table__)
+            .on_conflict_do_nothing(index_elements=['name'])
+            .returning(Hashtag.__table__.c.id, Hashtag.__table__.c.name)
+        )
+        return dict((name, tag_id) for tag_id, name in db.session.execute(stmt, rows))
+
+    # Other databases: one savepoint per tag so a concurrent insert only skips that tag
+    inserted = {}
+    for row in rows:
+        try:
+            with db.session.begin_nested():
+                result = db.session.execute(Hashtag.__table__.insert().values(**row))
+            inserted[row['name']] = result.inserted_primary_key[0]
+        except IntegrityError:
+            pass
+    return inserted
+
+
+def resolve_hashtags(names):
+    """Returns {name: id} for `names`, creating the missing hashtags.
+
+    One SELECT for the existing tags and, only if some are new, one
+    INSERT ... ON CONFLICT DO NOTHING. A tag created by another worker in
+    between is picked up by a final SELECT, so concurrent posts with the
+    same new tag do not fail on the unique name.
+    """
+    names = normalize_hashtags(names)
+    if not names:
+        return {}
+
+    def select(names):
+        rows = db.session.query(Hashtag.name, Hashtag.id).filter(Hashtag.name.in_(names))
+        return dict(rows.all())
+
+    tags = select(names)
+    missing = [name for name in names if name not in tags]
+    if missing:
+        tags.update(_insert_missing(missing))
+        lost_race = [name for name in missing if name not in tags]
+        if lost_race:
+            tags.update(select(lost_race))
+    return {name: tags[name] for name in names}
+
+
+def attach_hashtags(post, names):
+    """Tags a flushed post in bulk and updates the counters. Returns the tag names.
+
+    Writes the post_hashtag rows directly, so it is meant for new posts
+    whose `hashtags` collection has not been loaded.
+    """
+    tags = resolve_hashtags(names)
+    if tags:
+        db.session.execute(
+            post_hashtag.insert(),
+            [{'post_id': post.id, 'hashtag_id': tag_id} for tag_id in tags.values()]
+        )
+        record_hashtags(list(tags.values()))
+    return list(tags)
+
+
+def record_hashtags(tag_ids, delta=1):
+    """Shifts `Hashtag.post_count` after posts were tagged (or deleted).
+
+    Runs inside the current transaction; pending hashtags must already be
+    flushed so that they have ids.
+    """
+    if not tag_ids:
+        return
+    (
+        Hashtag.query
+        .filter(Hashtag.id.in_(tag_ids))
+        .update(
+            {Hashtag.post_count: Hashtag.post_count + delta},
+            synchronize_session=False
+        )
+    )
+
+
+def count_posts_per_hashtag():
+    """Recounts hashtag usage from post_hashtag: dict of hashtag_id -> posts."""
+    rows = (
+        db.session.query(post_hashtag.c.hashtag_id, func.count(post_hashtag.c.post_id))
+        .group_by(post_hashtag.c.hashtag_id)
+    )
+    return dict(rows.all())
+
+
+def find_hashtag_drift():
+    """Returns `(hashtag, stored, expected)` for every counter that is off."""
+    counts = count_posts_per_hashtag()
+    return [
+        (tag, tag.post_count, counts.get(tag.id, 0))
+        for tag in Hashtag.query.order_by(Hashtag.id)
+        if tag.post_count != counts.get(tag.id, 0)
+    ]
+
+
+def rebuild_hashtag_counts(drift=None):
+    """Fixes the counters reported by `find_hashtag_drift`."""
+    if drift is None:
+        drift = find_hashtag_drift()
+    for tag, stored, expected in drift:
+        tag.post_count = expected
+    db.session.commit()
+    cache.invalidate('hashtags')
+    return drift
+
+
+def trending_weight(now):
+    """SQL weight of a post in the trending score: 1 today, halved for every day of age."""
+    days = current_app.config['TRENDING_WINDOW_DAYS']
+    whens = [
+        (Post.created_at > now - timedelta(days=age + 1), 0.5 ** age)
+        for age in range(days)
+    ]
+    return case(*whens, else_=0)
+
+
+def _materialized(cte):
+    """Asks the database to compute `cte` once before joining it, where it supports the hint."""
+    dialect = db.engine.dialect
+    minimum = MATERIALIZED_CTE_VERSIONS.get(dialect.name)
+    if minimum and dialect.server_version_info and dialect.server_version_info >= minimum:
+        return cte.prefix_with('MATERIALIZED')
+    return cte
+
+
+def trending_query(limit, now=None):
+    """Ranks hashtags by the decayed number of posts within the trending window.
+
+    The posts newer than the window are read first, as a range of the
+    created_at index, then their tags are looked up by post_id and the
+    scores summed per tag; only the winners are joined to `Hashtag`. The
+    cost follows recent activity, not the total post count or tag usage.
+    The recent posts are a MATERIALIZED CTE: inlined, SQLite prefers to
+    scan all of post_hashtag in hashtag order to save the GROUP BY sort.
+    """
+    now = now or datetime.now()
+    cutoff = now - timedelta(days=current_app.config['TRENDING_WINDOW_DAYS'])
+    recent = _materialized(
+        select(Post.id.label('post_id'), trending_weight(now).label('weight'))
+        .where(Post.created_at > cutoff)
+        .cte('recent_posts')
+    )
+    scores = (
+        select(post_hashtag.c.hashtag_id, func.sum(recent.c.weight).label('score'))
+        .select_from(recent)
+        .join(post_hashtag, post_hashtag.c.post_id == recent.c.post_id)
+        .group_by(post_hashtag.c.hashtag_id)
+        .subquery('trending_scores')
+    )
+    return (
+        db.session.query(Hashtag.id, Hashtag.name, scores.c.score)
+        .join(scores, scores.c.hashtag_id == Hashtag.id)
+        .order_by(scores.c.score.desc(), Hashtag.id)
+        .limit(limit)
+    )
+
+
+def compute_trending(limit, now=None):
+    return [
+        TrendingTag(tag_id, name, round(value, 2))
+        for tag_id, name, value in trending_query(limit, now)
+    ]
+
+
+def trending_hashtags(limit=5):
+    """The precomputed trending list shown in the sidebar.
+
+    Recomputed at most every TRENDING_REFRESH seconds (per cache backend,
+    i.e. once for all workers with the SQLite cache), not on post changes.
+    """
+    return cache.get_or_set(
+        cache.key('trending', limit),
+        lambda: compute_trending(limit),
+        current_app.config['TRENDING_REFRESH']
+    )
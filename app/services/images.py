@@ -0,0 +1,184 @@
+"""Image uploads: size-capped streaming to disk and background thumbnails.
+
+Uploads are copied to `static/img` in small chunks, so a request never
+holds a whole file in memory and stops reading as soon as the configured
+cap is exceeded. Resizing happens afterwards in a background job (see
+app.services.jobs): the request only queues it, and the job stores
+`Post.thumbnail_url` once the JPEG and WebP thumbnails exist. Until then
+(or when Pillow is not installed) templates fall back to the original image.
+"""
+import logging
+import os
+
+from flask import current_app
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # thumbnails are optional, uploads still work
+    Image = None
+
+from app.extensions import db, cache
+from app.models import Post
+from app.services.jobs import enqueue, job_handler
+from app.services.metrics import timed
+
+log = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+THUMB_DIR = 'thumbs'
+
+
+class UploadError(ValueError):
+    """The upload was rejected; the message is shown to the user."""
+
+
+def image_dir():
+    return os.path.join(current_app.static_folder, 'img')
+
+
+def static_url(path):
+    """'/static/...' URL of a file below the static folder."""
+    rel = os.path.relpath(path, current_app.static_folder)
+    return current_app.static_url_path + '/' + rel.replace('\\', '/')
+
+
+def static_path(url):
+    """Filesystem path of a '/static/...' URL (the inverse of static_url)."""
+    rel = url[len(current_app.static_url_path):].lstrip('/')
+    return os.path.join(current_app.static_folder, rel)
+
+
+def save_upload(file, basename):
+    """Streams an uploaded image to static/img/<basename><ext>, returns its URL.
+
+    Raises UploadError for unsupported extensions or files larger than
+    IMAGE_MAX_BYTES. The file is written under a temporary name and
+    renamed when complete, so readers never see a partial image. The
+    upload is read from its start, since retry_on_lock may run the view
+    (and thus this copy) again.
+    """
+    ext = os.path.splitext(file.filename)[1].lower()
+    if ext not in current_app.config['IMAGE_EXTENSIONS']:
+        raise UploadError('Unsupported image format.')
+    if not file.stream.seekable():
+        raise UploadError('The upload cannot be read, please try again.')
+    file.stream.seek(0)
+
+    max_bytes = current_app.config['IMAGE_MAX_BYTES']
+    os.makedirs(image_dir(), exist_ok=True)
+    path = os.path.join(image_dir(), basename + ext)
+    tmp_path = f'{path}.{os.getpid()}.part'
+
+    written = 0
+    try:
+        with open(tmp_path, 'wb') as out:
+            while True:
+                chunk = file.stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                written += len(chunk)
+                if written > max_bytes:
+                    raise UploadError(
+                        f'Image is too large (max {max_bytes // (1024 * 1024)} MB).'
+                    )
+                out.write(chunk)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    return static_url(path)
+
+
+def thumbnail_paths(post_id):
+    """(jpeg, webp) paths of a post's thumbnail."""
+    base = os.path.join(image_dir(), THUMB_DIR, f'post_{post_id}')
+    return base + '.jpg', base + '.webp'
+
+
+@timed()
+def make_thumbnails(source, targets, max_size):
+    """Writes a downscaled copy of `source` to each of the `targets` paths.
+
+    The output format follows the target's extension. Transparent images
+    are flattened onto white, since JPEG has no alpha channel.
+    """
+    with Image.open(source) as img:
+        # Lets the JPEG decoder skip most of the work for large photos
+        img.draft('RGB', (max_size, max_size))
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((max_size, max_size), Image.LANCZOS)
+        if img.mode in ('RGBA', 'LA', 'P'):
+            img = img.convert('RGBA')
+            background = Image.new('RGB', img.size, 'white')
+            background.paste(img, mask=img.getchannel('A'))
+            img = background
+        elif img.mode != 'RGB':
+            img = img.convert('RGB')
+
+        for target in targets:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            tmp_path = f'{target}.{os.getpid()}.part'
+            if target.endswith('.webp'):
+                img.save(tmp_path, 'WEBP', quality=80, method=4)
+            else:
+                img.save(tmp_path, 'JPEG', quality=82, optimize=True, progressive=True)
+            os.replace(tmp_path, target)
+
+
+def process_post_image(post_id):
+    """Creates the thumbnails of a post and sets its thumbnail_url.
+
+    Does not commit. Returns the cache namespaces to invalidate after the
+    commit, or None when no thumbnail was made.
+    """
+    if Image is None:
+        return None
+
+    post = db.session.get(Post, post_id)
+    if not post or not post.image_url:
+        return None
+
+    jpeg_path, webp_path = thumbnail_paths(post.id)
+    try:
+        make_thumbnails(
+            static_path(post.image_url),
+            (jpeg_path, webp_path),
+            current_app.config['IMAGE_THUMB_SIZE']
+        )
+    except (OSError, Image.DecompressionBombError) as e:
+        log.warning('Could not create thumbnails for post %s: %s', post.id, e)
+        return None
+
+    post.thumbnail_url = static_url(jpeg_path)
+    return ['feed', f'profile:{post.author.login}'] + [f'hashtag:{tag.name}' for tag in post.hashtags]
+
+
+def schedule_post_image(post_id):
+    """Queues thumbnail generation for a post in the current transaction."""
+    if Image is not None:
+        enqueue('post_image', {'post_id': post_id})
+
+
+@job_handler('post_image')
+def create_post_thumbnails(payloads):
+    namespaces = set()
+    for payload in payloads:
+        namespaces.update(process_post_image(payload['post_id']) or ())
+    if namespaces:
+        return lambda: cache.invalidate(*namespaces)
+    return None
+
+
+def delete_post_images(post_id, image_url):
+    """Removes a post's original image and its thumbnails from disk."""
+    paths = list(thumbnail_paths(post_id))
+    if image_url:
+        paths.append(static_path(image_url))
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            log.warning('Failed to delete image %s: %s', path, e)
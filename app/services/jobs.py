@@ -0,0 +1,255 @@
+"""Durable background jobs stored in the `job` table.
+
+Write views call `enqueue()` inside their own transaction, so a job
+exists exactly when the change that caused it was committed. Worker
+threads (JOB_WORKER_THREADS per web process, or `flask jobs work` as a
+separate process) claim pending jobs in batches with a single UPDATE, run
+the handler registered for their kind once per batch and delete them in
+the same transaction as the handler's writes. A failing batch is retried
+with exponential backoff up to JOB_MAX_ATTEMPTS times and then kept with
+status 'failed' for inspection (`flask jobs status`, `/jobs/stats`).
+The same workers run the periodic tasks registered with `periodic_task`.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from flask import current_app, g, has_request_context
+from sqlalchemy import and_, func, or_, select, update
+
+from app.database import is_lock_error
+from app.extensions import db
+from app.models import Job
+from app.services.metrics import timed
+
+log = logging.getLogger(__name__)
+
+HANDLERS = {}
+# name -> (config key of the interval in seconds, fn)
+PERIODIC = {}
+
+_workers = []
+_workers_pid = None
+_workers_lock = threading.Lock()
+_wakeup = threading.Event()
+_next_runs = {}
+_periodic_lock = threading.Lock()
+
+
+def job_handler(kind):
+    """Registers `fn(payloads)` as the handler of a job kind.
+
+    The handler gets the payloads of one claimed batch, writes through
+    `db.session` without committing, and may return a callable that is run
+    once the batch has been committed (e.g. to invalidate caches).
+    """
+    def decorator(fn):
+        HANDLERS[kind] = fn
+        return fn
+    return decorator
+
+
+def periodic_task(name, interval_key):
+    """Registers `fn()` to run every `config[interval_key]` seconds in the workers.
+
+    Every process with workers runs it (an interval of 0 disables it), so
+    the task must be idempotent; it commits its own writes.
+    """
+    def decorator(fn):
+        PERIODIC[name] = (interval_key, fn)
+        return fn
+    return decorator
+
+
+def run_periodic():
+    """Runs the periodic tasks that are due in this process. Returns their names."""
+    now = time.monotonic()
+    with _periodic_lock:
+        due = [
+            name for name, (interval_key, fn) in PERIODIC.items()
+            if current_app.config[interval_key] > 0 and _next_runs.get(name, 0) <= now
+        ]
+        for name in due:
+            _next_runs[name] = now + current_app.config[PERIODIC[name][0]]
+
+    for name in due:
+        try:
+            PERIODIC[name][1]()
+        except Exception as e:
+            db.session.rollback()
+            if not is_lock_error(e):
+                log.exception('Periodic task %s failed', name)
+    return due
+
+
+def enqueue(kind, payload, delay=0):
+    """Adds a job to the current transaction; it runs after the commit."""
+    db.session.add(Job(
+        kind=kind,
+        payload=json.dumps(payload),
+        run_at=datetime.utcnow() + timedelta(seconds=delay)
+    ))
+    if has_request_context():
+        g.jobs_enqueued = True
+
+
+def claim(batch_size):
+    """Marks up to `batch_size` due jobs as running and returns them.
+
+    Jobs left 'running' for longer than JOB_LOCK_TIMEOUT (a worker died)
+    are claimed again.
+    """
+    now = datetime.utcnow()
+    stale = now - timedelta(seconds=current_app.config['JOB_LOCK_TIMEOUT'])
+    due = (
+        select(Job.id)
+        .where(or_(
+            and_(Job.status == 'pending', Job.run_at <= now),
+            and_(Job.status == 'running', Job.locked_at < stale),
+        ))
+        .order_by(Job.id)
+        .limit(batch_size)
+        .scalar_subquery()
+    )
+    rows = db.session.execute(
+        update(Job)
+        .where(Job.id.in_(due))
+        .values(status='running', locked_at=now, attempts=Job.attempts + 1)
+        .returning(Job.id, Job.kind, Job.payload, Job.attempts)
+        .execution_options(synchronize_session=False)
+    ).all()
+    db.session.commit()
+    return rows
+
+
+def _fail(rows, error):
+    """Schedules a retry of the failed jobs, or gives up after JOB_MAX_ATTEMPTS."""
+    config = current_app.config
+    now = datetime.utcnow()
+    for job_id, kind, payload, attempts in rows:
+        if attempts >= config['JOB_MAX_ATTEMPTS']:
+            values = {'status': 'failed', 'last_error': error}
+        else:
+            delay = config['JOB_RETRY_DELAY'] * 2 ** (attempts - 1)
+            values = {
+                'status': 'pending',
+                'run_at': now + timedelta(seconds=delay),
+                'last_error': error,
+            }
+        db.session.execute(
+            update(Job).where(Job.id == job_id).values(**values)
+            .execution_options(synchronize_session=False)
+        )
+    db.session.commit()
+
+
+@timed()
+def run_batch(batch_size=None):
+    """Claims and runs one batch of jobs. Returns the number of jobs claimed."""
+    rows = claim(batch_size or current_app.config['JOB_BATCH_SIZE'])
+
+    by_kind = defaultdict(list)
+    for row in rows:
+        by_kind[row.kind].append(row)
+
+    for kind, kind_rows in by_kind.items():
+        handler = HANDLERS.get(kind)
+        try:
+            if handler is None:
+                raise LookupError(f'no handler for job kind {kind!r}')
+            after_commit = handler([json.loads(row.payload) for row in kind_rows])
+            db.session.query(Job).filter(Job.id.in_([row.id for row in kind_rows])) \
+                .delete(synchronize_session=False)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            log.exception('%d %s job(s) failed', len(kind_rows), kind)
+            _fail(kind_rows, f'{type(e).__name__}: {e}')
+            continue
+        if after_commit:
+            after_commit()
+    return len(rows)
+
+
+def work(app, stop=None):
+    """Runs jobs until `stop` (a threading.Event) is set."""
+    stop = stop or threading.Event()
+    poll = app.config['JOB_POLL_INTERVAL']
+    while not stop.is_set():
+        with app.app_context():
+            run_periodic()
+            try:
+                claimed = run_batch()
+            except Exception as e:
+                db.session.rollback()
+                if not is_lock_error(e):
+                    log.exception('Job worker error')
+                claimed = 0
+        if not claimed:
+            _wakeup.wait(poll)
+            _wakeup.clear()
+
+
+def wake():
+    """Lets idle workers of this process look for new jobs right away."""
+    _wakeup.set()
+
+
+def start_workers(app):
+    """Starts JOB_WORKER_THREADS daemon threads in this process (again after a fork)."""
+    global _workers, _workers_pid
+    with _workers_lock:
+        if _workers_pid == os.getpid():
+            return
+        _workers = [
+            threading.Thread(target=work, args=(app,), name=f'jobs-{i}', daemon=True)
+            for i in range(app.config['JOB_WORKER_THREADS'])
+        ]
+        for thread in _workers:
+            thread.start()
+        _workers_pid = os.getpid()
+
+
+def backlog():
+    """Job counts by status and the age of the oldest due job, for monitoring."""
+    rows = (
+        db.session.query(Job.status, func.count(Job.id), func.min(Job.run_at))
+        .group_by(Job.status)
+        .all()
+    )
+    stats = {'pending': 0, 'running': 0, 'failed': 0, 'oldest_pending_seconds': 0}
+    for status, count, oldest in rows:
+        stats[status] = count
+        if status == 'pending' and oldest:
+            stats['oldest_pending_seconds'] = max(0, round((datetime.utcnow() - oldest).total_seconds(), 1))
+    return stats
+
+
+def retry_failed():
+    """Puts failed jobs back in the queue. Returns how many."""
+    count = (
+        Job.query.filter_by(status='failed')
+        .update({'status': 'pending', 'attempts': 0, 'run_at': datetime.utcnow()},
+                synchronize_session=False)
+    )
+    db.session.commit()
+    return count
+
+
+def init_jobs(app):
+    """Starts the in-process workers with the first request and wakes them after enqueues."""
+    if app.config['JOB_WORKER_THREADS'] > 0:
+        @app.before_request
+        def ensure_job_workers():
+            if _workers_pid != os.getpid():
+                start_workers(app)
+
+    @app.after_request
+    def wake_job_workers(response):
+        if g.pop('jobs_enqueued', False):
+            wake()
+        return response
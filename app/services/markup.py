@@ -0,0 +1,113 @@
+"""Rendering of post and comment bodies to HTML.
+
+Bodies are rendered once when they are written and stored in
+`content_html` together with the RENDER_VERSION of the rules used. The
+text is HTML-escaped; `@login` becomes a profile link only if that user
+exists (all candidates of a batch are looked up in one query) and
+`#tag` links to the hashtag page. Bump RENDER_VERSION when the output
+changes and run `flask content rerender` to update stored rows.
+"""
+import re
+from urllib.parse import quote
+
+from markupsafe import Markup, escape
+from sqlalchemy import or_
+
+from app.extensions import db
+from app.models import Post, Comment, User
+from app.services.metrics import timed
+
+RENDER_VERSION = 1
+
+TOKEN_RE = re.compile(r'([@#])(\w+)')
+
+
+def mentioned_logins(texts):
+    """All @names appearing in `texts` (existing users or not)."""
+    return {
+        name
+        for text in texts if text
+        for sigil, name in TOKEN_RE.findall(text)
+        if sigil == '@'
+    }
+
+
+def existing_logins(names):
+    """The subset of `names` that are logins of registered users (one query)."""
+    if not names:
+        return set()
+    # Rendering happens before the new post/comment is flushed; keep it that way
+    with db.session.no_autoflush:
+        rows = db.session.query(User.login).filter(User.login.in_(names)).all()
+    return {login for login, in rows}
+
+
+def render_body(text, logins=None):
+    """Escaped HTML of a body with mention and hashtag links.
+
+    `logins` is the set of existing logins to link; None links every
+    mention (used for rows not rendered yet, see `body_html`).
+    """
+    if not text:
+        return Markup('')
+
+    parts = []
+    pos = 0
+    for match in TOKEN_RE.finditer(text):
+        sigil, name = match.groups()
+        if sigil == '@' and logins is not None and name not in logins:
+            continue
+        parts.append(escape(text[pos:match.start()]))
+        if sigil == '@':
+            parts.append(Markup('<a href="/users/{}" class="mention">@{}</a>').format(quote(name), name))
+        else:
+            parts.append(Markup('<a href="/hashtag/{}" class="hashtag">#{}</a>').format(quote(name.lower()), name))
+        pos = match.end()
+    parts.append(escape(text[pos:]))
+    return Markup('').join(parts)
+
+
+@timed()
+def render_contents(objs):
+    """Renders `content` into `content_html` for posts/comments, one user query in total."""
+    objs = [obj for obj in objs if obj is not None]
+    logins = existing_logins(mentioned_logins(obj.content for obj in objs))
+    for obj in objs:
+        obj.content_html = str(render_body(obj.content, logins))
+        obj.render_version = RENDER_VERSION
+
+
+def body_html(obj):
+    """Template filter: the stored HTML, or a live rendering for stale rows."""
+    if obj.content_html is not None and obj.render_version == RENDER_VERSION:
+        return Markup(obj.content_html)
+    return render_body(obj.content)
+
+
+def rerender(batch_size=500, everything=False, progress=None):
+    """Re-renders stored bodies in batches of `batch_size` rows per transaction.
+
+    Only rows rendered with an older RENDER_VERSION (or never) unless
+    `everything` is set, e.g. after users registered whose mentions
+    should become links. Returns the number of rows rendered.
+    """
+    total = 0
+    for model in (Post, Comment):
+        last_id = 0
+        while True:
+            query = model.query.filter(model.id > last_id)
+            if not everything:
+                query = query.filter(or_(
+                    model.render_version.is_(None),
+                    model.render_version != RENDER_VERSION
+                ))
+            batch = query.order_by(model.id).limit(batch_size).all()
+            if not batch:
+                break
+            last_id = batch[-1].id
+            render_contents(batch)
+            db.session.commit()
+            total += len(batch)
+            if progress:
+                progress(model.__tablename__, total)
+    return total
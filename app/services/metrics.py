@@ -0,0 +1,348 @@
+"""Request metrics, slow query log and an on-demand profiler.
+
+Every request records its latency, number of SQL queries and time spent
+in SQL per endpoint, and every `render_template` its render time. The
+numbers are kept in memory per process and served in the Prometheus text
+format at `/metrics`. With several gunicorn workers set METRICS_DIR: each
+process then writes a snapshot there every METRICS_FLUSH_INTERVAL seconds
+and `/metrics` adds up the snapshots of all processes. Like the other
+stats endpoints it is only served to admins unless STATS_PUBLIC is set.
+
+Queries slower than SLOW_QUERY_SECONDS are logged to the 'app.sql.slow'
+logger. Admins can append `?_profile=1` to any URL to get a cProfile
+report of that request instead of the page (`?_profile=prof` downloads
+the raw stats for snakeviz, gprof2dot or flameprof).
+"""
+import cProfile
+import io
+import json
+import logging
+import marshal
+import os
+import pstats
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import (
+    Response, abort, before_render_template, current_app, g, has_request_context, request, template_rendered
+)
+from sqlalchemy import event
+
+from app.extensions import db, cache
+
+slow_log = logging.getLogger('app.sql.slow')
+
+# Set from SLOW_QUERY_SECONDS by init_metrics
+_slow_query_seconds = None
+# pid -> monotonic time of the last snapshot written to METRICS_DIR
+_flush_state = {}
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 50, 100)
+PROFILE_SORT_KEYS = ('cumulative', 'tottime', 'calls', 'ncalls', 'time')
+
+
+class Registry:
+    """Counters and histograms keyed by metric name and label values."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}  # name -> (type, help, buckets)
+        self.values = {}   # name -> {labels: value or [bucket counts..., sum, count]}
+
+    def counter(self, name, help):
+        self.metrics[name] = ('counter', help, None)
+        self.values.setdefault(name, {})
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS):
+        self.metrics[name] = ('histogram', help, tuple(buckets))
+        self.values.setdefault(name, {})
+
+    def inc(self, name, labels=(), amount=1):
+        with self.lock:
+            series = self.values[name]
+            series[labels] = series.get(labels, 0) + amount
+
+    def observe(self, name, value, labels=()):
+        buckets = self.metrics[name][2]
+        with self.lock:
+            series = self.values[name]
+            state = series.get(labels)
+            if state is None:
+                state = series[labels] = [0] * (len(buckets) + 2)
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def snapshot(self):
+        """JSON-serializable copy of the values."""
+        with self.lock:
+            return {
+                name: [[list(labels), value] for labels, value in series.items()]
+                for name, series in self.values.items()
+            }
+
+    def render(self, snapshots, label_names):
+        """Prometheus text format of the sum of `snapshots`."""
+        totals = {}
+        for snapshot in snapshots:
+            for name, series in snapshot.items():
+                if name not in self.metrics:
+                    continue
+                merged = totals.setdefault(name, {})
+                for labels, value in series:
+                    key = tuple(labels)
+                    if isinstance(value, list):
+                        current = merged.setdefault(key, [0] * len(value))
+                        merged[key] = [a + b for a, b in zip(current, value)]
+                    else:
+                        merged[key] = merged.get(key, 0) + value
+
+        lines = []
+        for name, (kind, help, buckets) in self.metrics.items():
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in sorted(totals.get(name, {}).items()):
+                pairs = list(zip(label_names[name], labels))
+                if kind == 'counter':
+                    lines.append(f'{name}{_labels(pairs)} {value}')
+                    continue
+                for bound, count in zip(buckets, value):
+                    lines.append(f'{name}_bucket{_labels(pairs + [("le", bound)])} {count}')
+                lines.append(f'{name}_bucket{_labels(pairs + [("le", "+Inf")])} {value[-1]}')
+                lines.append(f'{name}_sum{_labels(pairs)} {round(value[-2], 6)}')
+                lines.append(f'{name}_count{_labels(pairs)} {value[-1]}')
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(pairs):
+    if not pairs:
+        return ''
+    escaped = []
+    for key, value in pairs:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        escaped.append(f'{key}="{value}"')
+    return '{' + ','.join(escaped) + '}'
+
+
+registry = Registry()
+LABELS = {}
+
+
+def _define(kind, name, help, labels, buckets=None):
+    LABELS[name] = labels
+    if kind == 'counter':
+        registry.counter(name, help)
+    else:
+        registry.histogram(name, help, buckets or LATENCY_BUCKETS)
+
+
+_define('counter', 'http_requests_total', 'Requests by endpoint, method and status.',
+        ('endpoint', 'method', 'status'))
+_define('histogram', 'http_request_duration_seconds', 'Request latency by endpoint.', ('endpoint',))
+_define('histogram', 'http_request_sql_queries', 'SQL queries per request by endpoint.', ('endpoint',),
+        QUERY_COUNT_BUCKETS)
+_define('histogram', 'http_request_sql_seconds', 'Time spent in SQL per request by endpoint.', ('endpoint',))
+_define('histogram', 'template_render_seconds', 'render_template time by template.', ('template',))
+_define('histogram', 'function_duration_seconds', 'Time spent in instrumented functions.', ('function',))
+_define('counter', 'sql_slow_queries_total', 'Queries slower than SLOW_QUERY_SECONDS.', ('endpoint',))
+
+
+@contextmanager
+def timer(name):
+    """Records the duration of a block under function_duration_seconds{function=name}."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        registry.observe('function_duration_seconds', time.perf_counter() - start, (name,))
+
+
+def timed(name=None):
+    """Decorator version of `timer`; the label defaults to module.function."""
+    def decorator(fn):
+        label = name or f'{fn.__module__}.{fn.__qualname__}'
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with timer(label):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _endpoint():
+    return request.endpoint or 'unmatched'
+
+
+def _before_cursor(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def _query_failed(context):
+    starts = context.connection.info.get('query_start') if context.connection else None
+    if starts:
+        starts.pop()
+
+
+def _after_cursor(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_start'].pop()
+    in_request = has_request_context()
+    if in_request:
+        g.sql_seconds = g.get('sql_seconds', 0) + elapsed
+
+    threshold = _slow_query_seconds
+    if threshold is not None and elapsed >= threshold:
+        endpoint = _endpoint() if in_request else 'background'
+        registry.inc('sql_slow_queries_total', (endpoint,))
+        slow_log.warning('%.1f ms [%s] %s', elapsed * 1000, endpoint, ' '.join(statement.split())[:1000])
+
+
+def _before_render(sender, template, context, **extra):
+    g.setdefault('render_starts', []).append(time.perf_counter())
+
+
+def _after_render(sender, template, context, **extra):
+    starts = g.get('render_starts')
+    if starts:
+        registry.observe('template_render_seconds', time.perf_counter() - starts.pop(), (template.name,))
+
+
+def _flush_snapshot(app):
+    """Writes this process's snapshot to METRICS_DIR (at most every METRICS_FLUSH_INTERVAL)."""
+    directory = app.config['METRICS_DIR']
+    now = time.monotonic()
+    if not directory or now - _flush_state.get(os.getpid(), 0) < app.config['METRICS_FLUSH_INTERVAL']:
+        return
+    _flush_state[os.getpid()] = now
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'{os.getpid()}.json')
+    tmp_path = f'{path}.part'
+    with open(tmp_path, 'w') as f:
+        json.dump(registry.snapshot(), f)
+    os.replace(tmp_path, path)
+
+
+def collect_snapshots(app):
+    """This process's live values plus the snapshots of the other processes."""
+    snapshots = [registry.snapshot()]
+    directory = app.config['METRICS_DIR']
+    if directory and os.path.isdir(directory):
+        own = f'{os.getpid()}.json'
+        for name in os.listdir(directory):
+            if name.endswith('.json') and name != own:
+                try:
+                    with open(os.path.join(directory, name)) as f:
+                        snapshots.append(json.load(f))
+                except (OSError, ValueError):
+                    pass
+    return snapshots
+
+
+def gauges():
+    """Point-in-time values computed at scrape time."""
+    from app.services.jobs import backlog
+
+    lines = []
+    jobs = backlog()
+    lines.append('# HELP jobs_backlog Background jobs by status.')
+    lines.append('# TYPE jobs_backlog gauge')
+    for status in ('pending', 'running', 'failed'):
+        lines.append(f'jobs_backlog{{status="{status}"}} {jobs[status]}')
+    lines.append('# HELP jobs_oldest_pending_seconds Age of the oldest due job.')
+    lines.append('# TYPE jobs_oldest_pending_seconds gauge')
+    lines.append(f'jobs_oldest_pending_seconds {jobs["oldest_pending_seconds"]}')
+
+    stats = cache.stats()
+    lines.append('# HELP cache_requests_total Cache lookups of this process.')
+    lines.append('# TYPE cache_requests_total counter')
+    lines.append(f'cache_requests_total{{result="hit"}} {stats.get("hits", 0)}')
+    lines.append(f'cache_requests_total{{result="miss"}} {stats.get("misses", 0)}')
+    return '\n'.join(lines) + '\n'
+
+
+def stats_view(view):
+    """Limits a stats endpoint to admins, or to anyone with STATS_PUBLIC (e.g. for a scraper)."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        user = g.get('current_user')
+        if not (current_app.config['STATS_PUBLIC'] or (user and user.is_admin)):
+            abort(403)
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def _wants_profile():
+    mode = request.args.get('_profile')
+    user = g.get('current_user')
+    return mode if mode and user and user.is_admin else None
+
+
+def _profile_response(profiler, mode):
+    if mode == 'prof':
+        # The format written by Profile.dump_stats, without a temporary file
+        profiler.create_stats()
+        return Response(
+            marshal.dumps(profiler.stats),
+            mimetype='application/octet-stream',
+            headers={'Content-Disposition': f'attachment; filename="{_endpoint()}.prof"'}
+        )
+
+    sort = request.args.get('_sort', 'cumulative')
+    if sort not in PROFILE_SORT_KEYS:
+        sort = 'cumulative'
+    out = io.StringIO()
+    pstats.Stats(profiler, stream=out).strip_dirs().sort_stats(sort).print_stats(60)
+    return Response(out.getvalue(), mimetype='text/plain')
+
+
+def init_metrics(app):
+    """Registers the request timing hooks, SQL events and the profiler."""
+    global _slow_query_seconds
+    _slow_query_seconds = app.config['SLOW_QUERY_SECONDS']
+
+    with app.app_context():
+        for engine in db.engines.values():
+            event.listen(engine, 'before_cursor_execute', _before_cursor)
+            event.listen(engine, 'after_cursor_execute', _after_cursor)
+            event.listen(engine, 'handle_error', _query_failed)
+
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_after_render, app)
+
+    @app.before_request
+    def start_request_timer():
+        g.request_start = time.perf_counter()
+        g.sql_seconds = 0
+        mode = _wants_profile()
+        if mode:
+            g.profiler = cProfile.Profile()
+            g.profile_mode = mode
+            g.profiler.enable()
+
+    @app.after_request
+    def record_request(response):
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            profiler.disable()
+            response = _profile_response(profiler, g.profile_mode)
+
+        start = g.get('request_start')
+        if start is not None:
+            endpoint = _endpoint()
+            registry.inc('http_requests_total', (endpoint, request.method, str(response.status_code)))
+            registry.observe('http_request_duration_seconds', time.perf_counter() - start, (endpoint,))
+            registry.observe('http_request_sql_queries', g.get('sql_query_count', 0), (endpoint,))
+            registry.observe('http_request_sql_seconds', g.get('sql_seconds', 0), (endpoint,))
+            _flush_snapshot(app)
+        return response
+
+    @app.route('/metrics')
+    @stats_view
+    def metrics():
+        body = registry.render(collect_snapshots(app), LABELS) + gauges()
+        return Response(body, mimetype='text/plain; version=0.0.4')
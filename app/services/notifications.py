@@ -0,0 +1,89 @@
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy.orm import joinedload
+
+from app.extensions import db, cache
+from app.models import Notification, User
+from app.services.jobs import enqueue, job_handler
+from app.services.markup import mentioned_logins
+
+
+def queue_mention_notifications(text, actor_id, post_id, comment_id=None):
+    """Enqueues notifications for the users @mentioned in `text` (no query here)."""
+    logins = sorted(mentioned_logins([text]))
+    if logins:
+        enqueue('mentions', {
+            'logins': logins,
+            'actor_id': actor_id,
+            'post_id': post_id,
+            'comment_id': comment_id,
+        })
+
+
+@job_handler('mentions')
+def create_mention_notifications(payloads):
+    """Resolves the mentioned logins of a whole batch in one query and inserts the notifications."""
+    logins = {login for payload in payloads for login in payload['logins']}
+    user_ids = dict(db.session.query(User.login, User.id).filter(User.login.in_(logins)).all())
+
+    rows = []
+    for payload in payloads:
+        for login in payload['logins']:
+            user_id = user_ids.get(login)
+            if user_id and user_id != payload['actor_id']:
+                rows.append({
+                    'user_id': user_id,
+                    'actor_id': payload['actor_id'],
+                    'post_id': payload['post_id'],
+                    'comment_id': payload['comment_id'],
+                    'kind': 'mention',
+                })
+    if not rows:
+        return None
+
+    db.session.execute(Notification.__table__.insert(), rows)
+    notified = {row['user_id'] for row in rows}
+    return lambda: cache.invalidate(*[f'notifications:{user_id}' for user_id in notified])
+
+
+def unread_count(user_id):
+    """Number of unread notifications, cached until the next change."""
+    return cache.get_or_set(
+        cache.key(f'notifications:{user_id}', 'unread'),
+        lambda: (
+            Notification.query
+            .filter_by(user_id=user_id, read_at=None)
+            .count()
+        )
+    )
+
+
+def notifications_page(user_id, before=None, per_page=None):
+    """Returns `(notifications, next_before)`, newest first, keyset on id."""
+    per_page = per_page or current_app.config['NOTIFICATIONS_PER_PAGE']
+    query = (
+        Notification.query
+        .filter_by(user_id=user_id)
+        .options(joinedload(Notification.actor), joinedload(Notification.post))
+    )
+    if before:
+        query = query.filter(Notification.id < before)
+    items = query.order_by(Notification.id.desc()).limit(per_page + 1).all()
+    if len(items) > per_page:
+        return items[:per_page], items[per_page - 1].id
+    return items, None
+
+
+def mark_read(user_id, notifications):
+    """Marks the shown notifications as read."""
+    ids = [n.id for n in notifications if n.read_at is None]
+    if not ids:
+        return
+    (
+        Notification.query
+        .filter(Notification.id.in_(ids))
+        .update({'read_at': datetime.utcnow()}, synchronize_session=False)
+    )
+    db.session.commit()
+    cache.invalidate(f'notifications:{user_id}')
@@ -0,0 +1,92 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+
+from flask import abort, current_app
+from sqlalchemy import and_, func, or_, select
+
+from app.models import Post
+from app.services.metrics import timed
+
+
+def encode_cursor(*values):
+    """Packs keyset values into an opaque, URL-safe token."""
+    raw = json.dumps(
+        [v.isoformat() if isinstance(v, datetime) else v for v in values],
+        separators=(',', ':')
+    )
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token, size):
+    """Unpacks a token made by `encode_cursor`. Aborts with 400 if it is malformed."""
+    if not token:
+        return None
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (binascii.Error, ValueError, UnicodeDecodeError):
+        abort(400)
+    if not isinstance(values, list) or len(values) != size:
+        abort(400)
+    return values
+
+
+def page_size(requested=None):
+    """Returns the requested page size clamped to 1..POSTS_PER_PAGE_MAX."""
+    default = current_app.config['POSTS_PER_PAGE']
+    try:
+        size = int(requested) if requested else default
+    except (TypeError, ValueError):
+        size = default
+    return max(1, min(size, current_app.config['POSTS_PER_PAGE_MAX']))
+
+
+def split_page(rows, per_page, cursor_for):
+    """Splits `per_page + 1` fetched rows into the page and the cursor of the next one."""
+    if len(rows) <= per_page:
+        return rows, None
+    rows = rows[:per_page]
+    return rows, cursor_for(rows[-1])
+
+
+@timed()
+def chronological_page(query, cursor=None, per_page=None):
+    """Returns `(posts, next_cursor)` for `query` ordered newest first.
+
+    Keyset pagination on `(created_at, id)`: the next page starts right
+    after the last post of the previous one, so every page costs the same
+    no matter how deep the reader scrolls.
+    """
+    per_page = page_size(per_page)
+    after = decode_cursor(cursor, 2)
+    if after is not None and not isinstance(after[1], int):
+        abort(400)
+
+    posts = chronological_query(query, after).limit(per_page + 1).all()
+    return split_page(posts, per_page, lambda post: encode_cursor(post.created_at, post.id))
+
+
+def chronological_query(query, after=None):
+    """Orders a post query newest first, starting after the `(created_at, id)` keyset."""
+    if after is not None:
+        created_at, post_id = after
+        # Compare against the stored value of the last post so that the
+        # comparison uses the same datetime representation as the column.
+        last_created_at = func.coalesce(
+            select(Post.created_at).where(Post.id == post_id).scalar_subquery(),
+            parse_datetime(created_at)
+        )
+        query = query.filter(or_(
+            Post.created_at < last_created_at,
+            and_(Post.created_at == last_created_at, Post.id < post_id)
+        ))
+    return query.order_by(Post.created_at.desc(), Post.id.desc())
+
+
+def parse_datetime(value):
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        abort(400)
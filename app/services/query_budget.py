@@ -0,0 +1,50 @@
+from flask import g, has_request_context, request
+from sqlalchemy import event
+
+from app.extensions import db
+
+
+class QueryBudgetExceeded(RuntimeError):
+    """Raised when a request issues more SQL queries than its endpoint allows."""
+
+
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        g.sql_query_count = g.get('sql_query_count', 0) + 1
+
+
+def init_query_budget(app):
+    """Counts SQL queries per request and enforces QUERY_BUDGETS.
+
+    Budgets are fixed per endpoint and must hold no matter how many posts,
+    comments or reactions are in the database, so a regression back to
+    per-row lazy loading fails loudly. Enforcement is on in testing mode
+    (or with QUERY_BUDGET_ENFORCE=1); otherwise the count is only reported
+    in the X-Query-Count header when QUERY_COUNT_HEADER is set. A key
+    like 'POST posts.index' overrides the endpoint's budget for one method.
+    """
+    with app.app_context():
+        for engine in db.engines.values():
+            event.listen(engine, 'before_cursor_execute', _count_query)
+
+    @app.before_request
+    def reset_query_count():
+        g.sql_query_count = 0
+
+    @app.after_request
+    def check_query_budget(response):
+        count = g.get('sql_query_count', 0)
+        enforce = app.testing or app.config['QUERY_BUDGET_ENFORCE']
+
+        if enforce or app.config['QUERY_COUNT_HEADER']:
+            response.headers['X-Query-Count'] = str(count)
+
+        budgets = app.config['QUERY_BUDGETS']
+        budget = budgets.get(f'{request.method} {request.endpoint}', budgets.get(request.endpoint))
+        if enforce and budget is not None and count > budget and not g.get('query_budget_failed'):
+            # The error response passes through here again; report only once
+            g.query_budget_failed = True
+            raise QueryBudgetExceeded(
+                f'{request.endpoint} issued {count} SQL queries (budget: {budget})'
+            )
+        return response
@@ -0,0 +1,67 @@
+import re
+
+from sqlalchemy import text
+
+from app.extensions import db
+from app.models import Post, Reaction, Hashtag
+from app.services.activity import activity_query
+from app.services.comments import comment_tree_query, top_level_comments_query
+from app.services.pagination import chronological_query
+from app.services.hashtags import trending_query
+from app.services.ranking import ranked_posts_query, top_hashtags_query
+
+FULL_SCAN_RE = re.compile(r'^SCAN (\w+)$')
+
+
+def hot_queries():
+    """The statements behind the feed, detail, hashtag and profile pages.
+
+    Returns `(name, query, allowed_scans)` tuples; `allowed_scans` lists
+    tables that the query may legitimately read in full.
+    """
+    tag = Hashtag(id=1, name='example')
+    return [
+        ('feed', ranked_posts_query().limit(21), set()),
+        ('feed: next page', ranked_posts_query(after=(10, 100)).limit(21), set()),
+        ('detail: top-level comments', top_level_comments_query(1, after=10).limit(51), set()),
+        ('detail: comment tree', comment_tree_query([1, 2, 3], max_depth=6, replies_shown=10), {'comment_tree'}),
+        ('detail: your reaction',
+         db.session.query(Reaction.post_id, Reaction.type)
+         .filter(Reaction.user_id == 1, Reaction.post_id.in_([1, 2, 3])), set()),
+        ('hashtag', chronological_query(Post.query.filter(Post.hashtags.contains(tag))).limit(21), set()),
+        ('profile', chronological_query(Post.query.filter_by(author_id=1)).limit(21), set()),
+        # Each page is one LIMITed range of an (author_id, created_at) index
+        ('profile: activity', activity_query(1, after=('2024-01-01T00:00:00', 'post', 10)),
+         {'post_page', 'comment_page'}),
+        ('top hashtags', top_hashtags_query(), set()),
+        # Both are built from index ranges in the same statement
+        ('trending hashtags', trending_query(5), {'recent_posts', 'trending_scores'}),
+    ]
+
+
+def explain(query):
+    """Returns the EXPLAIN QUERY PLAN detail lines of an ORM query (SQLite only)."""
+    compiled = query.statement.compile(
+        dialect=db.engine.dialect,
+        compile_kwargs={'literal_binds': True}
+    )
+    rows = db.session.execute(text(f'EXPLAIN QUERY PLAN {compiled}'))
+    return [row[-1] for row in rows]
+
+
+def check_query_plans():
+    """Explains every hot query and flags full table scans.
+
+    Returns `(name, plan, problems)` tuples; `problems` lists the tables
+    scanned without an index.
+    """
+    results = []
+    for name, query, allowed_scans in hot_queries():
+        plan = explain(query)
+        problems = []
+        for line in plan:
+            match = FULL_SCAN_RE.match(line.strip())
+            if match and match.group(1) not in allowed_scans:
+                problems.append(match.group(1))
+        results.append((name, plan, problems))
+    return results
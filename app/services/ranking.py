@@ -0,0 +1,193 @@
+from datetime import datetime, timedelta
+
+from flask import abort, current_app
+from sqlalchemy import and_, case, exists, literal, or_, select, update
+from sqlalchemy.orm import contains_eager, joinedload
+
+from app.extensions import db, cache
+from app.models import Post, PostStats, Hashtag, post_hashtag
+from app.services.pagination import decode_cursor, encode_cursor, page_size, split_page
+from app.services.jobs import periodic_task
+from app.services.metrics import timed
+
+
+# Points awarded by the popularity score (see calculate_popularity_score)
+PLUS_POINTS = 2
+REACTION_POINTS = 1
+COMMENT_POINTS = 5
+TOP_HASHTAG_BONUS = 10
+FRESHNESS_DAYS = 7
+
+
+def top_hashtags(limit=5):
+    """Returns the `limit` hashtags attached to the most posts.
+
+    Reads the `Hashtag.post_count` counters through their index instead
+    of counting `post_hashtag` rows.
+    """
+    return top_hashtags_query(limit).all()
+
+
+def top_hashtags_query(limit=5):
+    return (
+        Hashtag.query
+        .filter(Hashtag.post_count > 0)
+        .order_by(Hashtag.post_count.desc(), Hashtag.id.desc())
+        .limit(limit)
+    )
+
+
+def freshness_boost(now=None):
+    """SQL expression for the new post boost: 7 points on day 0, down to 0 on day 7.
+
+    `days_old` is the number of whole days since creation, so a post is
+    `d` days old exactly when `now - (d + 1) days < created_at <= now - d days`.
+    Comparing against precomputed cut-offs keeps the expression portable
+    and lets the database use an index on `created_at`.
+    """
+    now = now or datetime.now()
+    whens = [
+        (Post.created_at > now - timedelta(days=days + 1), FRESHNESS_DAYS - days)
+        for days in range(FRESHNESS_DAYS)
+    ]
+    return case(*whens, else_=0)
+
+
+def bonus_expression(top_hashtag_ids, post_id):
+    """SQL expression for the top hashtag bonus of the post `post_id`."""
+    if not top_hashtag_ids:
+        return literal(0)
+    return case(
+        (
+            exists().where(
+                post_hashtag.c.post_id == post_id,
+                post_hashtag.c.hashtag_id.in_(top_hashtag_ids)
+            ),
+            TOP_HASHTAG_BONUS
+        ),
+        else_=0
+    )
+
+
+def new_post_stats():
+    """Stats row of a post being created: full freshness boost, bonus added by the next refresh."""
+    return PostStats(rank_freshness=FRESHNESS_DAYS, rank_score=FRESHNESS_DAYS)
+
+
+# Top hashtags seen by the last refresh in this process (None: not run yet)
+_refreshed_top_ids = None
+
+
+@periodic_task('refresh_ranks', 'RANK_REFRESH_INTERVAL')
+@timed()
+def refresh_ranks(now=None, full=False):
+    """Brings the stored hashtag bonus and freshness boost of posts up to date.
+
+    `PostStats.rank_score` follows reactions and comments in the same
+    transaction (app.services.stats); what changes with time and with the
+    top hashtags is refreshed here. Only posts young enough to lose
+    freshness and posts tagged with a hashtag that entered or left the
+    top list are looked at, and only rows whose values changed are
+    written. The first call in a process (or `full`) checks every post,
+    e.g. after the app was down for longer than a day. Returns the number
+    of posts updated.
+    """
+    global _refreshed_top_ids
+    now = now or datetime.now()
+    top_ids = {tag.id for tag in top_hashtags_query()}
+    full = full or _refreshed_top_ids is None
+
+    freshness = (
+        select(freshness_boost(now))
+        .where(Post.id == PostStats.post_id)
+        .scalar_subquery()
+    )
+    bonus = bonus_expression(top_ids, PostStats.post_id)
+    statement = (
+        update(PostStats)
+        .where(or_(PostStats.rank_freshness != freshness, PostStats.rank_bonus != bonus))
+        .values(
+            rank_freshness=freshness,
+            rank_bonus=bonus,
+            rank_score=PostStats.score + bonus + freshness,
+        )
+        .execution_options(synchronize_session=False)
+    )
+    if not full:
+        # A day of slack covers posts that aged out since the last sweep
+        candidates = [PostStats.post_id.in_(
+            select(Post.id).where(Post.created_at > now - timedelta(days=FRESHNESS_DAYS + 1))
+        )]
+        changed_tags = top_ids ^ _refreshed_top_ids
+        if changed_tags:
+            candidates.append(PostStats.post_id.in_(
+                select(post_hashtag.c.post_id).where(post_hashtag.c.hashtag_id.in_(changed_tags))
+            ))
+        statement = statement.where(or_(*candidates))
+
+    updated = db.session.execute(statement).rowcount
+    db.session.commit()
+    _refreshed_top_ids = top_ids
+    if updated:
+        cache.invalidate('feed')
+    return updated
+
+
+def ranked_posts_query(after=None):
+    """Query yielding `(post, score)` rows ordered by popularity.
+
+    Reads the stored `PostStats.rank_score` through its index, so a page
+    costs the same however many posts there are. Ties keep the insertion
+    order. `after` is an optional `(score, post_id)` keyset: only posts
+    ranked below it are returned.
+    """
+    score = PostStats.rank_score
+    query = (
+        db.session.query(Post, score.label('score'))
+        .join(Post.stats)
+        .options(contains_eager(Post.stats), joinedload(Post.author))
+    )
+    if after is not None:
+        last_score, last_id = after
+        query = query.filter(or_(
+            score < last_score,
+            and_(score == last_score, PostStats.post_id > last_id)
+        ))
+    return query.order_by(score.desc(), PostStats.post_id.asc())
+
+
+def rank_posts():
+    """Returns all posts ordered by popularity score (highest first)."""
+    return [post for post, score in ranked_posts_query()]
+
+
+@timed()
+def ranked_page(cursor=None, per_page=None):
+    """Returns `(posts, next_cursor)` for one page of the ranked feed.
+
+    Keyset pagination on `(score, id)`; see `chronological_page`.
+    """
+    per_page = page_size(per_page)
+    key = cache.key('feed', 'ranking', cursor or '', per_page)
+    cached = cache.get(key)
+    if cached is not None:
+        post_ids, next_cursor = cached
+        posts = {
+            post.id: post for post in
+            Post.query
+            .filter(Post.id.in_(post_ids))
+            .options(joinedload(Post.author), joinedload(Post.stats))
+        }
+        return [posts[post_id] for post_id in post_ids if post_id in posts], next_cursor
+
+    after = decode_cursor(cursor, 2)
+    if after is not None and not all(isinstance(v, int) for v in after):
+        abort(400)
+
+    rows = ranked_posts_query(after=after).limit(per_page + 1).all()
+    rows, next_cursor = split_page(rows, per_page, lambda row: encode_cursor(row[1], row[0].id))
+    posts = [post for post, score in rows]
+
+    # refresh_ranks() re-orders posts as they age, hence the shorter timeout
+    cache.set(key, ([post.id for post in posts], next_cursor), current_app.config['CACHE_FEED_TIMEOUT'])
+    return posts, next_cursor
@@ -0,0 +1,188 @@
+"""Reaction writes.
+
+`set_reaction` stores a user's reaction with INSERT ... ON CONFLICT DO
+NOTHING on `_user_post_uc` and, only when the user had reacted before, a
+conditional UPDATE: no SELECT first, and clicking the same reaction again
+writes nothing. The `Reaction` rows are authoritative; the counters in
+post_stats/user_stats are derived from them.
+
+With REACTION_FLUSH_INTERVAL > 0 counter changes are not written by the
+request: they are added up per post in memory and a thread of each
+process applies them every REACTION_FLUSH_INTERVAL seconds in one
+transaction, so a burst of clicks on a hot post becomes one UPDATE of its
+stats row (and one feed cache invalidation) instead of one per click.
+Until then the counters lag behind the reactions; changes still buffered
+when a process is killed are lost and `flask stats rebuild` recounts them.
+"""
+import atexit
+import logging
+import os
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+
+from app.database import is_lock_error
+from app.extensions import db, cache
+from app.models import Post, PostStats, Reaction
+from app.services.metrics import timed
+from app.services.stats import reaction_deltas, record_reaction, record_reactions
+
+log = logging.getLogger(__name__)
+
+OTHER_TYPE = {'plus': 'minus', 'minus': 'plus'}
+
+
+def _insert_reaction(post_id, user_id, reaction_type):
+    """INSERT ... ON CONFLICT DO NOTHING; True if the row was inserted."""
+    row = {'post_id': post_id, 'user_id': user_id, 'type': reaction_type}
+    dialect = db.engine.dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        insert = sqlite.insert if dialect == 'sqlite' else postgresql.insert
+        stmt = (
+            insert(Reaction.__table__)
+            .values(**row)
+            .on_conflict_do_nothing(index_elements=['post_id', 'user_id'])
+        )
+        return db.session.execute(stmt).rowcount == 1
+
+    # Other databases: a savepoint so that the conflict only skips the insert
+    try:
+        with db.session.begin_nested():
+            db.session.execute(Reaction.__table__.insert().values(**row))
+    except IntegrityError:
+        return False
+    return True
+
+
+def set_reaction(post_id, user_id, reaction_type):
+    """Stores the reaction of `user_id` to `post_id` in the current transaction.
+
+    Returns `(changed, old_type)`: whether anything was written and the
+    previous reaction (None for a new one).
+    """
+    if _insert_reaction(post_id, user_id, reaction_type):
+        return True, None
+    switched = (
+        Reaction.query
+        .filter(
+            Reaction.post_id == post_id,
+            Reaction.user_id == user_id,
+            Reaction.type != reaction_type
+        )
+        .update({Reaction.type: reaction_type}, synchronize_session=False)
+    )
+    if switched:
+        return True, OTHER_TYPE[reaction_type]
+    return False, reaction_type
+
+
+def count_reaction(post_id, old_type, new_type):
+    """Updates the counters for a changed reaction.
+
+    Call before the commit and run the returned callable after it: it
+    invalidates the feed, or hands the change to the buffer when
+    REACTION_FLUSH_INTERVAL is set (so a rolled back change is never counted).
+    """
+    if current_app.config['REACTION_FLUSH_INTERVAL'] <= 0:
+        record_reaction(post_id, old_type, new_type)
+        return lambda: cache.invalidate('feed')
+    app = current_app._get_current_object()
+    return lambda: _pending.add(app, post_id, reaction_deltas(old_type, new_type))
+
+
+def reaction_counts(post_id):
+    """`{'plus': n, 'minus': n}` of a post including this process's buffered changes."""
+    counts = (
+        db.session.query(PostStats.plus_count, PostStats.minus_count)
+        .filter(PostStats.post_id == post_id)
+        .first()
+    )
+    plus, minus = counts if counts else (0, 0)
+    pending = _pending.get(post_id)
+    return {'plus': plus + pending['plus'], 'minus': minus + pending['minus']}
+
+
+class PendingDeltas:
+    """Counter changes per post waiting to be written, with the thread that writes them."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.deltas = {}
+        self.pid = None
+
+    def add(self, app, post_id, deltas):
+        with self.lock:
+            pending = self.deltas.setdefault(post_id, {'plus': 0, 'minus': 0})
+            pending['plus'] += deltas['plus']
+            pending['minus'] += deltas['minus']
+            if self.pid != os.getpid():
+                # First change in this process (a thread started before a fork is gone)
+                self.pid = os.getpid()
+                threading.Thread(target=self._run, args=(app,), name='reaction-flush', daemon=True).start()
+                atexit.register(self._flush_at_exit, app)
+
+    def get(self, post_id):
+        with self.lock:
+            return dict(self.deltas.get(post_id, {'plus': 0, 'minus': 0}))
+
+    def take(self):
+        with self.lock:
+            deltas, self.deltas = self.deltas, {}
+            return deltas
+
+    def put_back(self, deltas):
+        with self.lock:
+            for post_id, change in deltas.items():
+                pending = self.deltas.setdefault(post_id, {'plus': 0, 'minus': 0})
+                pending['plus'] += change['plus']
+                pending['minus'] += change['minus']
+
+    def _run(self, app):
+        while True:
+            time.sleep(app.config['REACTION_FLUSH_INTERVAL'])
+            with app.app_context():
+                flush_reactions()
+
+    def _flush_at_exit(self, app):
+        with app.app_context():
+            flush_reactions()
+
+
+_pending = PendingDeltas()
+
+
+@timed()
+def flush_reactions():
+    """Writes the buffered counter changes of this process in one transaction.
+
+    Returns the number of posts updated; on failure the changes stay
+    buffered for the next attempt.
+    """
+    deltas = _pending.take()
+    changed = {
+        post_id: change for post_id, change in deltas.items()
+        if change['plus'] or change['minus']
+    }
+    if not changed:
+        return 0
+    try:
+        # Reactions of posts deleted in the meantime are gone with them
+        existing = {
+            post_id for post_id, in
+            db.session.query(Post.id).filter(Post.id.in_(list(changed)))
+        }
+        changed = {post_id: change for post_id, change in changed.items() if post_id in existing}
+        for post_id in sorted(changed):
+            record_reactions(post_id, changed[post_id]['plus'], changed[post_id]['minus'])
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        _pending.put_back(changed)
+        if not is_lock_error(e):
+            log.exception('Writing %d buffered reaction count(s) failed', len(changed))
+        return 0
+    cache.invalidate('feed')
+    return len(changed)
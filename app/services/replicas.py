@@ -0,0 +1,71 @@
+"""Routing of read-only requests to replica databases.
+
+Every URL in DATABASE_REPLICA_URLS becomes a Flask-SQLAlchemy bind
+(`replica_0`, `replica_1`, ...). GET requests to the endpoints in
+REPLICA_ENDPOINTS pick one replica at random and `RoutingSession` sends
+their SELECTs there; everything else, and any flush or UPDATE/INSERT/
+DELETE statement even within those requests, goes to the primary.
+
+Replicas lag behind the primary, so after a client sends a write
+request (any method but GET/HEAD/OPTIONS) its session is pinned to the
+primary for REPLICA_STICKY_SECONDS and it reads its own writes.
+Background jobs and CLI commands have no request and always use the
+primary.
+
+Locally a copy of the SQLite file works as a (never updated) replica:
+
+    cp app/forum.db /tmp/replica.db
+    DATABASE_REPLICA_URLS=sqlite:////tmp/replica.db python3 run.py
+"""
+import random
+import time
+
+from flask import current_app, g, has_request_context, request, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy.sql.dml import UpdateBase
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+STICKY_KEY = 'primary_until'
+
+
+class RoutingSession(Session):
+    """Uses the replica chosen for the request for reads, the primary otherwise."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and not isinstance(clause, UpdateBase):
+            replica = g.get('db_replica') if has_request_context() else None
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def replica_binds(urls):
+    """SQLALCHEMY_BINDS entries for the replica URLs."""
+    return {f'replica_{i}': url for i, url in enumerate(urls)}
+
+
+def sticky():
+    """Whether the client wrote recently and has to read from the primary."""
+    return session.get(STICKY_KEY, 0) > time.time()
+
+
+def init_replicas(app):
+    """Routes reads of the REPLICA_ENDPOINTS to the configured replicas."""
+    keys = list(replica_binds(app.config['DATABASE_REPLICA_URLS']))
+    if not keys:
+        return
+
+    @app.before_request
+    def choose_replica():
+        if (
+            request.method in ('GET', 'HEAD')
+            and request.endpoint in current_app.config['REPLICA_ENDPOINTS']
+            and not sticky()
+        ):
+            g.db_replica = current_app.extensions['sqlalchemy'].engines[random.choice(keys)]
+
+    @app.after_request
+    def pin_writers(response):
+        if request.method not in SAFE_METHODS and request.endpoint != 'static':
+            session[STICKY_KEY] = int(time.time()) + current_app.config['REPLICA_STICKY_SECONDS']
+        return response
@@ -0,0 +1,244 @@
+import re
+
+from flask import current_app
+from markupsafe import Markup, escape
+from sqlalchemy import or_, text
+
+from app.extensions import db
+from app.models import Post, Comment
+from app.services.metrics import timed
+
+# Rows of the FTS table are keyed by rowid: 2 * id for posts and
+# 2 * id + 1 for comments, so triggers can update them without a scan.
+SCHEMA = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(
+        title, body,
+        kind UNINDEXED, ref_id UNINDEXED, post_id UNINDEXED,
+        tokenize = 'unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS search_post_ai AFTER INSERT ON post BEGIN
+        INSERT INTO search_index (rowid, title, body, kind, ref_id, post_id)
+        VALUES (new.id * 2, new.title, new.content, 'post', new.id, new.id);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS search_post_au AFTER UPDATE OF title, content ON post BEGIN
+        DELETE FROM search_index WHERE rowid = old.id * 2;
+        INSERT INTO search_index (rowid, title, body, kind, ref_id, post_id)
+        VALUES (new.id * 2, new.title, new.content, 'post', new.id, new.id);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS search_post_ad AFTER DELETE ON post BEGIN
+        DELETE FROM search_index WHERE rowid = old.id * 2;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS search_comment_ai AFTER INSERT ON comment BEGIN
+        INSERT INTO search_index (rowid, title, body, kind, ref_id, post_id)
+        VALUES (new.id * 2 + 1, NULL, new.content, 'comment', new.id, new.post_id);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS search_comment_au AFTER UPDATE OF content ON comment BEGIN
+        DELETE FROM search_index WHERE rowid = old.id * 2 + 1;
+        INSERT INTO search_index (rowid, title, body, kind, ref_id, post_id)
+        VALUES (new.id * 2 + 1, NULL, new.content, 'comment', new.id, new.post_id);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS search_comment_ad AFTER DELETE ON comment BEGIN
+        DELETE FROM search_index WHERE rowid = old.id * 2 + 1;
+    END
+    """,
+]
+
+# Control characters never present in user text; replaced by <mark> tags
+# after the snippet has been HTML-escaped.
+MARK_START = '\x02'
+MARK_END = '\x03'
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def fts_available():
+    """Full-text search needs SQLite with FTS5; other databases use a LIKE fallback."""
+    return db.engine.dialect.name == 'sqlite'
+
+
+def init_search():
+    """Creates the FTS5 table and the triggers that keep it in sync (idempotent)."""
+    if not fts_available():
+        return
+    with db.engine.begin() as conn:
+        for statement in SCHEMA:
+            conn.execute(text(statement))
+
+
+def build_match_query(query):
+    """Turns free text into a safe FTS5 expression: every word must match, the last one as a prefix."""
+    tokens = TOKEN_RE.findall(query or '')
+    if not tokens:
+        return None
+    terms = [f'"{token}"' for token in tokens]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def highlight(fragment):
+    """Escapes an FTS5 snippet and turns its match markers into <mark> tags."""
+    if fragment is None:
+        return None
+    escaped = str(escape(fragment))
+    return Markup(escaped.replace(MARK_START, '<mark>').replace(MARK_END, '</mark>'))
+
+
+@timed()
+def search(query, page=1, per_page=None):
+    """Searches posts and comments, best matches first.
+
+    Returns `(results, has_next)`; each result is a dict with `kind`,
+    `post_id`, `comment_id`, `title` and `snippet` (both safe HTML).
+    """
+    per_page = per_page or current_app.config['SEARCH_RESULTS_PER_PAGE']
+    page = max(page, 1)
+    if not fts_available():
+        return _search_like(query, page, per_page)
+
+    match = build_match_query(query)
+    if match is None:
+        return [], False
+
+    rows = db.session.execute(
+        text(
+            "SELECT kind, ref_id, post_id,"
+            " highlight(search_index, 0, :start, :end) AS title,"
+            " snippet(search_index, 1, :start, :end, '…', :tokens) AS snippet"
+            " FROM search_index WHERE search_index MATCH :match"
+            # Title matches weigh more than body matches
+            " ORDER BY bm25(search_index, 5.0, 1.0)"
+            " LIMIT :limit OFFSET :offset"
+        ),
+        {
+            'start': MARK_START,
+            'end': MARK_END,
+            'tokens': current_app.config['SEARCH_SNIPPET_TOKENS'],
+            'match': match,
+            'limit': per_page + 1,
+            'offset': (page - 1) * per_page,
+        }
+    ).all()
+
+    has_next = len(rows) > per_page
+    rows = rows[:per_page]
+
+    # Comments are shown under the title of their post
+    comment_post_ids = {row.post_id for row in rows if row.kind == 'comment'}
+    post_titles = dict(
+        db.session.query(Post.id, Post.title).filter(Post.id.in_(comment_post_ids))
+    ) if comment_post_ids else {}
+
+    results = []
+    for row in rows:
+        is_post = row.kind == 'post'
+        results.append({
+            'kind': row.kind,
+            'post_id': row.post_id,
+            'comment_id': None if is_post else row.ref_id,
+            'title': highlight(row.title) if is_post else escape(post_titles.get(row.post_id, '')),
+            'snippet': highlight(row.snippet),
+        })
+    return results, has_next
+
+
+def _search_like(query, page, per_page):
+    """Unranked substring search for databases without FTS5."""
+    if not query or not query.strip():
+        return [], False
+    pattern = f'%{query.strip()}%'
+    limit = page * per_page + 1
+
+    posts = (
+        Post.query
+        .filter(or_(Post.title.ilike(pattern), Post.content.ilike(pattern)))
+        .order_by(Post.id.desc())
+        .limit(limit)
+        .all()
+    )
+    comments = (
+        db.session.query(Comment, Post.title)
+        .join(Post, Post.id == Comment.post_id)
+        .filter(Comment.content.ilike(pattern))
+        .order_by(Comment.id.desc())
+        .limit(limit)
+        .all()
+    )
+
+    results = [
+        {'kind': 'post', 'post_id': post.id, 'comment_id': None,
+         'title': escape(post.title), 'snippet': escape(post.content[:200])}
+        for post in posts
+    ] + [
+        {'kind': 'comment', 'post_id': comment.post_id, 'comment_id': comment.id,
+         'title': escape(title), 'snippet': escape(comment.content[:200])}
+        for comment, title in comments
+    ]
+    start = (page - 1) * per_page
+    return results[start:start + per_page], len(results) > start + per_page
+
+
+def reindex(batch_size=1000, progress=None):
+    """Rebuilds the search index from the post and comment tables.
+
+    Rows are written in primary-key batches, each in its own short
+    transaction, so the app keeps serving writes while an existing
+    database is being indexed. Returns the number of indexed rows.
+    """
+    if not fts_available():
+        return 0
+
+    total = 0
+    sources = [
+        ('post', "SELECT id * 2, title, content, 'post', id, id FROM post"),
+        ('comment', "SELECT id * 2 + 1, NULL, content, 'comment', id, post_id FROM comment"),
+    ]
+    for kind, select in sources:
+        last_id = 0
+        while True:
+            with db.engine.begin() as conn:
+                rows = conn.execute(
+                    text(f"{select} WHERE id > :last_id ORDER BY id LIMIT :limit"),
+                    {'last_id': last_id, 'limit': batch_size}
+                ).all()
+                if not rows:
+                    break
+                conn.execute(
+                    text(
+                        "INSERT OR REPLACE INTO search_index"
+                        " (rowid, title, body, kind, ref_id, post_id)"
+                        " VALUES (:rowid, :title, :body, :kind, :ref_id, :post_id)"
+                    ),
+                    [
+                        {'rowid': r[0], 'title': r[1], 'body': r[2],
+                         'kind': r[3], 'ref_id': r[4], 'post_id': r[5]}
+                        for r in rows
+                    ]
+                )
+            last_id = rows[-1][4]
+            total += len(rows)
+            if progress:
+                progress(kind, total)
+
+    # Drop entries whose post or comment no longer exists
+    with db.engine.begin() as conn:
+        conn.execute(text(
+            "DELETE FROM search_index WHERE rowid IN ("
+            " SELECT s.rowid FROM search_index s"
+            " LEFT JOIN post p ON s.kind = 'post' AND p.id = s.ref_id"
+            " LEFT JOIN comment c ON s.kind = 'comment' AND c.id = s.ref_id"
+            " WHERE p.id IS NULL AND c.id IS NULL)"
+        ))
+    return total
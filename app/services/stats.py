@@ -0,0 +1,176 @@
+from sqlalchemy import case, func
+
+from app.extensions import db
+from app.models import Post, Comment, Reaction, PostStats
+from app.services.ranking import PLUS_POINTS, REACTION_POINTS, COMMENT_POINTS
+from app.services.user_stats import record_received_reactions
+
+
+def base_score(plus, minus, comments):
+    """Reaction and comment part of the popularity score."""
+    return plus * PLUS_POINTS + (plus + minus) * REACTION_POINTS + comments * COMMENT_POINTS
+
+
+def _apply_delta(post_id, plus=0, minus=0, comments=0):
+    """Atomically shifts the counters of one post inside the current transaction."""
+    updated = (
+        PostStats.query
+        .filter_by(post_id=post_id)
+        .update({
+            PostStats.plus_count: PostStats.plus_count + plus,
+            PostStats.minus_count: PostStats.minus_count + minus,
+            PostStats.comment_count: PostStats.comment_count + comments,
+            PostStats.score: PostStats.score + base_score(plus, minus, comments),
+            # The feed order follows right away; bonus and freshness are unchanged
+            PostStats.rank_score: PostStats.rank_score + base_score(plus, minus, comments),
+        }, synchronize_session=False)
+    )
+    if not updated:
+        # Post created before the stats table existed: count it from scratch
+        # (the pending change is flushed first so it is included).
+        db.session.flush()
+        db.session.add(compute_stats([post_id]).get(post_id, PostStats(post_id=post_id)))
+
+
+def reaction_deltas(old_type, new_type):
+    """`{'plus': n, 'minus': n}` change of the counters when a reaction goes from `old_type` to `new_type`."""
+    deltas = {'plus': 0, 'minus': 0}
+    if old_type:
+        deltas[old_type] -= 1
+    if new_type:
+        deltas[new_type] += 1
+    return deltas
+
+
+def record_reaction(post_id, old_type, new_type):
+    """Updates the counters after a user's reaction changed from `old_type` to `new_type`."""
+    deltas = reaction_deltas(old_type, new_type)
+    record_reactions(post_id, deltas['plus'], deltas['minus'])
+
+
+def record_reactions(post_id, plus=0, minus=0):
+    """Shifts the reaction counters of a post and its author, e.g. by a batch of buffered changes."""
+    _apply_delta(post_id, plus=plus, minus=minus)
+    record_received_reactions(post_id, plus=plus, minus=minus)
+
+
+def record_comment(post_id, delta=1):
+    """Updates the counters after comments were added to (or removed from) a post."""
+    _apply_delta(post_id, comments=delta)
+
+
+def compute_stats(post_ids=None):
+    """Recounts stats from the Reaction and Comment tables.
+
+    Returns a dict of post_id -> transient PostStats. Posts without any
+    reactions or comments are included with zero counters.
+    """
+    reactions = db.session.query(
+        Reaction.post_id,
+        func.sum(case((Reaction.type == 'plus', 1), else_=0)),
+        func.sum(case((Reaction.type == 'minus', 1), else_=0)),
+    ).group_by(Reaction.post_id)
+    comments = db.session.query(
+        Comment.post_id,
+        func.count(Comment.id),
+    ).group_by(Comment.post_id)
+    posts = db.session.query(Post.id)
+
+    if post_ids is not None:
+        reactions = reactions.filter(Reaction.post_id.in_(post_ids))
+        comments = comments.filter(Comment.post_id.in_(post_ids))
+        posts = posts.filter(Post.id.in_(post_ids))
+
+    reaction_counts = {post_id: (plus, minus) for post_id, plus, minus in reactions}
+    comment_counts = dict(comments.all())
+
+    result = {}
+    for (post_id,) in posts:
+        plus, minus = reaction_counts.get(post_id, (0, 0))
+        comment_count = comment_counts.get(post_id, 0)
+        result[post_id] = PostStats(
+            post_id=post_id,
+            plus_count=plus,
+            minus_count=minus,
+            comment_count=comment_count,
+            score=base_score(plus, minus, comment_count),
+            # Bonus and freshness start at 0 until the next refresh_ranks()
+            rank_score=base_score(plus, minus, comment_count),
+        )
+    return result
+
+
+def find_drift():
+    """Compares stored counters with a fresh recount.
+
+    Returns a list of `(post_id, stored, expected)` tuples where `stored`
+    is None for posts that have no stats row yet.
+    """
+    expected = compute_stats()
+    stored = {row.post_id: row for row in PostStats.query.all()}
+
+    drift = []
+    for post_id, fresh in expected.items():
+        row = stored.get(post_id)
+        if row is None or _counters(row) != _counters(fresh):
+            drift.append((post_id, row, fresh))
+    return drift
+
+
+def rebuild_stats(drift=None):
+    """Rewrites the counters of every post that drifted. Returns the drift fixed."""
+    if drift is None:
+        drift = find_drift()
+    for post_id, row, fresh in drift:
+        if row is None:
+            db.session.add(fresh)
+        else:
+            row.plus_count = fresh.plus_count
+            row.minus_count = fresh.minus_count
+            row.comment_count = fresh.comment_count
+            row.score = fresh.score
+            row.rank_score = fresh.score + row.rank_bonus + row.rank_freshness
+    db.session.commit()
+    return drift
+
+
+def backfill_missing_stats():
+    """Creates stats rows for posts that have none (e.g. databases created before the table)."""
+    missing = [
+        post_id for (post_id,) in
+        db.session.query(Post.id).filter(~Post.stats.has())
+    ]
+    if not missing:
+        return 0
+    db.session.add_all(compute_stats(missing).values())
+    db.session.commit()
+    return len(missing)
+
+
+def reaction_summary(posts, user_id=None):
+    """Returns `(reactions_map, your_reactions)` for the given posts.
+
+    Counters come from the stats rows; the current user's reactions are
+    fetched with a single query.
+    """
+    reactions_map = {}
+    for post in posts:
+        stats = post.stats
+        reactions_map[post.id] = {
+            'plus': stats.plus_count if stats else 0,
+            'minus': stats.minus_count if stats else 0,
+        }
+
+    your_reactions = dict.fromkeys(reactions_map)
+    if user_id and reactions_map:
+        rows = (
+            db.session.query(Reaction.post_id, Reaction.type)
+            .filter(Reaction.user_id == user_id, Reaction.post_id.in_(list(reactions_map)))
+        )
+        your_reactions.update(rows)
+
+    return reactions_map, your_reactions
+
+
+def _counters(stats):
+    return (stats.plus_count, stats.minus_count, stats.comment_count, stats.score)
@@ -0,0 +1,350 @@
+"""NDJSON export and import of the forum content.
+
+An export is one JSON object per line: a header, then the rows of
+users, hashtags, posts, post_hashtag, reactions and comments in that
+order, each tagged with its table:
+
+    {"format": "forum-ndjson", "version": 1, "schema": 6, ...}
+    {"table": "user", "id": 1, "login": "admin", ...}
+
+Rows are read in primary-key batches inside one read transaction, so the
+export is a consistent snapshot of a live database and needs constant
+memory. Derived data (post stats and feed scores, hashtag and user
+counters, the search index, notifications, jobs) is not exported; the import
+recomputes it.
+
+The import appends to the target database. Users and hashtags whose
+login/name already exists there are merged into the existing rows, all
+other ids are shifted past the largest id in the target table (kept as
+they are when the table is empty), so foreign keys are remapped without
+a lookup table. Rows are written with one `executemany` per batch and
+table. The secondary indexes of the bulk tables and the search triggers
+are dropped for the duration and rebuilt once at the end, so stop the app
+(or at least its writes) while importing. Image files are not included.
+
+Batches are committed as they are written. When an import fails halfway
+(invalid line, database error) the rows loaded so far are kept and still
+get their derived data, so the forum stays consistent, but importing the
+same file again adds them a second time.
+"""
+import json
+import time
+from datetime import datetime
+
+from sqlalchemy import case, func, select, text, tuple_
+
+from app.extensions import db, cache
+from app.migrations import MIGRATIONS
+from app.models import User, Hashtag, Post, Reaction, Comment, PostStats, post_hashtag
+from app.services.ranking import refresh_ranks
+from app.services.search import fts_available, init_search
+from app.services.stats import base_score
+from app.services.user_stats import backfill_missing_user_stats, refresh_user_stats
+
+FORMAT = 'forum-ndjson'
+VERSION = 1
+
+# Export and import order: referenced tables first
+TABLES = [
+    ('user', User.__table__),
+    ('hashtag', Hashtag.__table__),
+    ('post', Post.__table__),
+    ('post_hashtag', post_hashtag),
+    ('reaction', Reaction.__table__),
+    ('comment', Comment.__table__),
+]
+# Columns recomputed by the import instead of being exported
+DERIVED_COLUMNS = {'hashtag': {'post_count'}, 'reaction': {'id'}}
+# Tables whose secondary indexes are rebuilt after the rows are loaded
+BULK_TABLES = ('post', 'post_hashtag', 'reaction', 'comment')
+SEARCH_INSERT_TRIGGERS = ('search_post_ai', 'search_comment_ai')
+
+
+class TransferError(ValueError):
+    """The input is not a forum export this version can import."""
+
+
+def _encode(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f'cannot serialize {type(value).__name__}')
+
+
+def _key_columns(table):
+    return list(table.primary_key.columns)
+
+
+def export_ndjson(out, batch_size=5000, progress=None):
+    """Writes the export to the text stream `out`. Returns the number of rows."""
+    total = 0
+    started = time.perf_counter()
+    with db.engine.connect() as conn, conn.begin():
+        out.write(json.dumps({
+            'format': FORMAT,
+            'version': VERSION,
+            'schema': MIGRATIONS[-1][0],
+            'exported_at': datetime.utcnow().isoformat(),
+        }) + '\n')
+        for name, table in TABLES:
+            keys = _key_columns(table)
+            columns = [c for c in table.columns if c.name not in DERIVED_COLUMNS.get(name, ())]
+            selected = columns + [k for k in keys if k not in columns]
+            positions = [selected.index(k) for k in keys]
+            key = tuple_(*keys) if len(keys) > 1 else keys[0]
+            last = None
+            count = 0
+            while True:
+                query = select(*selected).order_by(*keys).limit(batch_size)
+                if last is not None:
+                    query = query.where(key > (tuple_(*last) if len(keys) > 1 else last[0]))
+                rows = conn.execute(query).all()
+                if not rows:
+                    break
+                for row in rows:
+                    record = {'table': name}
+                    record.update((c.name, row[i]) for i, c in enumerate(columns))
+                    out.write(json.dumps(record, default=_encode, ensure_ascii=False) + '\n')
+                last = [rows[-1][i] for i in positions]
+                count += len(rows)
+                total += len(rows)
+                if progress:
+                    progress(name, count, time.perf_counter() - started)
+    return total
+
+
+def read_header(lines):
+    """Parses and checks the header line of an export."""
+    try:
+        header = json.loads(next(lines))
+    except (StopIteration, ValueError):
+        raise TransferError('missing export header')
+    if header.get('format') != FORMAT:
+        raise TransferError('not a forum export')
+    if header.get('version') != VERSION:
+        raise TransferError(f'unsupported export version {header.get("version")}')
+    if header.get('schema', 0) > MIGRATIONS[-1][0]:
+        raise TransferError(
+            f'exported from schema {header["schema"]}, this database is at '
+            f'{MIGRATIONS[-1][0]}; upgrade the app first'
+        )
+    return header
+
+
+class _Importer:
+    """Remaps and writes the rows of one import."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.offsets = {
+            name: conn.execute(select(func.max(table.c.id))).scalar() or 0
+            for name, table in TABLES if name in ('user', 'hashtag', 'post', 'comment')
+        }
+        # Imported ids of users/hashtags merged into existing rows
+        self.merged = {'user': {}, 'hashtag': {}}
+        self.merged_logins = []
+        self.datetime_columns = {
+            name: [c.name for c in table.columns if isinstance(c.type, db.DateTime)]
+            for name, table in TABLES
+        }
+
+    def _id(self, name, old_id):
+        if old_id is None:
+            return None
+        merged = self.merged.get(name)
+        if merged and old_id in merged:
+            return merged[old_id]
+        return old_id + self.offsets[name]
+
+    def _merge_existing(self, name, table, column, rows):
+        """Maps rows whose unique `column` already exists to the existing row and drops them."""
+        values = [row[column] for row in rows]
+        existing = dict(self.conn.execute(
+            select(getattr(table.c, column), table.c.id).where(getattr(table.c, column).in_(values))
+        ).all())
+        if not existing:
+            return rows
+        kept = []
+        for row in rows:
+            if row[column] in existing:
+                self.merged[name][row['id']] = existing[row[column]]
+                if name == 'user':
+                    self.merged_logins.append(row[column])
+            else:
+                kept.append(row)
+        return kept
+
+    def write(self, name, table, records):
+        rows = []
+        for record in records:
+            row = {c.name: record[c.name] for c in table.columns if c.name in record}
+            for column in self.datetime_columns[name]:
+                if row.get(column) is not None:
+                    row[column] = datetime.fromisoformat(row[column])
+            rows.append(row)
+
+        if name == 'user':
+            rows = self._merge_existing(name, table, 'login', rows)
+        elif name == 'hashtag':
+            rows = self._merge_existing(name, table, 'name', rows)
+
+        for row in rows:
+            if name in ('user', 'hashtag', 'post', 'comment'):
+                row['id'] = self._id(name, row['id'])
+            if name in ('post', 'comment'):
+                row['author_id'] = self._id('user', row['author_id'])
+            if name in ('post_hashtag', 'reaction', 'comment'):
+                row['post_id'] = self._id('post', row['post_id'])
+            if name == 'post_hashtag':
+                row['hashtag_id'] = self._id('hashtag', row['hashtag_id'])
+            elif name == 'reaction':
+                row['user_id'] = self._id('user', row['user_id'])
+                row.pop('id', None)
+            elif name == 'comment':
+                row['parent_id'] = self._id('comment', row.get('parent_id'))
+        if rows:
+            self.conn.execute(table.insert(), rows)
+        return len(records)
+
+
+def _secondary_indexes():
+    return [
+        index
+        for name, table in TABLES if name in BULK_TABLES
+        for index in table.indexes
+    ]
+
+
+def _drop_deferred(conn):
+    for index in _secondary_indexes():
+        index.drop(conn, checkfirst=True)
+    if fts_available():
+        for trigger in SEARCH_INSERT_TRIGGERS:
+            conn.execute(text(f'DROP TRIGGER IF EXISTS {trigger}'))
+
+
+def _restore_deferred(progress):
+    with db.engine.begin() as conn:
+        for index in _secondary_indexes():
+            index.create(conn, checkfirst=True)
+            if progress:
+                progress('index', index.name)
+    init_search()
+
+
+def _rebuild_derived(offsets):
+    """Fills post stats, hashtag counters and the search index for the imported rows."""
+    post_offset = offsets['post']
+    comment_offset = offsets['comment']
+    plus = func.sum(case((Reaction.type == 'plus', 1), else_=0))
+    minus = func.sum(case((Reaction.type == 'minus', 1), else_=0))
+    reactions = (
+        select(Reaction.post_id, plus.label('plus'), minus.label('minus'))
+        .where(Reaction.post_id > post_offset)
+        .group_by(Reaction.post_id)
+        .subquery()
+    )
+    comments = (
+        select(Comment.post_id, func.count().label('comments'))
+        .where(Comment.post_id > post_offset)
+        .group_by(Comment.post_id)
+        .subquery()
+    )
+    plus_count = func.coalesce(reactions.c.plus, 0)
+    minus_count = func.coalesce(reactions.c.minus, 0)
+    comment_count = func.coalesce(comments.c.comments, 0)
+    score = base_score(plus_count, minus_count, comment_count)
+    stats = (
+        select(Post.id, plus_count, minus_count, comment_count, score, score.label('rank_score'))
+        .outerjoin(reactions, reactions.c.post_id == Post.id)
+        .outerjoin(comments, comments.c.post_id == Post.id)
+        .where(Post.id > post_offset)
+    )
+    with db.engine.begin() as conn:
+        conn.execute(PostStats.__table__.insert().from_select(
+            ['post_id', 'plus_count', 'minus_count', 'comment_count', 'score', 'rank_score'], stats
+        ))
+        conn.execute(text(
+            'UPDATE hashtag SET post_count = '
+            '(SELECT count(*) FROM post_hashtag WHERE post_hashtag.hashtag_id = hashtag.id)'
+        ))
+        if fts_available():
+            conn.execute(text(
+                "INSERT INTO search_index (rowid, title, body, kind, ref_id, post_id)"
+                " SELECT id * 2, title, content, 'post', id, id FROM post WHERE id > :offset"
+            ), {'offset': post_offset})
+            conn.execute(text(
+                "INSERT INTO search_index (rowid, title, body, kind, ref_id, post_id)"
+                " SELECT id * 2 + 1, NULL, content, 'comment', id, post_id FROM comment WHERE id > :offset"
+            ), {'offset': comment_offset})
+        if conn.dialect.name == 'sqlite':
+            conn.execute(text('ANALYZE'))
+
+
+def import_ndjson(lines, batch_size=5000, progress=None):
+    """Loads an export from the iterable of text `lines` into the database.
+
+    `progress(table, rows, seconds)` is called after every batch and
+    `progress('index', name)` for every rebuilt index. Returns a dict of
+    table -> rows read.
+    """
+    lines = iter(lines)
+    read_header(lines)
+    order = [name for name, table in TABLES]
+    tables = dict(TABLES)
+    counts = dict.fromkeys(order, 0)
+    started = time.perf_counter()
+
+    with db.engine.begin() as conn:
+        importer = _Importer(conn)
+        _drop_deferred(conn)
+
+    try:
+        current = None
+        batch = []
+
+        def flush():
+            if not batch:
+                return
+            with db.engine.begin() as conn:
+                importer.conn = conn
+                counts[current] += importer.write(current, tables[current], batch)
+            batch.clear()
+            if progress:
+                progress(current, counts[current], time.perf_counter() - started)
+
+        for number, line in enumerate(lines, start=2):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                raise TransferError(f'line {number}: invalid JSON')
+            name = record.get('table')
+            if name not in tables:
+                raise TransferError(f'line {number}: unknown table {name!r}')
+            if name != current:
+                if current is not None and order.index(name) < order.index(current):
+                    raise TransferError(f'line {number}: {name} rows after {current} rows')
+                flush()
+                current = name
+            batch.append(record)
+            if len(batch) >= batch_size:
+                flush()
+        flush()
+    finally:
+        # Also when the import failed: the batches written so far stay
+        # and need their indexes, stats and search entries
+        _restore_deferred(progress)
+        _finish(importer)
+    return counts
+
+
+def _finish(importer):
+    """Derives everything that is not exported for the rows written by `importer`."""
+    _rebuild_derived(importer.offsets)
+    refresh_ranks(full=True)
+    # New users get their counters here, merged ones gained posts and comments
+    refresh_user_stats(list(importer.merged['user'].values()))
+    db.session.commit()
+    backfill_missing_user_stats()
+    cache.invalidate('feed', 'hashtags', *[f'profile:{login}' for login in importer.merged_logins])
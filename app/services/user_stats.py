@@ -0,0 +1,153 @@
+from sqlalchemy import case, func, select
+
+from app.extensions import db
+from app.models import Post, Comment, Reaction, User, UserStats
+
+
+def _apply_delta(user_id, posts=0, comments=0, plus=0, minus=0):
+    """Atomically shifts the counters of one user inside the current transaction.
+
+    `user_id` may be a SQL expression, e.g. the author of a post.
+    """
+    updated = (
+        UserStats.query
+        .filter(UserStats.user_id == user_id)
+        .update({
+            UserStats.post_count: UserStats.post_count + posts,
+            UserStats.comment_count: UserStats.comment_count + comments,
+            UserStats.plus_received: UserStats.plus_received + plus,
+            UserStats.minus_received: UserStats.minus_received + minus,
+        }, synchronize_session=False)
+    )
+    if not updated:
+        # User created before the stats table existed: count from scratch
+        # (the pending change is flushed first so it is included).
+        db.session.flush()
+        user_id = db.session.execute(select(User.id).where(User.id == user_id)).scalar()
+        if user_id is not None:
+            db.session.add(compute_user_stats([user_id]).get(user_id, UserStats(user_id=user_id)))
+
+
+def record_post(user_id, delta=1):
+    """Updates the counters after `user_id` created a post."""
+    _apply_delta(user_id, posts=delta)
+
+
+def record_user_comment(user_id, delta=1):
+    """Updates the counters after `user_id` wrote a comment."""
+    _apply_delta(user_id, comments=delta)
+
+
+def record_received_reactions(post_id, plus=0, minus=0):
+    """Updates the author of `post_id` after reactions to the post changed by `plus`/`minus`."""
+    author = select(Post.author_id).where(Post.id == post_id).scalar_subquery()
+    _apply_delta(author, plus=plus, minus=minus)
+
+
+def compute_user_stats(user_ids=None):
+    """Recounts user counters from the Post, Comment and Reaction tables.
+
+    Returns a dict of user_id -> transient UserStats, including users
+    without any activity.
+    """
+    posts = db.session.query(Post.author_id, func.count(Post.id)).group_by(Post.author_id)
+    comments = db.session.query(Comment.author_id, func.count(Comment.id)).group_by(Comment.author_id)
+    received = (
+        db.session.query(
+            Post.author_id,
+            func.sum(case((Reaction.type == 'plus', 1), else_=0)),
+            func.sum(case((Reaction.type == 'minus', 1), else_=0)),
+        )
+        .join(Reaction, Reaction.post_id == Post.id)
+        .group_by(Post.author_id)
+    )
+    users = db.session.query(User.id)
+
+    if user_ids is not None:
+        posts = posts.filter(Post.author_id.in_(user_ids))
+        comments = comments.filter(Comment.author_id.in_(user_ids))
+        received = received.filter(Post.author_id.in_(user_ids))
+        users = users.filter(User.id.in_(user_ids))
+
+    post_counts = dict(posts.all())
+    comment_counts = dict(comments.all())
+    received_counts = {user_id: (plus, minus) for user_id, plus, minus in received}
+
+    result = {}
+    for (user_id,) in users:
+        plus, minus = received_counts.get(user_id, (0, 0))
+        result[user_id] = UserStats(
+            user_id=user_id,
+            post_count=post_counts.get(user_id, 0),
+            comment_count=comment_counts.get(user_id, 0),
+            plus_received=plus,
+            minus_received=minus,
+        )
+    return result
+
+
+def find_user_drift():
+    """Compares stored user counters with a fresh recount.
+
+    Returns a list of `(user_id, stored, expected)` tuples where `stored`
+    is None for users that have no stats row yet.
+    """
+    expected = compute_user_stats()
+    stored = {row.user_id: row for row in UserStats.query.all()}
+
+    drift = []
+    for user_id, fresh in expected.items():
+        row = stored.get(user_id)
+        if row is None or _counters(row) != _counters(fresh):
+            drift.append((user_id, row, fresh))
+    return drift
+
+
+def rebuild_user_stats(drift=None):
+    """Rewrites the counters of every user that drifted. Returns the drift fixed."""
+    if drift is None:
+        drift = find_user_drift()
+    for user_id, row, fresh in drift:
+        if row is None:
+            db.session.add(fresh)
+        else:
+            _copy_counters(row, fresh)
+    db.session.commit()
+    return drift
+
+
+def refresh_user_stats(user_ids):
+    """Recounts the given users inside the current transaction, e.g. after a post was deleted."""
+    db.session.flush()
+    stored = {row.user_id: row for row in UserStats.query.filter(UserStats.user_id.in_(user_ids))}
+    for user_id, fresh in compute_user_stats(user_ids).items():
+        row = stored.get(user_id)
+        if row is None:
+            db.session.add(fresh)
+        else:
+            _copy_counters(row, fresh)
+
+
+def backfill_missing_user_stats():
+    """Creates stats rows for users that have none (e.g. databases created before the table)."""
+    missing = [
+        user_id for (user_id,) in
+        db.session.query(User.id).filter(~User.stats.has())
+    ]
+    if not missing:
+        return 0
+    for start in range(0, len(missing), 500):
+        db.session.add_all(compute_user_stats(missing[start:start + 500]).values())
+    db.session.commit()
+    return len(missing)
+
+
+def _copy_counters(row, fresh):
+    row.post_count = fresh.post_count
+    row.comment_count = fresh.comment_count
+    row.plus_received = fresh.plus_received
+    row.minus_received = fresh.minus_received
+
+
+def _counters(stats):
+    return (stats.post_count, stats.comment_count, stats.plus_received, stats.minus_received)
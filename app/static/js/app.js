@@ -0,0 +1,65 @@
+// Infinite scrolling for paginated listings.
+// A list with a non-empty data-next-url loads the next page from the JSON
+// API when its end scrolls into view; the "load more" link is the fallback
+// for browsers without JavaScript.
+document.addEventListener('DOMContentLoaded', () => {
+  document.querySelectorAll('[data-next-url]').forEach(list => {
+    let nextUrl = list.dataset.nextUrl;
+    if (!nextUrl || !('IntersectionObserver' in window)) return;
+
+    const fallback = list.parentElement.querySelector('.load-more');
+    if (fallback) fallback.style.display = 'none';
+
+    const sentinel = document.createElement('div');
+    list.after(sentinel);
+
+    let loading = false;
+    const observer = new IntersectionObserver(async entries => {
+      if (!entries[0].isIntersecting || loading || !nextUrl) return;
+      loading = true;
+      try {
+        const response = await fetch(nextUrl, { headers: { Accept: 'application/json' } });
+        if (!response.ok) throw new Error(response.statusText);
+        const page = await response.json();
+        list.insertAdjacentHTML('beforeend', page.html);
+        nextUrl = page.next_api_url;
+        if (fallback && page.next_page_url) fallback.href = page.next_page_url;
+      } catch (err) {
+        // Give up on infinite scrolling and let the user page manually.
+        nextUrl = null;
+        if (fallback) fallback.style.display = '';
+      } finally {
+        loading = false;
+      }
+      if (!nextUrl) observer.disconnect();
+    }, { rootMargin: '400px' });
+
+    observer.observe(sentinel);
+  });
+});
+
+// Reaction buttons post to the JSON API and update the counts in place;
+// without JavaScript (or when the API refuses) the form is submitted.
+document.addEventListener('DOMContentLoaded', () => {
+  document.querySelectorAll('.reactions form[data-api-url]').forEach(form => {
+    form.addEventListener('submit', async event => {
+      event.preventDefault();
+      const container = form.closest('.reactions');
+      try {
+        const response = await fetch(form.dataset.apiUrl, {
+          method: 'POST',
+          headers: { Accept: 'application/json' },
+        });
+        if (!response.ok) throw new Error(response.statusText);
+        const result = await response.json();
+        container.querySelectorAll('button[data-reaction]').forEach(button => {
+          const type = button.dataset.reaction;
+          button.querySelector('.reaction-count').textContent = result[type] > 0 ? result[type] : '';
+          button.disabled = type === result.your_reaction;
+        });
+      } catch (err) {
+        form.submit();
+      }
+    });
+  });
+});
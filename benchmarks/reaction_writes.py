@@ -0,0 +1,117 @@
+"""Reaction write throughput with and without the SQLite tuning layer.
+
+Several processes (like gunicorn workers) hammer POST /react on a few hot
+posts of a scratch database. The "default" run disables the pragmas, busy
+timeout and lock retries of app/database.py; the "tuned" run uses the
+configured defaults (WAL, busy_timeout, retries); the "coalesced" run also
+buffers the counter updates (REACTION_FLUSH_INTERVAL, app/services/reactions.py).
+
+    python benchmarks/reaction_writes.py --workers 4 --reactions 300
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODES = {
+    'default': {'SQLITE_TUNING': '0', 'DB_LOCK_RETRIES': '0'},
+    'tuned': {},
+    'coalesced': {'REACTION_FLUSH_INTERVAL': '0.5'},
+}
+
+
+def _load_app(env):
+    os.environ.update(env)
+    os.environ.setdefault('ADMIN_PASSWORD', 'Benchmark-Admin-1')
+    os.environ.setdefault('SECRET_KEY', 'benchmark')
+    sys.path.insert(0, ROOT)
+    from app import app
+    app.logger.disabled = True
+    return app
+
+
+def _seed(env, users, posts):
+    app = _load_app(env)
+    from app.extensions import db
+    from app.models import User, Post, PostStats
+
+    with app.app_context():
+        accounts = [User(login=f'bench{i}', password_hash='-') for i in range(users)]
+        db.session.add_all(accounts)
+        db.session.flush()
+        for i in range(posts):
+            db.session.add(Post(title=f'Hot post {i}', content='...', author_id=accounts[0].id, stats=PostStats()))
+        db.session.commit()
+        return [user.id for user in accounts], [post.id for post in Post.query.all()]
+
+
+def _worker(env, user_ids, post_ids, reactions, queue):
+    app = _load_app(env)
+    client = app.test_client()
+    ok = errors = 0
+    start = time.perf_counter()
+    for i in range(reactions):
+        with client.session_transaction() as session:
+            session['user_id'] = user_ids[i % len(user_ids)]
+        reaction = 'plus' if (i // len(user_ids)) % 2 == 0 else 'minus'
+        response = client.post(f'/react/{random.choice(post_ids)}/{reaction}')
+        if response.status_code == 302:
+            ok += 1
+        else:
+            errors += 1
+    # Child processes skip atexit handlers, so write the buffered counters here
+    from app.services.reactions import flush_reactions
+    with app.app_context():
+        flush_reactions()
+    queue.put((ok, errors, time.perf_counter() - start))
+
+
+def run(mode, workers, reactions, posts):
+    ctx = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(
+            MODES[mode],
+            DATABASE_URL='sqlite:///' + os.path.join(tmp, 'bench.db'),
+            CACHE_BACKEND='null',
+        )
+        with ctx.Pool(1) as pool:
+            user_ids, post_ids = pool.apply(_seed, (env, workers * 10, posts))
+
+        queue = ctx.Queue()
+        procs = [
+            ctx.Process(target=_worker, args=(env, user_ids[w::workers], post_ids, reactions, queue))
+            for w in range(workers)
+        ]
+        start = time.perf_counter()
+        for proc in procs:
+            proc.start()
+        results = [queue.get() for _ in procs]
+        for proc in procs:
+            proc.join()
+        elapsed = time.perf_counter() - start
+
+    ok = sum(r[0] for r in results)
+    errors = sum(r[1] for r in results)
+    return {'mode': mode, 'ok': ok, 'errors': errors, 'seconds': elapsed, 'per_second': ok / elapsed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--reactions', type=int, default=300, help='reactions per worker')
+    parser.add_argument('--posts', type=int, default=3, help='number of hot posts')
+    args = parser.parse_args()
+
+    print(f"{'mode':<10}{'ok':>8}{'errors':>8}{'seconds':>10}{'writes/s':>10}")
+    for mode in MODES:
+        r = run(mode, args.workers, args.reactions, args.posts)
+        print(f"{r['mode']:<10}{r['ok']:>8}{r['errors']:>8}{r['seconds']:>10.2f}{r['per_second']:>10.1f}")
+
+
+if __name__ == '__main__':
+    main()
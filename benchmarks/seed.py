@@ -0,0 +1,271 @@
+"""Generates a realistic forum into a scratch SQLite database.
+
+Activity follows Zipf distributions like real forums: a few users write
+most posts, comments and reactions, a few posts get most of the
+attention and a few hashtags are used on most posts. Comment threads
+grow deep because most comments reply to a recent comment of the same
+post. Counters (post_stats, user_stats, hashtag.post_count) and the stored HTML of
+bodies are written consistently, so `flask stats verify` reports no drift.
+
+All users share the password BENCH_PASSWORD. The same --seed always
+produces the same database.
+
+    python benchmarks/seed.py --db /tmp/forum.db --users 1000 --posts 20000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from bisect import bisect_left
+from datetime import datetime, timedelta
+from itertools import accumulate
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+BENCH_PASSWORD = 'Benchmark-User-1'
+
+WORDS = (
+    'forum post komentarz dyskusja pytanie odpowiedź python flask sqlite '
+    'wydajność cache indeks zapytanie serwer przeglądarka obrazek tydzień '
+    'dzisiaj wczoraj projekt problem rozwiązanie pomysł test wynik'
+).split()
+
+BATCH = 5000
+
+
+def load_app(env):
+    """Imports the app configured by `env` (the config is read at import time)."""
+    os.environ.update(env)
+    os.environ.setdefault('ADMIN_PASSWORD', 'Benchmark-Admin-1')
+    os.environ.setdefault('SECRET_KEY', 'benchmark')
+    # Bulk inserts would flood the slow query log
+    os.environ.setdefault('SLOW_QUERY_SECONDS', 'inf')
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    from app import app
+    app.logger.disabled = True
+    return app
+
+
+class Zipf:
+    """Draws ranks 0..n-1 with probability proportional to 1 / (rank + 1) ** s."""
+
+    def __init__(self, n, s=1.1):
+        self.cum_weights = list(accumulate(1 / (rank + 1) ** s for rank in range(n)))
+
+    def draw(self, rng):
+        return bisect_left(self.cum_weights, rng.random() * self.cum_weights[-1])
+
+
+def _sentence(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+
+def _insert(table, rows):
+    from app.extensions import db
+    for start in range(0, len(rows), BATCH):
+        db.session.execute(table.insert(), rows[start:start + BATCH])
+
+
+def generate(users=1000, posts=10000, hashtags=None, reactions_per_post=8,
+             comments_per_post=4, days=90, seed=1, progress=print):
+    """Fills the database of the current app context. Returns the row counts.
+
+    Expects an empty forum (only the admin account); ids follow the
+    existing rows so it also works next to it.
+    """
+    from werkzeug.security import generate_password_hash
+    from sqlalchemy import func
+    from app.extensions import db
+    from app.models import User, Post, Comment, Reaction, Hashtag, PostStats, post_hashtag
+    from app.services.markup import RENDER_VERSION, render_body
+    from app.services.ranking import refresh_ranks
+    from app.services.stats import base_score
+    from app.services.user_stats import backfill_missing_user_stats
+
+    rng = random.Random(seed)
+    hashtags = hashtags or max(20, posts // 40)
+    now = datetime.now().replace(microsecond=0)
+    first_user = (db.session.query(func.max(User.id)).scalar() or 0) + 1
+
+    # Users (one password hash for everybody: hashing dominates otherwise)
+    password_hash = generate_password_hash(BENCH_PASSWORD)
+    logins = [f'user{i}' for i in range(users)]
+    _insert(User.__table__, [
+        {
+            'id': first_user + i,
+            'login': login,
+            'password_hash': password_hash,
+            'bio': _sentence(rng, 12) if rng.random() < 0.3 else None,
+            'is_admin': False,
+        }
+        for i, login in enumerate(logins)
+    ])
+    login_set = set(logins)
+    # Rank -> user id; shuffled so activity does not follow the id order
+    user_ranks = list(range(first_user, first_user + users))
+    rng.shuffle(user_ranks)
+    user_zipf = Zipf(users)
+    progress(f'{users} users')
+
+    tag_names = [f'{rng.choice(WORDS)}{i}' for i in range(hashtags)]
+    tag_zipf = Zipf(hashtags)
+
+    # Posts, oldest first so that ids follow created_at like in production
+    offsets = sorted((rng.random() * days * 86400 for _ in range(posts)), reverse=True)
+    post_rows, tag_rows = [], []
+    tag_counts = [0] * hashtags
+    for i, offset in enumerate(offsets):
+        post_id = i + 1
+        tags = {tag_zipf.draw(rng) for _ in range(rng.choice((0, 1, 1, 2, 2, 3, 4)))}
+        mentions = [logins[user_ranks[user_zipf.draw(rng)] - first_user] for _ in range(rng.choice((0, 0, 0, 1, 2)))]
+        content = ' '.join(
+            [_sentence(rng, rng.randint(10, 60))]
+            + [f'@{login}' for login in mentions]
+            + [f'#{tag_names[tag]}' for tag in sorted(tags)]
+        )
+        post_rows.append({
+            'id': post_id,
+            'title': _sentence(rng, rng.randint(3, 8)).capitalize(),
+            'content': content,
+            'content_html': str(render_body(content, login_set)),
+            'render_version': RENDER_VERSION,
+            'author_id': user_ranks[user_zipf.draw(rng)],
+            'created_at': now - timedelta(seconds=offset),
+        })
+        for tag in tags:
+            tag_rows.append({'post_id': post_id, 'hashtag_id': tag + 1})
+            tag_counts[tag] += 1
+
+    _insert(Hashtag.__table__, [
+        {'id': i + 1, 'name': name, 'post_count': tag_counts[i]}
+        for i, name in enumerate(tag_names)
+    ])
+    _insert(Post.__table__, post_rows)
+    _insert(post_hashtag, tag_rows)
+    progress(f'{posts} posts, {hashtags} hashtags')
+
+    # Attention: rank -> post id, biased towards recent posts
+    post_ranks = sorted(range(1, posts + 1), key=lambda post_id: -post_id * rng.random())
+    post_zipf = Zipf(posts)
+    created = {row['id']: row['created_at'] for row in post_rows}
+    plus = [0] * (posts + 1)
+    minus = [0] * (posts + 1)
+    comment_count = [0] * (posts + 1)
+
+    reaction_rows = {}
+    for _ in range(posts * reactions_per_post):
+        key = (post_ranks[post_zipf.draw(rng)], user_ranks[user_zipf.draw(rng)])
+        if key not in reaction_rows:
+            reaction_rows[key] = 'plus' if rng.random() < 0.75 else 'minus'
+    for (post_id, _), kind in reaction_rows.items():
+        if kind == 'plus':
+            plus[post_id] += 1
+        else:
+            minus[post_id] += 1
+    _insert(Reaction.__table__, [
+        {'post_id': post_id, 'user_id': user_id, 'type': kind}
+        for (post_id, user_id), kind in reaction_rows.items()
+    ])
+    progress(f'{len(reaction_rows)} reactions')
+
+    # Comments: mostly replies to one of the latest comments of the post
+    comment_rows = []
+    thread = {}
+    for comment_id in range(1, posts * comments_per_post + 1):
+        post_id = post_ranks[post_zipf.draw(rng)]
+        previous = thread.setdefault(post_id, [])
+        parent_id = None
+        if previous and rng.random() < 0.7:
+            parent_id = previous[-1 - min(int(rng.expovariate(1)), len(previous) - 1)]
+        previous.append(comment_id)
+        comment_count[post_id] += 1
+        content = _sentence(rng, rng.randint(3, 30))
+        if rng.random() < 0.1:
+            content += f' @{logins[user_ranks[user_zipf.draw(rng)] - first_user]}'
+        comment_rows.append({
+            'id': comment_id,
+            'content': content,
+            'content_html': str(render_body(content, login_set)),
+            'render_version': RENDER_VERSION,
+            'created_at': created[post_id] + timedelta(minutes=len(previous)),
+            'post_id': post_id,
+            'parent_id': parent_id,
+            'author_id': user_ranks[user_zipf.draw(rng)],
+        })
+    _insert(Comment.__table__, comment_rows)
+    progress(f'{len(comment_rows)} comments')
+
+    _insert(PostStats.__table__, [
+        {
+            'post_id': post_id,
+            'plus_count': plus[post_id],
+            'minus_count': minus[post_id],
+            'comment_count': comment_count[post_id],
+            'score': base_score(plus[post_id], minus[post_id], comment_count[post_id]),
+            'rank_score': base_score(plus[post_id], minus[post_id], comment_count[post_id]),
+        }
+        for post_id in range(1, posts + 1)
+    ])
+    db.session.commit()
+    refresh_ranks(full=True)
+    backfill_missing_user_stats()
+
+    return {
+        'users': users,
+        'posts': posts,
+        'hashtags': hashtags,
+        'reactions': len(reaction_rows),
+        'comments': len(comment_rows),
+    }
+
+
+def build(path, users, posts, seed=1, progress=print, **options):
+    """Creates a new database file at `path` and seeds it (run in a fresh process)."""
+    if os.path.exists(path):
+        os.remove(path)
+    app = load_app({
+        'DATABASE_URL': 'sqlite:///' + os.path.abspath(path),
+        'CACHE_BACKEND': 'null',
+        'JOB_WORKER_THREADS': '0',
+    })
+    from sqlalchemy import text
+    from app.extensions import db
+
+    with app.app_context():
+        start = time.perf_counter()
+        counts = generate(users, posts, seed=seed, progress=progress, **options)
+        db.session.execute(text('ANALYZE'))
+        # Fold the WAL into the main file so the database can be copied
+        db.session.execute(text('PRAGMA wal_checkpoint(TRUNCATE)'))
+        db.session.commit()
+        db.engine.dispose()
+        progress(f'seeded {path} in {time.perf_counter() - start:.1f}s')
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', required=True, help='SQLite file to create (replaced if it exists)')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--posts', type=int, default=10000)
+    parser.add_argument('--hashtags', type=int, help='default: posts / 40')
+    parser.add_argument('--reactions-per-post', type=int, default=8)
+    parser.add_argument('--comments-per-post', type=int, default=4)
+    parser.add_argument('--days', type=int, default=90, help='age of the oldest post')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    counts = build(
+        args.db, args.users, args.posts, seed=args.seed,
+        hashtags=args.hashtags,
+        reactions_per_post=args.reactions_per_post,
+        comments_per_post=args.comments_per_post,
+        days=args.days,
+    )
+    print(', '.join(f'{value} {name}' for name, value in counts.items()))
+
+
+if __name__ == '__main__':
+    main()
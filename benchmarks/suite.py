@@ -0,0 +1,468 @@
+"""Latency and query counts of the main pages at several data sizes.
+
+For every size the forum is generated once by seed.py (kept in
+--data-dir and reused), copied to a scratch file and then hit with
+--requests requests per scenario, either through the Flask test client in
+a fresh process (default) or over HTTP against a local server started on
+the copy: gunicorn (sync WSGI) or uvicorn (the ASGI mode of app/asgi.py),
+optionally with --concurrency client threads and --slow-clients
+connections that keep trickling an upload to occupy the server.
+Posts, hashtags and profiles are picked with the same Zipf skew as the
+data, all requests are made by logged-in users so the page cache does not
+hide the work, and the whole run is reproducible for a given --seed.
+
+The results (p50/p95/p99 latency, throughput, SQL queries per request)
+are printed and saved as JSON. When a baseline exists they are compared
+with it and the exit status is 1 if a scenario got slower than
+--threshold or issues more queries than before.
+
+    python benchmarks/suite.py --sizes small,medium --save-baseline
+    python benchmarks/suite.py --sizes small,medium
+    python benchmarks/suite.py --server gunicorn --workers 4 --concurrency 8
+
+Compare how many concurrent connections each serving mode copes with:
+
+    python benchmarks/suite.py --server gunicorn --concurrency 16 --slow-clients 4
+    python benchmarks/suite.py --server uvicorn --concurrency 16 --slow-clients 4
+"""
+import argparse
+import contextlib
+import http.client
+import json
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import socket
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from urllib.parse import urlencode
+
+from seed import BENCH_PASSWORD, ROOT, Zipf, build, load_app
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+SIZES = {
+    'small': {'users': 200, 'posts': 2000},
+    'medium': {'users': 1000, 'posts': 20000},
+    'large': {'users': 5000, 'posts': 100000},
+}
+
+SCENARIOS = ('index', 'post_detail', 'posts_by_hashtag', 'react', 'users.profile')
+
+# Logged-in users the requests are spread over
+SESSIONS = 20
+
+
+def _env(database):
+    return {
+        'DATABASE_URL': 'sqlite:///' + database,
+        'CACHE_BACKEND': 'null',
+        'QUERY_COUNT_HEADER': '1',
+        'JOB_WORKER_THREADS': '0',
+    }
+
+
+def targets(database, limit=5000):
+    """Posts, hashtags and authors of a seeded database, most popular first."""
+    conn = sqlite3.connect(database)
+    try:
+        return {
+            'counts': {
+                table: conn.execute(f'SELECT count(*) FROM "{table}"').fetchone()[0]
+                for table in ('user', 'post', 'comment', 'reaction', 'hashtag')
+            },
+            'posts': [row[0] for row in conn.execute(
+                'SELECT post_id FROM post_stats ORDER BY score DESC, post_id DESC LIMIT ?', (limit,))],
+            'hashtags': [row[0] for row in conn.execute(
+                'SELECT name FROM hashtag ORDER BY post_count DESC, id LIMIT ?', (limit,))],
+            'authors': [row[0] for row in conn.execute(
+                'SELECT login FROM user JOIN post ON post.author_id = user.id '
+                'GROUP BY user.id ORDER BY count(*) DESC, user.id LIMIT ?', (limit,))],
+            'logins': [row[0] for row in conn.execute(
+                "SELECT login FROM user WHERE login LIKE 'user%' ORDER BY id LIMIT ?", (SESSIONS,))],
+        }
+    finally:
+        conn.close()
+
+
+def plan(scenario, targets, count, rng):
+    """The `(method, path, session)` requests of one scenario."""
+    posts = Zipf(len(targets['posts']))
+    hashtags = Zipf(len(targets['hashtags']))
+    authors = Zipf(len(targets['authors']))
+    requests = []
+    for _ in range(count):
+        session = rng.randrange(len(targets['logins']))
+        if scenario == 'index':
+            requests.append(('GET', '/', session))
+        elif scenario == 'post_detail':
+            requests.append(('GET', f"/post/{targets['posts'][posts.draw(rng)]}", session))
+        elif scenario == 'posts_by_hashtag':
+            requests.append(('GET', f"/hashtag/{targets['hashtags'][hashtags.draw(rng)]}", session))
+        elif scenario == 'react':
+            kind = rng.choice(('plus', 'minus'))
+            requests.append(('POST', f"/react/{targets['posts'][posts.draw(rng)]}/{kind}", session))
+        elif scenario == 'users.profile':
+            requests.append(('GET', f"/users/{targets['authors'][authors.draw(rng)]}", session))
+    return requests
+
+
+class TestClient:
+    """Requests through the Flask test client, one client (cookie jar) per user."""
+
+    def __init__(self, app):
+        self.app = app
+        self.clients = []
+
+    def login(self, login):
+        client = self.app.test_client()
+        response = client.post('/auth/login', data={'login': login, 'password': BENCH_PASSWORD})
+        if response.status_code != 302:
+            raise RuntimeError(f'could not log in as {login}')
+        self.clients.append(client)
+
+    def request(self, method, path, session):
+        response = self.clients[session].open(path, method=method)
+        return response.status_code, response.headers.get('X-Query-Count')
+
+
+class HttpClient:
+    """Requests over HTTP, one connection per request like a browser without keep-alive."""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.cookies = []
+
+    def _send(self, method, path, headers=None, body=None):
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=10)
+        try:
+            conn.request(method, path, body=body, headers=headers or {})
+            response = conn.getresponse()
+            response.read()
+            return response
+        finally:
+            conn.close()
+
+    def login(self, login):
+        response = self._send(
+            'POST', '/auth/login',
+            {'Content-Type': 'application/x-www-form-urlencoded'},
+            urlencode({'login': login, 'password': BENCH_PASSWORD})
+        )
+        cookie = response.getheader('Set-Cookie')
+        if response.status != 302 or not cookie:
+            raise RuntimeError(f'could not log in as {login}')
+        self.cookies.append(cookie.split(';', 1)[0])
+
+    def request(self, method, path, session):
+        response = self._send(method, path, {'Cookie': self.cookies[session]})
+        return response.status, response.getheader('X-Query-Count')
+
+
+def percentile(quantiles, p):
+    return round(quantiles[p - 1], 2)
+
+
+def run_scenario(client, requests, concurrency=1):
+    """Sends `requests` with `concurrency` threads; returns the latency and query figures."""
+    latencies, queries = [], []
+    errors = 0
+    lock = threading.Lock()
+
+    def worker(chunk):
+        nonlocal errors
+        for method, path, session in chunk:
+            start = time.perf_counter()
+            try:
+                status, query_count = client.request(method, path, session)
+            except (OSError, http.client.HTTPException):
+                with lock:
+                    errors += 1
+                continue
+            elapsed = (time.perf_counter() - start) * 1000
+            with lock:
+                latencies.append(elapsed)
+                if query_count is not None:
+                    queries.append(int(query_count))
+                if status not in (200, 302):
+                    errors += 1
+
+    start = time.perf_counter()
+    if concurrency == 1:
+        worker(requests)
+    else:
+        threads = [threading.Thread(target=worker, args=(requests[i::concurrency],)) for i in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    wall = time.perf_counter() - start
+
+    if len(latencies) < 2:
+        return {'requests': len(latencies), 'errors': errors, 'p50_ms': None, 'p95_ms': None,
+                'p99_ms': None, 'mean_ms': None, 'rps': 0, 'queries': None}
+    quantiles = statistics.quantiles(latencies, n=100, method='inclusive')
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'p50_ms': percentile(quantiles, 50),
+        'p95_ms': percentile(quantiles, 95),
+        'p99_ms': percentile(quantiles, 99),
+        'mean_ms': round(statistics.fmean(latencies), 2),
+        'rps': round(len(latencies) / wall, 1),
+        'queries': round(statistics.fmean(queries), 2) if queries else None,
+    }
+
+
+class SlowClients:
+    """Connections that send a request body a byte at a time, like uploads over a bad network."""
+
+    HEAD = (
+        b'POST /auth/login HTTP/1.1\r\nHost: benchmark\r\n'
+        b'Content-Type: application/x-www-form-urlencoded\r\nContent-Length: 20000\r\n\r\n'
+    )
+
+    def __init__(self, host, port, count, interval=0.5):
+        self.address = (host, port)
+        self.interval = interval
+        self.stop = threading.Event()
+        self.threads = [threading.Thread(target=self._trickle, daemon=True) for _ in range(count)]
+
+    def _trickle(self):
+        while not self.stop.is_set():
+            try:
+                with socket.create_connection(self.address, timeout=5) as sock:
+                    sock.sendall(self.HEAD)
+                    while not self.stop.wait(self.interval):
+                        sock.sendall(b'x')
+            except OSError:
+                # Dropped by the server (e.g. a gunicorn worker timeout); reconnect
+                self.stop.wait(self.interval)
+
+    def __enter__(self):
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop.set()
+        for thread in self.threads:
+            thread.join()
+
+
+def run_all(client, targets, options, background=None):
+    """Logs the users in and runs every scenario (while `background` is active)."""
+    for login in targets['logins']:
+        client.login(login)
+    results = {}
+    with background or contextlib.nullcontext():
+        for scenario in options['scenarios']:
+            rng = random.Random(f"{options['seed']}-{scenario}")
+            run_scenario(client, plan(scenario, targets, options['warmup'], rng), options['concurrency'])
+            results[scenario] = run_scenario(
+                client, plan(scenario, targets, options['requests'], rng), options['concurrency']
+            )
+    return results
+
+
+def _run_test_client(database, targets, options):
+    app = load_app(_env(database))
+    return run_all(TestClient(app), targets, options)
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _server_command(server, workers, port):
+    if server == 'uvicorn':
+        return [sys.executable, '-m', 'uvicorn', '--workers', str(workers), '--host', '127.0.0.1',
+                '--port', str(port), '--log-level', 'warning', 'app.asgi:asgi_app']
+    return [sys.executable, '-m', 'gunicorn', '--workers', str(workers),
+            '--bind', f'127.0.0.1:{port}', '--log-level', 'warning', 'app:app']
+
+
+def _run_server(database, targets, options):
+    port = _free_port()
+    env = dict(os.environ, **_env(database))
+    env.setdefault('ADMIN_PASSWORD', 'Benchmark-Admin-1')
+    env.setdefault('SECRET_KEY', 'benchmark')
+    server = subprocess.Popen(_server_command(options['server'], options['workers'], port), cwd=ROOT, env=env)
+    try:
+        client = HttpClient('127.0.0.1', port)
+        deadline = time.monotonic() + 60
+        while True:
+            try:
+                client._send('GET', '/auth/login')
+                break
+            except OSError:
+                if time.monotonic() > deadline or server.poll() is not None:
+                    raise RuntimeError(f"{options['server']} did not start")
+                time.sleep(0.2)
+        slow = SlowClients('127.0.0.1', port, options['slow_clients']) if options['slow_clients'] else None
+        return run_all(client, targets, options, slow)
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def run_size(name, options):
+    """Seeds (or reuses) the database of one size and benchmarks a copy of it."""
+    size = SIZES[name]
+    ctx = multiprocessing.get_context('spawn')
+    os.makedirs(options['data_dir'], exist_ok=True)
+    seeded = os.path.join(options['data_dir'], f"{name}-s{options['seed']}.db")
+    if options['reseed'] or not os.path.exists(seeded):
+        with ctx.Pool(1) as pool:
+            pool.apply(build, (seeded, size['users'], size['posts'], options['seed']))
+
+    data = targets(seeded)
+    with tempfile.TemporaryDirectory() as tmp:
+        database = os.path.join(tmp, 'bench.db')
+        shutil.copyfile(seeded, database)
+        if options['server'] in ('gunicorn', 'uvicorn'):
+            scenarios = _run_server(database, data, options)
+        else:
+            with ctx.Pool(1) as pool:
+                scenarios = pool.apply(_run_test_client, (database, data, options))
+    return {'data': data['counts'], 'scenarios': scenarios}
+
+
+def compare(results, baseline, threshold, min_delta_ms):
+    """Returns `(size, scenario, metric, before, after)` for every regression."""
+    regressions = []
+    for name, size in results['sizes'].items():
+        before_size = baseline.get('sizes', {}).get(name)
+        if not before_size:
+            continue
+        for scenario, after in size['scenarios'].items():
+            before = before_size['scenarios'].get(scenario)
+            if not before:
+                continue
+            for metric in ('p50_ms', 'p95_ms'):
+                if after[metric] is None or before[metric] is None:
+                    continue
+                if after[metric] > before[metric] * (1 + threshold) and after[metric] - before[metric] >= min_delta_ms:
+                    regressions.append((name, scenario, metric, before[metric], after[metric]))
+            if before['queries'] is not None and after['queries'] is not None and after['queries'] > before['queries'] + 0.01:
+                regressions.append((name, scenario, 'queries', before['queries'], after['queries']))
+            if after['errors'] > before['errors']:
+                regressions.append((name, scenario, 'errors', before['errors'], after['errors']))
+    return regressions
+
+
+def _git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_size(name, size):
+    counts = ', '.join(f'{value} {table}s' for table, value in size['data'].items())
+    print(f'\n{name}: {counts}')
+    print(f"{'scenario':<18}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'req/s':>9}{'queries':>9}{'errors':>8}")
+    for scenario, r in size['scenarios'].items():
+        cells = ['-' if r[key] is None else f'{r[key]:g}' for key in ('p50_ms', 'p95_ms', 'p99_ms', 'rps', 'queries')]
+        print(f"{scenario:<18}" + ''.join(f'{cell:>9}' for cell in cells) + f"{r['errors']:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default='small,medium', help=f"comma-separated, from: {', '.join(SIZES)}")
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--requests', type=int, default=300, help='measured requests per scenario')
+    parser.add_argument('--warmup', type=int, default=30, help='unmeasured requests per scenario')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--server', choices=('test-client', 'gunicorn', 'uvicorn'), default='test-client',
+                        help='uvicorn serves the ASGI mode (app/asgi.py)')
+    parser.add_argument('--workers', type=int, default=2, help='server worker processes')
+    parser.add_argument('--concurrency', type=int, default=1, help='client threads (servers only)')
+    parser.add_argument('--slow-clients', type=int, default=0,
+                        help='connections trickling an upload during the run (servers only)')
+    parser.add_argument('--data-dir', default=os.path.join(HERE, 'data'), help='seeded databases')
+    parser.add_argument('--reseed', action='store_true', help='regenerate the seeded databases')
+    parser.add_argument('--out', default=os.path.join(HERE, 'results', 'latest.json'))
+    parser.add_argument('--baseline', default=os.path.join(HERE, 'results', 'baseline.json'))
+    parser.add_argument('--save-baseline', action='store_true', help='store these results as the baseline')
+    parser.add_argument('--threshold', type=float, default=0.2, help='allowed relative latency increase')
+    parser.add_argument('--min-delta-ms', type=float, default=1.0, help='ignore smaller latency increases')
+    args = parser.parse_args()
+
+    sizes = args.sizes.split(',')
+    scenarios = args.scenarios.split(',')
+    for value, known in [(size, SIZES) for size in sizes] + [(s, SCENARIOS) for s in scenarios]:
+        if value not in known:
+            parser.error(f'unknown size or scenario: {value}')
+    if args.server == 'test-client' and (args.concurrency != 1 or args.slow_clients):
+        parser.error('--concurrency and --slow-clients need --server gunicorn or uvicorn')
+
+    options = {
+        'scenarios': scenarios,
+        'requests': args.requests,
+        'warmup': args.warmup,
+        'seed': args.seed,
+        'server': args.server,
+        'workers': args.workers,
+        'concurrency': args.concurrency,
+        'slow_clients': args.slow_clients,
+        'data_dir': args.data_dir,
+        'reseed': args.reseed,
+    }
+    results = {
+        'meta': {
+            'date': datetime.now().isoformat(timespec='seconds'),
+            'revision': _git_revision(),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'machine': platform.machine(),
+            **{key: value for key, value in options.items() if key not in ('data_dir', 'reseed')},
+        },
+        'sizes': {},
+    }
+    for name in sizes:
+        results['sizes'][name] = run_size(name, options)
+        print_size(name, results['sizes'][name])
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+    with open(args.out, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f'\nresults written to {args.out}')
+
+    if args.save_baseline:
+        shutil.copyfile(args.out, args.baseline)
+        print(f'baseline saved to {args.baseline}')
+        return
+
+    if not os.path.exists(args.baseline):
+        return
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    setup = ('server', 'workers', 'concurrency', 'slow_clients', 'seed')
+    if any(baseline['meta'].get(key) != results['meta'][key] for key in setup):
+        print(f'not comparing with {args.baseline}: it was made with a different {"/".join(setup)}')
+        return
+    regressions = compare(results, baseline, args.threshold, args.min_delta_ms)
+    print(f"compared with {args.baseline} ({baseline['meta'].get('revision')}, {baseline['meta']['date']})")
+    for name, scenario, metric, before, after in regressions:
+        print(f'  REGRESSION {name} {scenario} {metric}: {before} -> {after}')
+    if regressions:
+        sys.exit(1)
+    print('  no regressions')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+"""Test fixtures: the app on a scratch SQLite database seeded like the benchmarks.
+
+The config is read when `app` is imported, so the environment has to be
+set before any test module imports it; `load_app` from benchmarks/seed.py
+does that.
+
+    python -m pytest -q
+"""
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+from seed import generate, load_app  # noqa: E402
+
+_tmp = tempfile.mkdtemp(prefix='forum-tests-')
+app = load_app({
+    'DATABASE_URL': 'sqlite:///' + os.path.join(_tmp, 'forum.db'),
+    'CACHE_BACKEND': 'null',
+    'JOB_WORKER_THREADS': '0',
+    'RANK_REFRESH_INTERVAL': '0',
+    'STATIC_COMPRESS_ON_START': '0',
+})
+
+
+@pytest.fixture(scope='session')
+def seeded_app():
+    """The app with a small Zipf-distributed forum, ANALYZEd like `benchmarks/seed.py` leaves it."""
+    from sqlalchemy import text
+    from app.extensions import db
+
+    with app.app_context():
+        generate(users=100, posts=1500, progress=lambda message: None)
+        db.session.execute(text('ANALYZE'))
+        db.session.commit()
+    yield app
+    with app.app_context():
+        db.engine.dispose()
+    shutil.rmtree(_tmp, ignore_errors=True)
+
+
+@pytest.fixture
+def app_context(seeded_app):
+    with seeded_app.app_context():
+        yield seeded_app
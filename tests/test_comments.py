@@ -0,0 +1,48 @@
+"""Comment trees are cut at COMMENT_REPLIES_SHOWN and COMMENT_MAX_DEPTH in SQL."""
+import pytest
+
+from app.extensions import db
+from app.models import Comment, Post
+from app.services.comments import build_comment_tree
+
+
+@pytest.fixture
+def thread(app_context):
+    """A top-level comment with three replies, the first of which has a reply. Rolled back afterwards."""
+    post = Post.query.first()
+
+    def add(parent=None):
+        comment = Comment(content='Wątek', post_id=post.id, author_id=post.author_id,
+                          parent_id=parent.id if parent else None)
+        db.session.add(comment)
+        db.session.flush()
+        return comment
+
+    root = add()
+    replies = [add(root) for _ in range(3)]
+    nested = add(replies[0])
+    yield root, replies, nested
+    db.session.rollback()
+
+
+def test_replies_cut_in_query(thread):
+    root, replies, nested = thread
+    [node] = build_comment_tree([root.id], max_depth=1, replies_shown=2)
+    assert [reply.comment.id for reply in node.replies] == [replies[0].id, replies[1].id]
+    assert node.more_replies == 1
+    assert node.replies[0].deeper_replies == 1
+    assert node.replies[0].replies == []
+
+    [node] = build_comment_tree([root.id], max_depth=1, replies_shown=2, all_root_replies=True)
+    assert len(node.replies) == 3
+    assert node.more_replies == 0
+
+
+def test_reply_with_lower_id_than_its_parent(thread):
+    root, replies, nested = thread
+    # e.g. comments moved between threads
+    replies[1].parent_id = nested.id
+    db.session.flush()
+    [node] = build_comment_tree([root.id], max_depth=6, replies_shown=10)
+    [moved] = node.replies[0].replies[0].replies
+    assert moved.comment.id == replies[1].id
@@ -0,0 +1,31 @@
+"""Login attempts are limited per client IP, also behind a reverse proxy."""
+import pytest
+
+from app.extensions import cache
+from app.services.auth import init_proxies
+from app.services.cache import LRUBackend
+
+
+@pytest.fixture
+def proxied_app(seeded_app, monkeypatch):
+    monkeypatch.setattr(cache, 'backend', LRUBackend())
+    monkeypatch.setitem(seeded_app.config, 'LOGIN_ATTEMPTS_PER_IP', 1)
+    monkeypatch.setitem(seeded_app.config, 'TRUSTED_PROXIES', 1)
+    monkeypatch.setattr(seeded_app, 'wsgi_app', seeded_app.wsgi_app)
+    init_proxies(seeded_app)
+    return seeded_app
+
+
+def attempt(app, client_ip, login):
+    return app.test_client().post(
+        '/auth/login',
+        data={'login': login, 'password': 'Niepoprawne1'},
+        headers={'X-Forwarded-For': client_ip},
+    ).status_code
+
+
+def test_attempts_counted_per_forwarded_ip(proxied_app):
+    assert attempt(proxied_app, '203.0.113.1', 'nobody1') == 200
+    assert attempt(proxied_app, '203.0.113.1', 'nobody2') == 429
+    # Another client behind the same proxy has its own budget
+    assert attempt(proxied_app, '203.0.113.2', 'nobody3') == 200
@@ -0,0 +1,53 @@
+"""Cached profile pages follow the posts and comments they list."""
+import pytest
+from sqlalchemy import func
+
+from app.extensions import cache, db
+from app.models import Comment, Post, User
+from app.services.cache import LRUBackend
+
+
+@pytest.fixture
+def caching_app(seeded_app, monkeypatch):
+    monkeypatch.setattr(cache, 'backend', LRUBackend())
+    return seeded_app
+
+
+def client(app, login):
+    c = app.test_client()
+    with app.app_context():
+        user_id = User.query.filter_by(login=login).one().id
+    with c.session_transaction() as session:
+        session.update(user_id=user_id, user_login=login, is_admin=False, identity_at=0)
+    return c
+
+
+def comment_count(app, login):
+    with app.app_context():
+        return User.query.filter_by(login=login).one().stats.comment_count
+
+
+def test_deleting_a_post_refreshes_commenter_profiles(caching_app):
+    client(caching_app, 'user1').post('/', data={'title': 'Do usunięcia', 'content': 'Wkrótce zniknie'})
+    with caching_app.app_context():
+        post_id = db.session.query(func.max(Post.id)).scalar()
+    client(caching_app, 'user2').post(f'/post/{post_id}', data={'content': 'Komentarz do usunięcia'})
+    with caching_app.app_context():
+        comment_id = db.session.query(func.max(Comment.id)).scalar()
+    comment_link = f'/post/{post_id}/comment/{comment_id}'.encode()
+    comments_before = comment_count(caching_app, 'user2')
+
+    visitor = caching_app.test_client()
+    visitor.get('/users/user2')
+    cached = visitor.get('/users/user2')
+    assert cached.headers['X-Cache'] == 'HIT'
+    assert comment_link in cached.data
+
+    response = client(caching_app, 'admin').post(f'/delete/{post_id}')
+    assert response.status_code == 302
+
+    profile = visitor.get('/users/user2')
+    assert profile.headers['X-Cache'] == 'MISS'
+    assert comment_link not in profile.data
+    assert comment_count(caching_app, 'user2') == comments_before - 1
+    assert f'<strong>{comments_before - 1}</strong> komentarzy'.encode() in profile.data
@@ -0,0 +1,103 @@
+"""Every page stays within its QUERY_BUDGETS entry on the seeded forum.
+
+Requests are made as a logged-in user whose session identity is due for a
+refresh, the most expensive case. Budgets are enforced in testing mode,
+so a request over budget raises QueryBudgetExceeded.
+"""
+import io
+
+import pytest
+from PIL import Image
+from sqlalchemy import func
+
+from app.extensions import db
+from app.models import Comment, Hashtag, Post, User
+
+
+@pytest.fixture
+def enforcing_app(seeded_app, monkeypatch, tmp_path):
+    monkeypatch.setattr(seeded_app, 'testing', True)
+    # Uploaded images go to a scratch folder
+    monkeypatch.setattr(seeded_app, 'static_folder', str(tmp_path))
+    return seeded_app
+
+
+@pytest.fixture
+def forum(enforcing_app):
+    """Ids and names of the busiest rows of the seeded forum."""
+    with enforcing_app.app_context():
+        busy_post = (
+            db.session.query(Comment.post_id)
+            .group_by(Comment.post_id)
+            .order_by(func.count().desc())
+            .first()[0]
+        )
+        reply = (
+            Comment.query
+            .filter(Comment.post_id == busy_post, Comment.parent_id.isnot(None))
+            .order_by(Comment.id.desc())
+            .first()
+        )
+        author = db.session.get(User, (
+            db.session.query(Post.author_id)
+            .group_by(Post.author_id)
+            .order_by(func.count().desc())
+            .first()[0]
+        ))
+        return {
+            'post': busy_post,
+            'comment': reply.parent_id,
+            'tag': Hashtag.query.order_by(Hashtag.post_count.desc()).first().name,
+            'author': author.login,
+            'user': (author.id, author.login),
+        }
+
+
+def client(app, forum):
+    c = app.test_client()
+    user_id, login = forum['user']
+    with c.session_transaction() as session:
+        session.update(user_id=user_id, user_login=login, is_admin=False, identity_at=0)
+    return c
+
+
+def png():
+    image = io.BytesIO()
+    Image.new('RGB', (32, 32), 'red').save(image, 'PNG')
+    image.seek(0)
+    return image
+
+
+@pytest.mark.parametrize('url', [
+    '/',
+    '/api/posts',
+    '/post/{post}',
+    '/post/{post}/comment/{comment}',
+    '/hashtag/{tag}',
+    '/api/posts?tag={tag}',
+    '/api/posts?author={author}',
+    '/users/{author}',
+    '/users/{author}/activity',
+    '/search?q=python',
+    '/api/search?q=python',
+])
+def test_pages_within_budget(enforcing_app, forum, url):
+    response = client(enforcing_app, forum).get(url.format(**forum))
+    assert response.status_code == 200
+
+
+def test_create_post_within_budget(enforcing_app, forum):
+    response = client(enforcing_app, forum).post('/', data={
+        'title': 'Budżet #budzet #zapytania',
+        'content': f'Z obrazkiem #{forum["tag"]} @{forum["author"]} @user1',
+        'image': (png(), 'obrazek.png'),
+    }, content_type='multipart/form-data')
+    assert response.status_code == 302
+
+
+def test_comment_within_budget(enforcing_app, forum):
+    response = client(enforcing_app, forum).post(f'/post/{forum["post"]}', data={
+        'content': f'Odpowiedź @{forum["author"]} @user1',
+        'parent_id': forum['comment'],
+    })
+    assert response.status_code == 302
@@ -0,0 +1,30 @@
+"""The stats endpoints are only served to admins unless STATS_PUBLIC is set."""
+import pytest
+
+from app.models import User
+
+STATS_URLS = ['/metrics', '/cache/stats', '/jobs/stats']
+
+
+def client(app, login=None):
+    c = app.test_client()
+    if login:
+        with app.app_context():
+            user = User.query.filter_by(login=login).one()
+            user_id, is_admin = user.id, user.is_admin
+        with c.session_transaction() as session:
+            session.update(user_id=user_id, user_login=login, is_admin=is_admin, identity_at=0)
+    return c
+
+
+@pytest.mark.parametrize('url', STATS_URLS)
+def test_admin_only(seeded_app, url):
+    assert client(seeded_app).get(url).status_code == 403
+    assert client(seeded_app, 'user1').get(url).status_code == 403
+    assert client(seeded_app, 'admin').get(url).status_code == 200
+
+
+@pytest.mark.parametrize('url', STATS_URLS)
+def test_public_when_configured(seeded_app, monkeypatch, url):
+    monkeypatch.setitem(seeded_app.config, 'STATS_PUBLIC', True)
+    assert client(seeded_app).get(url).status_code == 200